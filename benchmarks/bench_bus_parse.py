@@ -0,0 +1,82 @@
+"""
+バス接近情報のパース速度・メモリ使用量のベンチマーク。
+
+BUS NAVIの応答を模した複数バス停分のJSONを、
+通常のパース（BusLocationResponse.model_validate_json）と高速なパース（parse_bus_response）で比較する。
+
+    python benchmarks/bench_bus_parse.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from keihan_tracker.bus.schemes import BusLocationResponse, parse_bus_response
+
+STOPS = 15           # バス停数
+BUSES_PER_STOP = 12  # 1バス停あたりの接近バス数
+
+def make_response(stop_index: int, rnd: random.Random) -> str:
+    """1バス停分の応答。html/html_spは実際の応答と同程度の大きさにする。"""
+    busstates = []
+    for order in range(1, BUSES_PER_STOP + 1):
+        lat = 34.75 + rnd.random() * 0.1
+        lon = 135.60 + rnd.random() * 0.1
+        route = f"[{rnd.randint(1, 40)}]"
+        hour, minute = rnd.randint(6, 23), rnd.randint(0, 59)
+        prms = (
+            f"{order}:{lat:.6f}:{lon:.6f}:{rnd.randint(0, 359)}:{rnd.getrandbits(64):016x}:"
+            f"{1000 + stop_index}:{rnd.randint(1, 4)}:{route}:京阪香里園:成田山経由:接近中:"
+            f"{hour:02}__________{minute:02} 到着予定"
+        )
+        html = (
+            f'<div class="busstate"><span class="route">{route}</span>'
+            f'<span class="dest">京阪香里園行き</span>' + '<span class="pad"></span>' * 40 + "</div>"
+        )
+        busstates.append({"html": html, "html_sp": html.replace("busstate", "busstate_sp"), "busstateprms": prms})
+    return json.dumps({
+        "head": {"errorcode": 0, "objid": f"{stop_index}"},
+        "body": {"datetimeStr": "2026/10/19 08:12:00", "busstates": busstates},
+    }, ensure_ascii=False)
+
+def measure(func, texts: list[str], repeat: int = 20) -> tuple[float, int]:
+    """1回あたりの処理時間（秒、最良値）と、結果を保持したときのメモリ（バイト）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    results = [func(text) for text in texts]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return best, retained
+
+def run() -> dict[str, float]:
+    rnd = random.Random(0)
+    texts = [make_response(i, rnd) for i in range(STOPS)]
+    full_time, full_mem = measure(BusLocationResponse.model_validate_json, texts)
+    lean_time, lean_mem = measure(parse_bus_response, texts)
+    return {
+        "bus_parse.full.seconds": full_time,
+        "bus_parse.lean.seconds": lean_time,
+        "bus_parse.full.bytes": full_mem,
+        "bus_parse.lean.bytes": lean_mem,
+    }
+
+if __name__ == "__main__":
+    r = run()
+    buses = STOPS * BUSES_PER_STOP
+    print(f"{STOPS}停留所 x {BUSES_PER_STOP}台 = {buses}台")
+    print(f"通常: {r['bus_parse.full.seconds'] * 1e3:8.3f} ms  {r['bus_parse.full.bytes'] / 1024:8.1f} KiB")
+    print(f"高速: {r['bus_parse.lean.seconds'] * 1e3:8.3f} ms  {r['bus_parse.lean.bytes'] / 1024:8.1f} KiB")
+    print(f"速度 {r['bus_parse.full.seconds'] / r['bus_parse.lean.seconds']:.1f}倍 / "
+          f"メモリ {r['bus_parse.lean.bytes'] / r['bus_parse.full.bytes'] * 100:.0f}%")
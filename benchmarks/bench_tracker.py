@@ -0,0 +1,186 @@
+"""
+KHTrackerの主な処理のベンチマーク。
+
+synthetic.SyntheticDay の合成データを httpx.MockTransport で返し、時間帯と本数の違う場面ごとに
+初回取得（cold start）・fetch_posの更新・regist_dia・find_trains・全駅のupcoming_trains・
+check_stops_gui.build_tracker_data（fetch_tracker_dataのうちfetch_pos以外の部分）の処理時間を測る。
+check_stops_guiはFastAPIとuvicornがインストールされている場合のみ測る。
+
+    python benchmarks/bench_tracker.py
+    python benchmarks/bench_tracker.py rush_x3
+"""
+
+from typing import Callable, Awaitable, Any, Optional
+import asyncio
+import datetime
+import importlib.util
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from keihan_tracker.keihan_train.tracker import KHTracker, DEFAULT_URLS
+from synthetic import SyntheticDay, JST
+
+# 場面名:(時刻, 本数の倍率)
+SCENARIOS = {
+    "offpeak": (datetime.time(11, 0), 1.0),
+    "rush": (datetime.time(8, 0), 1.0),
+    "rush_x3": (datetime.time(8, 0), 3.0),
+}
+REPEAT = 5             # 各処理の測定回数（最良値を使う）
+STEP = datetime.timedelta(minutes=1)   # fetch_posごとに進める時刻
+
+
+class SyntheticSource:
+    """SyntheticDayのデータを now の時点のAPIの応答として返す"""
+    def __init__(self, day: SyntheticDay, now: datetime.datetime) -> None:
+        self.day = day
+        self.now = now
+        self._endpoints = {url: endpoint for endpoint, url in DEFAULT_URLS.items()}
+        self._static = {
+            "select_station": day.select_station(),
+            "transfer_guide_info": day.transfer_guide_info(),
+            "start_time_list": day.start_time_list(now),
+        }
+        self._positions: dict[datetime.datetime, str] = {}
+
+    def positions(self, now: datetime.datetime) -> str:
+        text = self._positions.get(now)
+        if text is None:
+            text = self._positions[now] = self.day.train_position_list(now)
+        return text
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        endpoint = self._endpoints.get(str(request.url))
+        if endpoint == "train_position_list":
+            return httpx.Response(200, text=self.positions(self.now))
+        if endpoint in self._static:
+            return httpx.Response(200, text=self._static[endpoint])
+        return httpx.Response(404)
+
+    def tracker(self) -> KHTracker:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+        return KHTracker(rate_limit=0, serve_stale=False, client=client, clock=lambda: self.now)
+
+
+def _best(repeat: int, func: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def _best_async(repeat: int, func: Callable[[], Awaitable[Any]]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def run_scenario(name: str, repeat: int = REPEAT) -> dict[str, float]:
+    at, scale = SCENARIOS[name]
+    day = SyntheticDay(scale=scale)
+    source = SyntheticSource(day, datetime.datetime.combine(day.date, at, JST))
+    origin = source.now
+    prefix = f"tracker.{name}"
+    result: dict[str, float] = {}
+
+    # 初回取得: 駅・乗り換え・列車位置・ダイヤをすべて取得してパースする
+    trackers: list[KHTracker] = []
+
+    async def cold_start() -> None:
+        tracker = source.tracker()
+        await tracker.fetch_pos()
+        trackers.append(tracker)
+
+    result[f"{prefix}.cold_start.seconds"] = await _best_async(repeat, cold_start)
+    tracker = trackers[-1]
+    for old in trackers[:-1]:
+        await old.web.aclose()
+
+    # 1分ごとの更新: 前回から列車が動いた列車位置を反映する（ダイヤは再取得しない）
+    positions = [origin + STEP * (i + 1) for i in range(repeat)]
+    for now in positions:
+        source.positions(now)   # 合成データの生成は測定に含めない
+
+    async def reconcile() -> None:
+        source.now = positions.pop(0)
+        await tracker.fetch_pos()
+
+    result[f"{prefix}.fetch_pos.seconds"] = await _best_async(repeat, reconcile)
+    result[f"{prefix}.regist_dia.seconds"] = await _best_async(repeat, lambda: tracker.regist_dia(True))
+
+    stations = list(tracker.stations.values())
+    kyoto = tracker.stations[40]
+
+    def find_trains() -> None:
+        tracker.find_trains(status="active")
+        tracker.find_trains(status="scheduled", direction="up")
+        tracker.find_trains(next_stop_station=kyoto)
+
+    result[f"{prefix}.find_trains.seconds"] = _best(repeat, find_trains)
+
+    def upcoming_trains() -> None:
+        for station in stations:
+            station.upcoming_trains
+
+    result[f"{prefix}.upcoming_trains.seconds"] = _best(max(1, repeat // 2), upcoming_trains)
+
+    gui = _gui()
+    if gui is not None:
+        def build_tracker_data() -> None:
+            tracker._boards = None   # 発車標のキャッシュを使わず、fetch_pos直後と同じ状態から作る
+            tracker._eta = None
+            gui.build_tracker_data(tracker)
+
+        result[f"{prefix}.build_tracker_data.seconds"] = _best(repeat, build_tracker_data)
+
+    # 保持しているデータの量（memory_reportの概算）
+    report = tracker.memory_report()
+    result[f"{prefix}.memory.bytes"] = report.total_bytes
+    for name in ("route_stations", "starttime_list", "departure_boards"):
+        result[f"{prefix}.memory.{name}.bytes"] = report[name].bytes
+    result[f"{prefix}.trains"] = len(tracker.trains)
+    result[f"{prefix}.active_trains"] = len(tracker.active_trains)
+    result[f"{prefix}.position_list.bytes"] = len(source.positions(source.now).encode())
+    result[f"{prefix}.start_time_list.bytes"] = len(source._static["start_time_list"].encode())
+    await tracker.web.aclose()
+    return result
+
+
+def _gui() -> Optional[Any]:
+    """check_stops_guiモジュール。FastAPIがなければsys.exitするため、先に確認する"""
+    if importlib.util.find_spec("fastapi") is None or importlib.util.find_spec("uvicorn") is None:
+        return None
+    import check_stops_gui
+    return check_stops_gui
+
+
+def run(scenarios: Optional[list[str]] = None, repeat: int = REPEAT) -> dict[str, float]:
+    result: dict[str, float] = {}
+    for name in scenarios or list(SCENARIOS):
+        result.update(asyncio.run(run_scenario(name, repeat)))
+    return result
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(SCENARIOS)
+    r = run(names)
+    for name in names:
+        prefix = f"tracker.{name}"
+        print(f"{name}: 列車 {r[f'{prefix}.trains']:.0f}本（走行中 {r[f'{prefix}.active_trains']:.0f}本）"
+              f"  startTimeList {r[f'{prefix}.start_time_list.bytes'] / 1024:.0f} KiB"
+              f"  trainPositionList {r[f'{prefix}.position_list.bytes'] / 1024:.0f} KiB"
+              f"  保持データ {r[f'{prefix}.memory.bytes'] / 1024 ** 2:.1f} MiB")
+        for key, value in r.items():
+            if key.startswith(prefix + ".") and key.endswith(".seconds"):
+                label = key[len(prefix) + 1:-len(".seconds")]
+                print(f"  {label:20} {value * 1e3:10.3f} ms")
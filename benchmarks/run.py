@@ -0,0 +1,81 @@
+"""
+すべてのベンチマークを実行し、結果をJSON（測定項目名:値）で出力する。
+
+--compare に以前の結果のJSONを指定すると、処理時間（.seconds）とメモリ（.bytes）を比べ、
+--threshold 倍より遅く・大きくなった項目があれば終了コード1で終了する。
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --compare baseline.json
+    python benchmarks/run.py --only tracker --scenario rush_x3
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import bench_bus_parse
+import bench_tracker
+
+SUITES = ["bus_parse", "tracker"]
+
+
+def compare(result: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """thresholdを超えて悪化した項目名のリスト。比べた項目は表にして表示する"""
+    regressions = []
+    for key, value in result.items():
+        old = baseline.get(key)
+        if not isinstance(old, (int, float)) or not key.endswith((".seconds", ".bytes")):
+            continue
+        ratio = value / old if old else float("inf")
+        mark = ""
+        if ratio > threshold:
+            mark = "  << 悪化"
+            regressions.append(key)
+        elif ratio < 1 / threshold:
+            mark = "  改善"
+        print(f"{key:48} {old:14.6g} -> {value:14.6g}  x{ratio:5.2f}{mark}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=SUITES, action="append", help="実行するベンチマーク（複数指定可）")
+    parser.add_argument("--scenario", choices=list(bench_tracker.SCENARIOS), action="append",
+                        help="trackerのベンチマークで測る場面（複数指定可）")
+    parser.add_argument("--repeat", type=int, default=bench_tracker.REPEAT, help="trackerの各処理の測定回数")
+    parser.add_argument("--output", help="結果のJSONを書き込むファイル（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較する以前の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=1.2, help="悪化とみなす比率")
+    args = parser.parse_args(argv)
+
+    suites = args.only or SUITES
+    result: dict[str, float] = {}
+    if "bus_parse" in suites:
+        result.update(bench_bus_parse.run())
+    if "tracker" in suites:
+        result.update(bench_tracker.run(args.scenario, args.repeat))
+    result["python"] = platform.python_version()   # type: ignore[assignment]
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}項目が{args.threshold}倍を超えて悪化しました", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+ベンチマーク用の合成データ。
+
+京阪の4路線（本線・鴨東線、中之島線、宇治線、交野線）に1日分のダイヤを作り、
+select_station・transferGuideInfo・startTimeList・trainPositionList と同じ形のJSONを返す。
+列車の位置は時刻表と列車ごとの遅延から計算し、座標は position_calculation.calc_position で解釈できる値にする。
+
+- scale: 運転本数の倍率。1.0でおよそ実際の本数（1日約1,000本）、ラッシュ時はさらに約1.6倍になる
+- seed: 遅延などの乱数の種。同じ値なら同じデータになる
+
+    day = SyntheticDay(scale=2.0)
+    text = day.train_position_list(datetime.datetime(2026, 10, 19, 8, 0, tzinfo=JST))
+"""
+
+from typing import Optional
+import bisect
+import datetime
+import json
+import os
+import random
+import sys
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from keihan_tracker.keihan_train.stations_map import HONNSEN_UP, NAKANOSHIMA_UP, UJI_UP, KATANO_UP
+
+JST = ZoneInfo("Asia/Tokyo")
+
+LINES = {
+    "京阪本線・鴨東線": HONNSEN_UP,
+    "中之島線": NAKANOSHIMA_UP,
+    "宇治線": UJI_UP,
+    "交野線": KATANO_UP,
+}
+# select_station上の路線ごとの駅（中之島線の列車は京橋以東では本線の駅を走る）
+LINE_STATIONS = {
+    "京阪本線・鴨東線": HONNSEN_UP,
+    "中之島線": [3, 51, 52, 53, 54],
+    "宇治線": UJI_UP,
+    "交野線": KATANO_UP,
+}
+# 1時間・片方向あたりの本数（scale=1.0、日中）
+BASE_TPH = {"京阪本線・鴨東線": 12, "中之島線": 4, "宇治線": 6, "交野線": 4}
+# 時間帯ごとの本数の倍率
+HOUR_FACTOR = {5: 0.5, 6: 1.0, 7: 1.6, 8: 1.6, 17: 1.4, 18: 1.6, 19: 1.2, 22: 0.8, 23: 0.5}
+# 本線・中之島線の種別の順番と停車駅（Noneは全駅停車）
+TYPE_CYCLE = ["普通", "急行", "普通", "特急", "普通", "準急"]
+LTD_EXP_STOPS = {1, 2, 3, 4, 21, 24, 28, 36, 37, 38, 39, 40, 41, 42, 51, 52, 53, 54}
+STOP_PATTERNS: dict[str, Optional[set[int]]] = {
+    "普通": None,
+    "準急": LTD_EXP_STOPS | set(range(13, 43)) | {10},
+    "急行": LTD_EXP_STOPS | {10, 13, 17, 19, 26, 31, 33},
+    "特急": LTD_EXP_STOPS,
+}
+TYPE_EN = {"普通": "Local", "準急": "Sub. Exp.", "急行": "Express", "特急": "Ltd. Exp."}
+
+RUN_SECONDS = 120     # 停車駅間1区間の走行時間
+PASS_SECONDS = 90     # 通過する区間の走行時間
+DWELL_SECONDS = 30    # 停車時間
+BOARDING_SECONDS = 180   # 始発駅で発車前から在線している時間
+
+
+def _ml(text: str) -> dict[str, str]:
+    return {"ja": text, "en": f"{text} (en)", "cn": f"{text}站", "tw": f"{text}站", "kr": f"{text} 역"}
+
+
+def _ml_list(text: str) -> dict[str, list[str]]:
+    return {key: [value] for key, value in _ml(text).items()}
+
+
+def _station_name(number: int) -> str:
+    return f"駅{number:02}"
+
+
+def _location(line: str, direction: str, a: int, b: Optional[int]) -> tuple[int, int]:
+    """
+    停車中（b=None）または a→b 間を走行中の列車の座標（col, row）。
+    calc_positionの逆。駅間に座標のない区間（淀屋橋〜天満橋・中之島線内）は発車した駅に停車中とする。
+    """
+    col = 3 if direction == "up" else 4
+    if line == "宇治線" or line == "交野線":
+        origin, first, last, base = (28, 71, 77, 132) if line == "宇治線" else (21, 61, 67, 154)
+
+        def stopped(s: int) -> int:
+            if s == origin:
+                return base
+            if s == last:
+                return base + 21
+            return base + 3 + 3 * (s - first)
+
+        if b is None:
+            return col, stopped(a)
+        low = a if (a == origin or (b != origin and a < b)) else b
+        return col, stopped(low) + (2 if low == origin else 1)
+
+    naka_rows = {3: 118, 51: 121, 52: 124, 53: 127, 54: 130}
+    main_rows = {3: 118, 2: 121, 1: 124}
+
+    def stopped(s: int) -> tuple[int, int]:
+        if line == "中之島線" and s in naka_rows:
+            return (1 if direction == "up" else 2), naka_rows[s]
+        if s in main_rows:
+            return col, main_rows[s]
+        return col, (42 - s) * 3 + 1
+
+    if b is None or min(a, b) < 4 or max(a, b) > 42:
+        return stopped(a)
+    # 本線の通常区間: 2駅のうち大きい駅番号のブロックの3行目が走行中
+    return col, (42 - max(a, b)) * 3 + 3
+
+
+class SyntheticTrain:
+    __slots__ = ("wdf", "line", "direction", "train_type", "route", "stops", "arrivals", "departures", "delay", "cars")
+
+    def __init__(self, wdf: int, line: str, direction: str, train_type: str, route: list[int],
+                 start: datetime.datetime, delay: int, cars: int) -> None:
+        self.wdf = wdf
+        self.line = line
+        self.direction = direction
+        self.train_type = train_type
+        self.route = route
+        self.delay = delay
+        self.cars = cars
+        pattern = STOP_PATTERNS.get(train_type)
+        self.stops = [
+            i == 0 or i == len(route) - 1 or pattern is None or station in pattern
+            for i, station in enumerate(route)
+            ]
+        # 駅ごとの到着・発車時刻（UNIX時間）。通過駅は到着=発車
+        self.arrivals: list[float] = []
+        self.departures: list[float] = []
+        t = start.timestamp()
+        for i in range(len(route)):
+            if i > 0:
+                t += RUN_SECONDS if self.stops[i] else PASS_SECONDS
+            self.arrivals.append(t)
+            if self.stops[i] and 0 < i < len(route) - 1:
+                t += DWELL_SECONDS
+            self.departures.append(t)
+
+    def location(self, now: float) -> Optional[tuple[int, Optional[int]]]:
+        """nowに停車中の駅（駅, None）または走行中の区間（駅, 次の駅）。運行していなければNone"""
+        t = now - self.delay * 60
+        if t < self.departures[0] - BOARDING_SECONDS or t >= self.arrivals[-1]:
+            return None
+        i = bisect.bisect_right(self.departures, t)
+        if i == 0:
+            return self.route[0], None
+        # departures[i-1] <= t < departures[i]: 駅iに停車中か、駅i-1から駅iへ走行中
+        if t >= self.arrivals[i]:
+            return self.route[i], None
+        return self.route[i - 1], self.route[i]
+
+
+class SyntheticDay:
+    """1日分の合成ダイヤ"""
+    def __init__(self, scale: float = 1.0, seed: int = 0, date: Optional[datetime.date] = None) -> None:
+        self.scale = scale
+        self.date = date or datetime.date(2026, 10, 19)
+        rnd = random.Random(seed)
+        self.trains: list[SyntheticTrain] = []
+        wdf = 1000
+        midnight = datetime.datetime.combine(self.date, datetime.time.min, JST)
+        for line, up in LINES.items():
+            for direction in ("up", "down"):
+                route = up if direction == "up" else list(reversed(up))
+                count = 0
+                for hour in range(5, 24):
+                    tph = BASE_TPH[line] * HOUR_FACTOR.get(hour, 1.0) * scale
+                    n = max(1, round(tph))
+                    for k in range(n):
+                        start = midnight + datetime.timedelta(hours=hour, seconds=3600 * k / n)
+                        if line in ("京阪本線・鴨東線", "中之島線"):
+                            train_type = TYPE_CYCLE[count % len(TYPE_CYCLE)]
+                            cars = 8 if train_type == "特急" else 7
+                        else:
+                            train_type, cars = "普通", 4 if line == "宇治線" else 5
+                        # ラッシュ時は遅れやすい
+                        weights = [70, 10, 8, 6, 4, 2] if HOUR_FACTOR.get(hour, 1.0) >= 1.4 else [88, 6, 3, 2, 1, 0]
+                        delay = rnd.choices([0, 1, 2, 3, 5, 10], weights)[0]
+                        self.trains.append(SyntheticTrain(wdf, line, direction, train_type, route, start, delay, cars))
+                        wdf += 1
+                        count += 1
+
+    # --- 不変データ ---
+    def select_station(self) -> str:
+        return json.dumps({
+            line: {"lineName": _ml(line), "stations": {f"KH{n:02}": _ml(_station_name(n)) for n in stations}}
+            for line, stations in LINE_STATIONS.items()
+        }, ensure_ascii=False)
+
+    def transfer_guide_info(self) -> str:
+        transfers = {1: "御堂筋線", 3: "谷町線", 4: "JR東西線", 28: "近鉄京都線", 40: "烏丸線", 42: "叡山電車"}
+        return json.dumps({
+            f"KH{n:02}": {"subway": _ml_list(name)} for n, name in transfers.items()
+        }, ensure_ascii=False)
+
+    # --- ダイヤ ---
+    @staticmethod
+    def _hhmm(t: float, midnight: float) -> str:
+        minutes = int((t - midnight) // 60)
+        return f"{minutes // 60:02}:{minutes % 60:02}"
+
+    def start_time_list(self, now: datetime.datetime) -> str:
+        midnight = datetime.datetime.combine(self.date, datetime.time.min, JST).timestamp()
+        trains = []
+        for train in self.trains:
+            objects = []
+            for i, station in enumerate(train.route):
+                if i == 0:
+                    time = "-"
+                elif train.stops[i]:
+                    time = self._hhmm(train.arrivals[i], midnight)
+                else:
+                    time = "99:99"
+                name = _ml(_station_name(station))
+                objects.append({
+                    "stationNumber": f"{station:02}{1 if train.direction == 'up' else 2}",
+                    "stationDepTime": time,
+                    "stationNameJp": name["ja"],
+                    "stationNameEn": name["en"],
+                    "stationNameZhTw": name["tw"],
+                    "stationNameZhCn": name["cn"],
+                    "stationNameKo": name["kr"],
+                    })
+            trains.append({
+                "wdfBlockNo": train.wdf,
+                "extTrain": False,
+                "premiumCar": 1 if train.train_type == "特急" else 0,
+                "trainCar": str(train.wdf % 9000 + 1000),
+                "diaStationInfoObjects": objects,
+                })
+        return json.dumps({
+            "fileCreatedTime": now.strftime("%Y%m%d%H%M%S"),
+            "fileVersion": "1",
+            "TrainInfo": trains,
+        }, ensure_ascii=False)
+
+    # --- 列車位置 ---
+    def train_position_list(self, now: datetime.datetime) -> str:
+        t = now.timestamp()
+        locations: dict[tuple[int, int, int], dict] = {}
+        for train in self.trains:
+            position = train.location(t)
+            if position is None:
+                continue
+            col, row = _location(train.line, train.direction, *position)
+            direction = 0 if train.direction == "up" else 1
+            key = (col, row, direction)
+            if key not in locations:
+                locations[key] = {
+                    "delay": "", "delayEn": "", "delayKo": "", "delayZhCn": "", "delayZhTw": "",
+                    "locationCol": col, "locationRow": row, "trainDirection": direction,
+                    "trainIconTypeImageJp": f"icon_{TYPE_EN[train.train_type]}.png",
+                    "trainTypeVisIconVis": "1",
+                    "trainInfoObjects": [],
+                    }
+            dest = train.route[-1]
+            delay = f"{train.delay}分遅れ" if train.delay else ""
+            name = _ml(_station_name(dest))
+            type_name = _ml(train.train_type)
+            locations[key]["trainInfoObjects"].append({
+                "wdfBlockNo": train.wdf,
+                "carsOfTrain": train.cars,
+                "delayMinutes": delay,
+                "delayMinutesEn": f"{train.delay} min late" if train.delay else "",
+                "delayMinutesKo": delay,
+                "delayMinutesZhCn": delay,
+                "delayMinutesZhTw": delay,
+                "destStationCode": dest,
+                "destStationNameEn": name["en"],
+                "destStationNameJp": name["ja"],
+                "destStationNameKo": name["kr"],
+                "destStationNameZhCn": name["cn"],
+                "destStationNameZhTw": name["tw"],
+                "destStationNumber": dest,
+                "lastPassStation": position[0] if position[1] is not None else 0,
+                "trainNumber": f"{train.wdf % 9000 + 1000}",
+                "trainTypeEn": TYPE_EN[train.train_type],
+                "trainTypeIcon": f"{TYPE_EN[train.train_type]}.png",
+                "trainTypeJp": train.train_type,
+                "trainTypeKo": type_name["kr"],
+                "trainTypeZhCn": type_name["cn"],
+                "trainTypeZhTw": type_name["tw"],
+                })
+        return json.dumps({
+            "fileCreatedTime": now.strftime("%Y%m%d%H%M%S"),
+            "fileVersion": "1",
+            "linkNum": "0",
+            "locationObjects": list(locations.values()),
+        }, ensure_ascii=False)
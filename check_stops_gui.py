@@ -3,12 +3,13 @@ import sys
 import os
 import datetime
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import webbrowser
 
 # 必要なライブラリのチェック
 try:
     from fastapi import FastAPI
-    from fastapi.responses import HTMLResponse, JSONResponse
+    from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
     import uvicorn
 except ImportError:
     print("FastAPI and Uvicorn are required.")
@@ -20,6 +21,8 @@ sys.path.append(os.getcwd())
 from keihan_tracker import KHTracker
 from keihan_tracker.keihan_train import stations_map
 from keihan_tracker.keihan_train.tracker import ActiveTrainData
+from keihan_tracker.keihan_train.mock_server import urls_for
+from keihan_tracker.metrics import FetchMetrics, phase
 
 PORT = 8000
 DATA_CACHE = None
@@ -110,6 +113,9 @@ HTML_CONTENT = """
                         <span v-if="rawData" class="text-[10px] bg-slate-200 text-slate-600 px-1.5 py-0.5 rounded font-mono">
                             更新: {{ rawData.last_updated }}
                         </span>
+                        <span v-if="rawData && rawData.stale" class="text-[10px] bg-amber-100 text-amber-700 px-1.5 py-0.5 rounded font-mono">
+                            取得失敗: {{ rawData.data_age }}秒前のデータ
+                        </span>
                     </div>
                 </div>
             </div>
@@ -557,11 +563,27 @@ HTML_CONTENT = """
 </html>
 """
 
+# パース・ダイヤ登録・発車標の計算をイベントループ外で行うためのExecutor
+EXECUTOR = ThreadPoolExecutor(max_workers=2)
+# 取得失敗時に前回のデータを使い続けられるよう、trackerは使い回す
+# 環境変数KEIHAN_API_BASEを指定すると、そのサーバー（mock_serverなど）から取得する
+API_BASE = os.environ.get("KEIHAN_API_BASE")
+# 取得・発車標の構築の区間ごとの処理時間。/metrics でPrometheus形式で返す
+METRICS = FetchMetrics()
+TRACKER = KHTracker(executor=EXECUTOR, urls=urls_for(API_BASE) if API_BASE else None, metrics=METRICS)
+
 async def fetch_tracker_data():
     print("Fetching data from Keihan API...")
-    tracker = KHTracker()
+    tracker = TRACKER
     await tracker.fetch_pos()
-    
+    # 発車標の構築はCPU負荷が高いため、リクエスト処理を止めないようスレッドで実行
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, build_tracker_data, tracker)
+
+def build_tracker_data(tracker: KHTracker):
+    with phase(tracker.metrics, "build_tracker_data"):
+        return _build_tracker_data(tracker)
+
+def _build_tracker_data(tracker: KHTracker):
     lines = {
         "main": stations_map.HONNSEN_UP,
         "nakanoshima": stations_map.NAKANOSHIMA_UP,
@@ -570,14 +592,16 @@ async def fetch_tracker_data():
     }
     
     # 駅情報の構築（Upcoming Trains含む）
+    # 全駅の発車標は列車ごとに1回の走査でまとめて作られ、次のfetch_posまでキャッシュされる
+    boards = tracker.departure_boards()
+    # 走行中の列車の推定到着時刻（予定＋遅延、足止め中は推定しない）
+    etas = tracker.eta_matrix()
     all_stations = {}
     for st_id, st_data in tracker.stations.items():
         # Upcoming Trainsの取得
         upcoming_list = []
         try:
-            # st_data.upcoming_trains はプロパティ
-            raw_upcoming = st_data.upcoming_trains 
-            for train, stop in raw_upcoming:
+            for train, stop in boards[st_id]:
                 t_type = train.train_type
                 if hasattr(t_type, 'value'):
                     t_type = t_type.value
@@ -587,6 +611,7 @@ async def fetch_tracker_data():
                 # ActiveTrainDataかどうかの判定
                 is_active = isinstance(train, ActiveTrainData)
                 delay = getattr(train, 'delay_minutes', 0) if is_active else 0
+                eta = etas.get(train.wdfBlockNo, st_id) if is_active else None
                 
                 upcoming_list.append({
                     "type": t_type,
@@ -596,6 +621,7 @@ async def fetch_tracker_data():
                     "formation": getattr(train, 'train_formation', '-'),
                     "cars": getattr(train, 'cars', '-'),
                     "delay": delay,
+                    "eta": eta.strftime("%H:%M") if eta else None,
                     "is_active": is_active
                 })
         except Exception as e:
@@ -604,7 +630,9 @@ async def fetch_tracker_data():
         all_stations[st_id] = {
             "id": st_id,
             "name": st_data.station_name.ja,
-            "upcoming": upcoming_list
+            "upcoming": upcoming_list,
+            # 発車標の内容が変わらない間は同じ値（クライアント側の差分判定用）
+            "version": boards[st_id].version
         }
 
     trains_list = []
@@ -658,11 +686,14 @@ async def fetch_tracker_data():
         }
         trains_list.append(train_data)
         
+    data_age = tracker.data_age
     return {
         "stations": all_stations,
         "lines": lines,
         "trains": trains_list,
-        "last_updated": datetime.datetime.now().strftime("%H:%M:%S")
+        "last_updated": datetime.datetime.now().strftime("%H:%M:%S"),
+        "stale": tracker.is_stale,
+        "data_age": int(data_age.total_seconds()) if data_age else None
     }
 
 # --- Background Task ---
@@ -672,11 +703,18 @@ async def data_updater_loop():
         try:
             print("[Background] Updating data...")
             DATA_CACHE = await fetch_tracker_data()
-            print(f"[Background] Data updated. {len(DATA_CACHE['trains'])} trains.")
+            if DATA_CACHE["stale"]:
+                print(f"[Background] Update failed, serving data from {DATA_CACHE['data_age']}s ago: {TRACKER.last_error}")
+            else:
+                print(f"[Background] Data updated. {len(DATA_CACHE['trains'])} trains.")
         except Exception as e:
+            # 前回のデータがあれば古いデータとして残す
+            if DATA_CACHE:
+                DATA_CACHE = {**DATA_CACHE, "stale": True}
             print(f"[Background] Update failed: {e}")
         
-        await asyncio.sleep(60)
+        # 上流の更新直後まで待機（更新周期はtrackerが学習する）
+        await TRACKER.wait_next_fetch()
 
 # --- FastAPI App Definition ---
 @asynccontextmanager
@@ -714,6 +752,10 @@ async def get_data():
         # データがまだない場合は503を返す
         return JSONResponse(status_code=503, content={"error": "Data is initializing, please wait."})
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(METRICS.prometheus(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     webbrowser.open(f"http://localhost:{PORT}")
     uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file
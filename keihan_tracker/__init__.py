@@ -1,5 +1,6 @@
 from .keihan_train import KHTracker
 from .keihan_train.tracker import TrainData, ActiveTrainData, LineLiteral
 from .keihan_train.schemes import TrainType
-from .bus import get_khbus_info
-from .delay_tracker import get_yahoo_delay
\ No newline at end of file
+from .bus import get_khbus_info, KHBusTracker
+from .delay_tracker import get_yahoo_delay
+from .orchestrator import Orchestrator
@@ -1 +1 @@
-from .tracker import get_khbus_info
\ No newline at end of file
+from .tracker import get_khbus_info, get_khbus_infos, KHBusTracker, BusData
\ No newline at end of file
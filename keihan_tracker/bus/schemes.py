@@ -1,5 +1,6 @@
 from typing import List, Optional
-from pydantic import BaseModel, model_validator
+from typing_extensions import TypedDict, NotRequired
+from pydantic import BaseModel, TypeAdapter, model_validator
 
 
 class Head(BaseModel):
@@ -56,3 +57,113 @@ class Body(BaseModel):
 class BusLocationResponse(BaseModel):
     head: Head
     body: Body
+
+class BusStateRecord:
+    """
+    BusStatePrmsと同じ属性を持つ軽量なレコード。
+    パース時に一度だけ型変換し、pydanticの検証やhtmlの保持を行わない。
+    """
+    __slots__ = (
+        "order", "lat", "lon", "heading", "guid", "stop_id", "platform_index",
+        "route", "destination", "via", "status", "timetable", "html", "html_sp",
+        )
+    order: int
+    lat: float
+    lon: float
+    heading: int
+    guid: str
+    stop_id: int
+    platform_index: int
+    route: str
+    destination: str
+    via: str
+    status: str
+    timetable: str
+    html: Optional[str]
+    html_sp: Optional[str]
+
+    @classmethod
+    def from_string(cls, raw: str, html: Optional[str] = None, html_sp: Optional[str] = None) -> "BusStateRecord":
+        parts = raw.split(":")
+        record = cls.__new__(cls)
+        record.order = int(parts[0])
+        record.lat = float(parts[1])
+        record.lon = float(parts[2])
+        record.heading = int(parts[3])
+        record.guid = parts[4]
+        record.stop_id = int(parts[5])
+        record.platform_index = int(parts[6])
+        record.route = parts[7]
+        record.destination = parts[8]
+        record.via = parts[9]
+        record.status = parts[10]
+        record.timetable = parts[11].replace("__________", ":")
+        record.html = html
+        record.html_sp = html_sp
+        return record
+
+    def __repr__(self) -> str:
+        return f"BusStateRecord(guid={self.guid!r}, route={self.route!r}, status={self.status!r})"
+
+
+class LeanBusResponse:
+    """parse_bus_responseの結果。busstatesは接近順のBusStateRecordのリスト。"""
+    __slots__ = ("errorcode", "objid", "datetimeStr", "busstates")
+
+    def __init__(self, errorcode: int, objid: str, datetimeStr: str, busstates: list[BusStateRecord]) -> None:
+        self.errorcode = errorcode
+        self.objid = objid
+        self.datetimeStr = datetimeStr
+        self.busstates = busstates
+
+
+# 必要なフィールドだけを定義し、JSONの解析・型検証をpydantic-core側で済ませる
+# htmlを定義しないアダプターでは、htmlはPythonの文字列として生成されない
+class _LeanState(TypedDict):
+    busstateprms: str
+
+class _LeanStateWithHTML(TypedDict):
+    busstateprms: str
+    html: NotRequired[Optional[str]]
+    html_sp: NotRequired[Optional[str]]
+
+class _LeanBody(TypedDict):
+    datetimeStr: str
+    busstates: list[_LeanState]
+
+class _LeanBodyWithHTML(TypedDict):
+    datetimeStr: str
+    busstates: list[_LeanStateWithHTML]
+
+class _LeanResponse(TypedDict):
+    head: Head
+    body: _LeanBody
+
+class _LeanResponseWithHTML(TypedDict):
+    head: Head
+    body: _LeanBodyWithHTML
+
+_lean_adapter = TypeAdapter(_LeanResponse)
+_lean_adapter_with_html = TypeAdapter(_LeanResponseWithHTML)
+
+def parse_bus_response(text: str, keep_html: bool = False) -> LeanBusResponse:
+    """
+    接近情報のJSONを、1台ごとのpydanticモデルを作らずにパースする。
+    busstateprmsは分割時に一度だけ型変換してBusStateRecordにする。
+    keep_htmlがFalseなら、使われないhtml/html_spは保持しない（メモリの大半を占める）。
+    """
+    if keep_html:
+        data = _lean_adapter_with_html.validate_json(text)
+        busstates = [
+            BusStateRecord.from_string(state["busstateprms"], state.get("html"), state.get("html_sp"))
+            for state in data["body"]["busstates"]
+            ]
+    else:
+        data = _lean_adapter.validate_json(text)
+        busstates = [BusStateRecord.from_string(state["busstateprms"]) for state in data["body"]["busstates"]]
+    return LeanBusResponse(
+        errorcode=data["head"].errorcode,
+        objid=data["head"].objid,
+        datetimeStr=data["body"]["datetimeStr"],
+        busstates=busstates,
+    )
@@ -0,0 +1,161 @@
+"""
+バス位置の空間インデックス。
+
+緯度経度を一定の大きさ（既定250m）の格子に分け、格子ごとにバスを保持する。
+ポーリングで移動したバスだけを格子間で付け替えるため、毎回作り直す必要はない。
+半径検索・近傍検索では周辺の格子だけを候補として距離を計算する。
+"""
+
+from typing import Optional, Iterable, TYPE_CHECKING
+import math
+
+if TYPE_CHECKING:
+    from .tracker import BusData
+
+EARTH_RADIUS = 6371008.8           # 地球の平均半径（m）
+# 緯度1度あたりの距離（m）。haversineと同じ球から求め、格子の大きさと距離の計算がずれないようにする
+METERS_PER_DEG_LAT = math.pi * EARTH_RADIUS / 180
+
+Cell = tuple[int, int]
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """2点間の大円距離（m）"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class BusSpatialIndex:
+    """
+    バスの位置を格子で管理するインデックス。
+    - cell_size: 格子の一辺（m）。検索半径と同程度にすると候補数が少なくなる
+    - ref_lat: 経度方向の格子幅を決める基準緯度（既定は京阪バスの営業エリア付近）
+    """
+    def __init__(self, cell_size: float = 250, ref_lat: float = 34.8) -> None:
+        self.cell_size = cell_size
+        self.cell_lat = cell_size / METERS_PER_DEG_LAT
+        self.cell_lon = cell_size / (METERS_PER_DEG_LAT * math.cos(math.radians(ref_lat)))
+        self.cells: dict[Cell, dict[str, "BusData"]] = {}
+        self.bus_cells: dict[str, Cell] = {}
+        # 登録されたことのある格子の範囲 (最小i, 最小j, 最大i, 最大j)。近傍検索の打ち切りに使う
+        self.bounds: Optional[tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.bus_cells)
+
+    def cell_of(self, lat: float, lon: float) -> Cell:
+        return (math.floor(lat / self.cell_lat), math.floor(lon / self.cell_lon))
+
+    def update(self, bus: "BusData") -> None:
+        """バスを追加する。既に登録済みなら、格子が変わった場合のみ付け替える。"""
+        cell = self.cell_of(bus.lat, bus.lon)
+        old = self.bus_cells.get(bus.guid)
+        if old == cell:
+            self.cells[cell][bus.guid] = bus
+            return
+        if old is not None:
+            self._discard(bus.guid, old)
+        self.cells.setdefault(cell, {})[bus.guid] = bus
+        self.bus_cells[bus.guid] = cell
+        if self.bounds is None:
+            self.bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            i0, j0, i1, j1 = self.bounds
+            self.bounds = (min(i0, cell[0]), min(j0, cell[1]), max(i1, cell[0]), max(j1, cell[1]))
+
+    def update_many(self, buses: Iterable["BusData"]) -> None:
+        for bus in buses:
+            self.update(bus)
+
+    def remove(self, guid: str) -> None:
+        cell = self.bus_cells.pop(guid, None)
+        if cell is not None:
+            self._discard(guid, cell)
+
+    def _discard(self, guid: str, cell: Cell) -> None:
+        members = self.cells.get(cell)
+        if members is None:
+            return
+        members.pop(guid, None)
+        if not members:
+            del self.cells[cell]
+
+    def _ring(self, center: Cell, r: int) -> Iterable[Cell]:
+        """centerからチェビシェフ距離がちょうどrの格子"""
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def _ring_width(self, lat: float) -> float:
+        """格子1つ分の、緯度latでの短い方の辺の長さ（m）"""
+        lon_m = self.cell_lon * METERS_PER_DEG_LAT * math.cos(math.radians(lat))
+        return min(self.cell_size, lon_m)
+
+    def within(
+            self,
+            lat: float,
+            lon: float,
+            radius: float,
+            route: Optional[str] = None
+            ) -> list[tuple["BusData", float]]:
+        """(lat, lon)から半径radius m以内のバスを、(バス, 距離)の近い順のリストで返す。"""
+        center = self.cell_of(lat, lon)
+        rings = math.ceil(radius / self._ring_width(lat))
+        found: list[tuple["BusData", float]] = []
+        for r in range(rings + 1):
+            for cell in self._ring(center, r):
+                for bus in self.cells.get(cell, {}).values():
+                    if route is not None and bus.route != route:
+                        continue
+                    d = haversine(lat, lon, bus.lat, bus.lon)
+                    if d <= radius:
+                        found.append((bus, d))
+        found.sort(key=lambda x: x[1])
+        return found
+
+    def nearest(
+            self,
+            lat: float,
+            lon: float,
+            k: int = 1,
+            route: Optional[str] = None,
+            max_radius: Optional[float] = None
+            ) -> list[tuple["BusData", float]]:
+        """
+        (lat, lon)に近いバスをk台まで、(バス, 距離)の近い順のリストで返す。
+        格子を内側から順に調べ、確定した範囲内でk台見つかった時点で打ち切る。
+        """
+        if not self.cells or self.bounds is None:
+            return []
+        center = self.cell_of(lat, lon)
+        width = self._ring_width(lat)
+        # 全ての格子を調べ終える環の番号
+        i0, j0, i1, j1 = self.bounds
+        max_ring = max(abs(i0 - center[0]), abs(i1 - center[0]), abs(j0 - center[1]), abs(j1 - center[1]))
+        if max_radius is not None:
+            max_ring = min(max_ring, math.ceil(max_radius / width))
+
+        found: list[tuple["BusData", float]] = []
+        for r in range(max_ring + 1):
+            for cell in self._ring(center, r):
+                for bus in self.cells.get(cell, {}).values():
+                    if route is not None and bus.route != route:
+                        continue
+                    d = haversine(lat, lon, bus.lat, bus.lon)
+                    if max_radius is None or d <= max_radius:
+                        found.append((bus, d))
+            # 環rまで調べれば、半径 r*width 以内のバスはすべて見つかっている
+            found.sort(key=lambda x: x[1])
+            if len(found) >= k and found[k - 1][1] <= r * width:
+                break
+        return found[:k]
@@ -1,13 +1,321 @@
 from httpx import AsyncClient
+from pydantic import BaseModel, Field
+from typing import Optional, Iterable, Literal, overload
+from zoneinfo import ZoneInfo
+import asyncio
+import datetime
+import re
+import time
 import urllib.parse
-from keihan_tracker.bus.schemes import BusLocationResponse
+from keihan_tracker.bus.schemes import BusLocationResponse, BusStatePrms, BusStateRecord, LeanBusResponse, parse_bus_response
+from keihan_tracker.client import get_client
+from keihan_tracker.metrics import FetchMetrics, phase
+from keihan_tracker.bus.spatial import BusSpatialIndex
 
 UPDATE_URL = "https://busnavi.keihanbus.jp/pc/busstateupd"
+JST = ZoneInfo("Asia/Tokyo")
+TIMETABLE_PATTERN = re.compile(r"(?P<hour>\d{1,2}):(?P<minute>\d{2})")
 
-async def get_khbus_info(stop_name:str, stop_num:int=1):
-    async with AsyncClient() as client:
-        dgmpl = f"{stop_name}:{stop_num}::"
+# (バス停名, のりば番号)
+StopKey = tuple[str, int]
+
+# get_khbus_infoの戻り値（leanの指定で変わる）
+BusResponse = BusLocationResponse | LeanBusResponse
+
+@overload
+async def get_khbus_info(stop_name:str, stop_num:int=1, client:Optional[AsyncClient]=None, lean:Literal[False]=False, metrics:Optional[FetchMetrics]=None) -> BusLocationResponse: ...
+@overload
+async def get_khbus_info(stop_name:str, stop_num:int=1, client:Optional[AsyncClient]=None, *, lean:Literal[True], metrics:Optional[FetchMetrics]=None) -> LeanBusResponse: ...
+async def get_khbus_info(stop_name:str, stop_num:int=1, client:Optional[AsyncClient]=None, lean:bool=False, metrics:Optional[FetchMetrics]=None) -> BusResponse:
+    """
+    バス停の接近情報を取得する。clientを省略すると共有クライアントを使う。
+    leanがTrueなら軽量なパースを行い、LeanBusResponse（BusStateRecordのリスト）を返す。html/html_spは保持しない。
+    metricsを渡すと "bus.download"・"bus.parse" の秒数と受信バイト数（"bus.bytes"）を記録する。
+    """
+    client = client or get_client()
+    dgmpl = f"{stop_name}:{stop_num}::"
+    with phase(metrics, "bus.download"):
         result = await client.post(UPDATE_URL,data={"dgmpl":urllib.parse.quote(dgmpl), "sort4":"0"})
-        result.raise_for_status()
+    result.raise_for_status()
+    if metrics is not None:
+        metrics.count("bus.bytes", len(result.content))
+    with phase(metrics, "bus.parse"):
+        if lean:
+            return parse_bus_response(result.text)
         res = BusLocationResponse.model_validate_json(result.text)
-        return res
\ No newline at end of file
+    return res
+
+
+class BusInfoFetcher:
+    """
+    複数のバス停の接近情報をまとめて取得する。
+    - 同時リクエスト数をmax_concurrencyに制限する
+    - 同じバス停への取得が進行中なら、その結果を待って共有する
+    - 取得結果をttl秒間キャッシュする
+    - leanがTrueなら高速なパースを行い、html/html_spは保持しない（get_khbus_info参照）
+    - metricsを渡すと取得・パースの秒数と、キャッシュ（"bus.cache_hits"）・進行中の取得の共有（"bus.shared"）の回数を記録する
+    上流へのリクエスト数は閲覧者数ではなく、ttl秒あたりのバス停の種類数に比例する。
+    返すレスポンスは呼び出し元の間で共有されるため、変更しないこと。
+    """
+    def __init__(
+            self,
+            ttl: float = 5,
+            max_concurrency: int = 4,
+            client: Optional[AsyncClient] = None,
+            lean: bool = False,
+            metrics: Optional[FetchMetrics] = None
+            ) -> None:
+        self.ttl = ttl
+        self.metrics = metrics
+        self.max_concurrency = max_concurrency
+        self.client = client
+        self.lean = lean
+        self.cache: dict[StopKey, tuple[float, BusResponse]] = {}
+        self._inflight: dict[StopKey, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Semaphoreはイベントループに紐づくため、ループが変わったら作り直す
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or loop is not self._loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+            self._loop = loop
+        return self._semaphore
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (fetched, _) in self.cache.items() if now - fetched >= self.ttl]:
+            del self.cache[key]
+
+    async def _fetch(self, key: StopKey) -> BusResponse:
+        try:
+            async with self._get_semaphore():
+                res = await get_khbus_info(key[0], key[1], client=self.client, lean=self.lean, metrics=self.metrics)
+            self._purge()
+            self.cache[key] = (time.monotonic(), res)
+            return res
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get(self, stop_name: str, stop_num: int = 1) -> BusResponse:
+        """1つのバス停の接近情報を返す。キャッシュ・進行中の取得があればそれを使う。"""
+        key = (stop_name, stop_num)
+        cached = self.cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            if self.metrics is not None:
+                self.metrics.count("bus.cache_hits")
+            return cached[1]
+
+        self._get_semaphore()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key))
+            self._inflight[key] = task
+        elif self.metrics is not None:
+            self.metrics.count("bus.shared")
+        # 1つの待機者がキャンセルされても、共有している取得は止めない
+        return await asyncio.shield(task)
+
+    async def get_many(
+            self,
+            stops: Iterable[StopKey],
+            return_exceptions: bool = False
+            ) -> dict[StopKey, BusResponse | BaseException]:
+        """
+        複数の(バス停名, のりば番号)の接近情報を並行して取得し、辞書で返す。
+        return_exceptionsがTrueなら、失敗したバス停の値は例外になる（asyncio.gatherと同様）。
+        """
+        keys = list(dict.fromkeys(stops))
+        results = await asyncio.gather(*(self.get(*key) for key in keys), return_exceptions=return_exceptions)
+        return dict(zip(keys, results))
+
+
+_default_fetcher = BusInfoFetcher()
+_lean_fetcher = BusInfoFetcher(lean=True)
+
+async def get_khbus_infos(
+        stops: Iterable[StopKey],
+        return_exceptions: bool = False
+        ) -> dict[StopKey, BusResponse | BaseException]:
+    """
+    複数のバス停の接近情報をまとめて取得する。
+    モジュール共通のBusInfoFetcherを使うため、画面をまたいだ同じバス停への取得は共有される。
+    """
+    return await _default_fetcher.get_many(stops, return_exceptions=return_exceptions)
+
+
+class BusData(BaseModel):
+    """
+    追跡中のバス1台を表すモデル。guidごとに1つ作られ、ポーリングのたびに更新される。
+    - stops: 接近情報に現れた監視中バス停と、そこでの接近順位
+    - timetable: 到着予定時刻（JST）。時刻を読み取れない場合はNone
+    """
+    guid:           str
+    route:          str
+    destination:    str
+    via:            str
+    lat:            float
+    lon:            float
+    heading:        int
+    status:         str
+    timetable_text: str
+    timetable:      Optional[datetime.datetime] = None
+    stops:          dict[StopKey, int] = Field(default_factory=dict)
+    last_update:    datetime.datetime
+
+    def __str__(self) -> str:
+        return f"{self.route} {self.destination}行き: {self.status} ({self.timetable_text})"
+
+
+def iter_busstates(res: BusResponse) -> list[BusStatePrms] | list[BusStateRecord]:
+    """レスポンスの形式によらず、接近順のバスの一覧を返す。"""
+    if isinstance(res, LeanBusResponse):
+        return res.busstates
+    return [state.busstateprms for state in res.body.busstates]
+
+
+def parse_timetable(text: str, now: datetime.datetime) -> Optional[datetime.datetime]:
+    """「17:30 到着予定」などの時刻文字列をnowに最も近い日付のJST datetimeにする。"""
+    m = TIMETABLE_PATTERN.search(text)
+    if not m:
+        return None
+    t = now.replace(hour=int(m["hour"]) % 24, minute=int(m["minute"]), second=0, microsecond=0)
+    # 日付をまたぐ場合
+    if t - now > datetime.timedelta(hours=12):
+        t -= datetime.timedelta(days=1)
+    elif now - t > datetime.timedelta(hours=12):
+        t += datetime.timedelta(days=1)
+    return t
+
+
+class KHBusTracker:
+    """
+    複数のバス停の接近情報をポーリングし、バスをguidごとに追跡するクラス。
+    - stops: 監視するバス停（(バス停名, のりば番号) のリスト）
+    - buses: 追跡中のバスの辞書（guid:BusData）
+    - fetch でまとめて取得し、移動・状態変化したバスのみを返す
+    - metricsを渡すと取得・パース・更新（"bus.update"）の秒数を記録する。fetcherを省略した場合は専用のfetcherを作る
+    """
+    def __init__(
+            self,
+            stops: Iterable[StopKey] = (),
+            fetcher: Optional[BusInfoFetcher] = None,
+            metrics: Optional[FetchMetrics] = None
+            ) -> None:
+        self.stops: list[StopKey] = list(dict.fromkeys(stops))
+        self.metrics: Optional[FetchMetrics] = metrics
+        # 追跡にhtmlは不要なので、既定では高速なパースを行うfetcherを使う
+        if fetcher is None:
+            fetcher = BusInfoFetcher(lean=True, metrics=metrics) if metrics is not None else _lean_fetcher
+        self.fetcher: BusInfoFetcher = fetcher
+        self.buses: dict[str, BusData] = {}
+        self.removed: list[BusData] = []     # 直近のfetchで接近情報から消えたバス
+        self.last_fetch_datetime: Optional[datetime.datetime] = None
+        # 現在位置の空間インデックス。fetchごとに変化したバスのみ更新する
+        self.index: BusSpatialIndex = BusSpatialIndex()
+
+    def watch(self, stop_name: str, stop_num: int = 1) -> None:
+        """監視するバス停を追加する。"""
+        if (stop_name, stop_num) not in self.stops:
+            self.stops.append((stop_name, stop_num))
+
+    def unwatch(self, stop_name: str, stop_num: int = 1) -> None:
+        """監視するバス停を外す。そのバス停でのみ見えていたバスは次のfetchで削除される。"""
+        if (stop_name, stop_num) in self.stops:
+            self.stops.remove((stop_name, stop_num))
+
+    def find_buses(self, stop: Optional[StopKey] = None, route: Optional[str] = None) -> list[BusData]:
+        """条件に合致するバスを、stopを指定した場合は接近順に返す。"""
+        buses = [
+            bus for bus in self.buses.values()
+            if (stop is None or stop in bus.stops) and (route is None or bus.route == route)
+            ]
+        if stop is not None:
+            buses.sort(key=lambda bus: bus.stops[stop])
+        return buses
+
+    async def fetch(self) -> list[BusData]:
+        """
+        監視中の全バス停の接近情報を取得してバスを更新し、新たに現れた・移動した・状態が変わったバスを返す。
+        取得に失敗したバス停のバスは前回の状態のまま残す。
+        """
+        now = datetime.datetime.now(JST)
+        results = await self.fetcher.get_many(self.stops, return_exceptions=True)
+
+        with phase(self.metrics, "bus.update"):
+            seen: dict[str, dict[StopKey, int]] = {}
+            failed_stops: set[StopKey] = set()
+            changed: dict[str, BusData] = {}
+            for stop, res in results.items():
+                if isinstance(res, BaseException):
+                    failed_stops.add(stop)
+                    continue
+                for prms in iter_busstates(res):
+                    seen.setdefault(prms.guid, {})[stop] = prms.order
+                    bus = self.buses.get(prms.guid)
+                    if bus is None:
+                        bus = BusData(
+                            guid=prms.guid,
+                            route=prms.route,
+                            destination=prms.destination,
+                            via=prms.via,
+                            lat=prms.lat,
+                            lon=prms.lon,
+                            heading=prms.heading,
+                            status=prms.status,
+                            timetable_text=prms.timetable,
+                            timetable=parse_timetable(prms.timetable, now),
+                            last_update=now,
+                        )
+                        self.buses[prms.guid] = bus
+                        changed[bus.guid] = bus
+                        continue
+
+                    # 同じfetch内で別のバス停から既に更新済みなら位置の比較は不要
+                    if bus.last_update == now:
+                        continue
+                    if (bus.lat, bus.lon, bus.heading, bus.status) != (prms.lat, prms.lon, prms.heading, prms.status):
+                        changed[bus.guid] = bus
+                    bus.lat = prms.lat
+                    bus.lon = prms.lon
+                    bus.heading = prms.heading
+                    bus.status = prms.status
+                    if bus.timetable_text != prms.timetable:
+                        bus.timetable_text = prms.timetable
+                        bus.timetable = parse_timetable(prms.timetable, now)
+                    bus.last_update = now
+
+            # 接近順位を更新し、どの監視中バス停にも現れなくなったバスを削除する
+            self.removed = []
+            for guid, bus in list(self.buses.items()):
+                kept = {stop: order for stop, order in bus.stops.items() if stop in failed_stops and stop in self.stops}
+                bus.stops = {**kept, **seen.get(guid, {})}
+                if not bus.stops:
+                    self.removed.append(self.buses.pop(guid))
+
+            self.index.update_many(changed.values())
+            for bus in self.removed:
+                self.index.remove(bus.guid)
+        if self.metrics is not None:
+            self.metrics.count("bus.changed", len(changed))
+            self.metrics.gauge("bus.buses", len(self.buses))
+
+        self.last_fetch_datetime = now
+        return list(changed.values())
+
+    def buses_within(self, lat: float, lon: float, radius: float, route: Optional[str] = None) -> list[tuple[BusData, float]]:
+        """(lat, lon)から半径radius m以内のバスを、(バス, 距離m)の近い順に返す。"""
+        return self.index.within(lat, lon, radius, route=route)
+
+    def nearest_buses(
+            self,
+            lat: float,
+            lon: float,
+            k: int = 1,
+            route: Optional[str] = None,
+            max_radius: Optional[float] = None
+            ) -> list[tuple[BusData, float]]:
+        """(lat, lon)に近いバスをk台まで、(バス, 距離m)の近い順に返す。routeで系統（例: "[22]"）を絞り込める。"""
+        return self.index.nearest(lat, lon, k=k, route=route, max_radius=max_radius)
@@ -0,0 +1,133 @@
+"""
+電車・バス・遅延情報で共有するHTTPクライアント。
+
+AsyncClientを呼び出しごとに作ると毎回TLSハンドシェイクが発生し、keep-aliveも効かない。
+ここで1つのAsyncClientを使い回し、コネクションプールを共有する。
+
+    from keihan_tracker.client import configure_client, aclose_client
+
+    configure_client(HTTPClientConfig(http2=True, max_connections=50))
+    ...
+    await aclose_client()   # 終了時
+"""
+
+from pydantic import BaseModel, Field
+from typing import Optional
+from httpx import AsyncClient, Limits, Timeout
+import asyncio
+import concurrent.futures
+
+
+class HTTPClientConfig(BaseModel):
+    """
+    共有クライアントの設定。
+    - http2: HTTP/2を使うか（`pip install httpx[http2]` が必要）
+    - max_connections, max_keepalive_connections, keepalive_expiry: コネクションプールの上限・保持時間
+    - timeout: 既定のタイムアウト（秒）。ResilientFetcherを通す場合はエンドポイントごとの値が優先される
+    """
+    http2:                     bool  = False
+    max_connections:           int   = 20
+    max_keepalive_connections: int   = 10
+    keepalive_expiry:          float = 30
+    timeout:                   float = 10
+    headers:                   dict[str, str] = Field(default_factory=dict)
+
+    def create(self) -> AsyncClient:
+        return AsyncClient(
+            http2=self.http2,
+            limits=Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=Timeout(self.timeout),
+            headers=self.headers,
+        )
+
+
+class SharedClient:
+    """
+    AsyncClientを必要になった時点で生成し、使い回す。
+    プール内のコネクションはイベントループに紐づくため、別のループ（asyncio.runの再実行など）から
+    使われた場合は新しいクライアントを作り直し、古いクライアントは閉じる。
+    """
+    def __init__(self, config: Optional[HTTPClientConfig] = None) -> None:
+        self.config: HTTPClientConfig = config or HTTPClientConfig()
+        self._client: Optional[AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 置き換えたクライアントを閉じているタスク（完了まで参照を保持する）
+        self._closing: set[asyncio.Future | concurrent.futures.Future] = set()
+
+    @property
+    def client(self) -> AsyncClient:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._client is None or self._client.is_closed or (loop is not None and loop is not self._loop):
+            self._discard()
+            self._client = self.config.create()
+            self._loop = loop
+        return self._client
+
+    def _discard(self) -> None:
+        """
+        現在のクライアントを手放し、閉じる。同期的な処理からはawaitできないため、
+        実行中のイベントループ（なければクライアントを作ったループ）にaclose()を予約する。
+        """
+        client, loop = self._client, self._loop
+        self._client = None
+        self._loop = None
+        if client is None or client.is_closed:
+            return
+        try:
+            running: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None:
+            future: asyncio.Future | concurrent.futures.Future = running.create_task(client.aclose())
+        elif loop is not None and loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # どのループも動いていなければ、コネクションは元のループとともに破棄されている
+            return
+        self._closing.add(future)
+        future.add_done_callback(self._closed)
+
+    def _closed(self, future: asyncio.Future | concurrent.futures.Future) -> None:
+        self._closing.discard(future)
+        # 元のループが閉じていると失敗することがあるが、コネクションはループとともに破棄されているため無視する
+        if not future.cancelled():
+            future.exception()
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    async def __aenter__(self) -> AsyncClient:
+        return self.client
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+
+_shared = SharedClient()
+
+def get_client() -> AsyncClient:
+    """共有クライアントを返す。"""
+    return _shared.client
+
+def configure_client(config: HTTPClientConfig) -> None:
+    """
+    共有クライアントの設定を変更する。以降に生成されるクライアントから反映される。
+    使用中のクライアントは閉じられる（実行中のイベントループがあればaclose()を予約する）。
+    確実に閉じ終えてから変更したい場合は、先にaclose_client()を呼ぶ。
+    """
+    _shared.config = config
+    _shared._discard()
+
+async def aclose_client() -> None:
+    """共有クライアントを閉じる。次に使われたときに再生成される。"""
+    await _shared.aclose()
@@ -1,16 +1,26 @@
 from pydantic import BaseModel, field_validator, BeforeValidator, Field
-from typing import Optional, Union, Annotated, List, Any
-from datetime import datetime
+from typing import Optional, Union, Annotated, List, Any, Literal, AsyncIterator
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from bs4 import BeautifulSoup as bs
+from bs4 import BeautifulSoup as bs, SoupStrainer
 import asyncio
 import httpx
 import re
+import unicodedata
 from urllib.parse import urljoin
+from .client import get_client
+from .metrics import FetchMetrics, phase
 
 JST = ZoneInfo("Asia/Tokyo")
 BASE_URL = "https://transit.yahoo.co.jp/diainfo/area/"
 
+# lxmlがあれば高速なlxmlパーサーを使う
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = "lxml"
+except ImportError:
+    DEFAULT_PARSER = "html.parser"
+
 class DelayLine(BaseModel):
     LineName: str
     status: str
@@ -83,71 +93,282 @@ class ResponseModel(BaseModel):
     ResultSet: ResultSetData
 
 
-async def get_yahoo_delay(area:int=6) -> list[DelayLine]:
-    async with httpx.AsyncClient() as crowler:
-        html = await crowler.get(f"{BASE_URL}{area}")
-
-        soup = bs(html.content, "html.parser")
-        
-        table = soup.select("div.elmTblLstLine.trouble")[0].find_all("table")
-        table = table[0] if len(table) != 0 else None
-        if not table:
-            return []
-        
-        async def get_detail(url:str) -> tuple[str,str]:
-            res = await crowler.get(url,follow_redirects=True)
-            soup = bs(res.text, "html.parser")
-            info = soup.select("div#mdServiceStatus")[0]
-            title = info.select("dl > dt")[0].text
-            text = info.select("dl > dd > p")[0].text
-
-            return title, text
-
-        delays:list[DelayLine] = []
-        tasks:list = []
-        lines:list[tuple[str,str]] = []
-        for tr in table.find_all("tr")[1:]:
-            url = urljoin(BASE_URL, str(tr.find_all("td")[0].find_all("a")[0].get("href")))
-            line = tr.find_all("td")[0].text    # ○○線
-            short_status = tr.find_all("td")[2].text  # 17:00頃、宇都宮...
-            tasks.append(get_detail(url))
-            lines.append((line, short_status))
-
-        for i, line in zip(await asyncio.gather(*tasks), lines):
-            line, status = line
-            title, text = i
-            
-            pattern = r"（(?P<month>\d{1,2})月(?P<day>\d{1,2})日\s*(?P<hour>\d{1,2})時(?P<minute>\d{1,2})分掲載）"
-            m = re.search(pattern, text) or {}
-
-            dt = datetime(
-                year=datetime.now().year,  # 年は別途補完
-                month=int(m["month"]),
-                day=int(m["day"]),
-                hour=int(m["hour"]),
-                minute=int(m["minute"]),
-                tzinfo=JST
-            )
-            delays.append(DelayLine(LineName=line, status=title, detail=text, AnnouncedTime=dt))
+# 一覧・詳細ページのうち使う部分だけを解析する
+# 解析中のclass属性はバージョンによって空白区切りの文字列のまま渡されるため、正規表現で照合する
+AREA_STRAINER = SoupStrainer("div", class_=re.compile(r"\belmTblLstLine\b"))
+DETAIL_STRAINER = SoupStrainer("div", id="mdServiceStatus")
+ANNOUNCED_PATTERN = re.compile(r"（(?P<month>\d{1,2})月(?P<day>\d{1,2})日\s*(?P<hour>\d{1,2})時(?P<minute>\d{1,2})分掲載）")
+
+def _parse_area(html: str | bytes, parser: str) -> list[tuple[str, str, str]]:
+    """運行情報一覧ページから、障害のある路線の(詳細URL, 路線名, 概要)のリストを返す。"""
+    soup = bs(html, parser, parse_only=AREA_STRAINER)
+    troubles = soup.select("div.elmTblLstLine.trouble")
+    if not troubles:
+        return []
+    table = troubles[0].find_all("table")
+    table = table[0] if len(table) != 0 else None
+    if not table:
+        return []
+
+    rows: list[tuple[str, str, str]] = []
+    for tr in table.find_all("tr")[1:]:
+        url = urljoin(BASE_URL, str(tr.find_all("td")[0].find_all("a")[0].get("href")))
+        line = tr.find_all("td")[0].text    # ○○線
+        short_status = tr.find_all("td")[2].text  # 17:00頃、宇都宮...
+        rows.append((url, line, short_status))
+    return rows
+
+def _parse_detail(html: str, parser: str) -> tuple[str, str, datetime]:
+    """運行情報の詳細ページから(状態, 詳細, 掲載時刻)を返す。"""
+    soup = bs(html, parser, parse_only=DETAIL_STRAINER)
+    info = soup.select("div#mdServiceStatus")[0]
+    title = info.select("dl > dt")[0].text
+    text = info.select("dl > dd > p")[0].text
+
+    m = ANNOUNCED_PATTERN.search(text) or {}
+    dt = datetime(
+        year=datetime.now().year,  # 年は別途補完
+        month=int(m["month"]),
+        day=int(m["day"]),
+        hour=int(m["hour"]),
+        minute=int(m["minute"]),
+        tzinfo=JST
+    )
+    return title, text, dt
+
+
+class YahooDelayClient:
+    """
+    Yahoo!路線情報の運行情報を取得するクライアント。
+    詳細ページを詳細URLと一覧の概要文で保持し、概要が変わった路線だけ詳細ページを取得し直す。
+    - area: エリアコード（6=近畿）
+    - max_concurrency: 詳細ページの同時取得数
+    - parser: BeautifulSoupのパーサー。lxmlがインストールされていれば既定でlxmlを使う
+    - metrics: 渡すと一覧・詳細ページの取得（"delay.download"）・解析（"delay.parse"）の秒数と、
+      受信バイト数（"delay.bytes"）・詳細ページのキャッシュヒット数（"delay.cache_hits"）を記録する
+    """
+    def __init__(
+            self,
+            area: int = 6,
+            client: Optional[httpx.AsyncClient] = None,
+            max_concurrency: int = 4,
+            parser: Optional[str] = None,
+            metrics: Optional[FetchMetrics] = None
+            ) -> None:
+        self.area = area
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.parser: str = parser or DEFAULT_PARSER
+        self.metrics = metrics
+        # 詳細URL: (概要, DelayLine)
+        self.cache: dict[str, tuple[str, DelayLine]] = {}
+
+    async def fetch(self) -> list[DelayLine]:
+        crowler = self.client or get_client()
+        metrics = self.metrics
+        with phase(metrics, "delay.download"):
+            html = await crowler.get(f"{BASE_URL}{self.area}")
+        if metrics is not None:
+            metrics.count("delay.bytes", len(html.content))
+        with phase(metrics, "delay.parse"):
+            rows = _parse_area(html.content, self.parser)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async def get_detail(url: str, line: str, short_status: str) -> DelayLine:
+            cached = self.cache.get(url)
+            if cached is not None and cached[0] == short_status and cached[1].LineName == line:
+                if metrics is not None:
+                    metrics.count("delay.cache_hits")
+                return cached[1]
+            async with semaphore:
+                with phase(metrics, "delay.download"):
+                    res = await crowler.get(url, follow_redirects=True)
+            if metrics is not None:
+                metrics.count("delay.bytes", len(res.content))
+            with phase(metrics, "delay.parse"):
+                title, text, dt = _parse_detail(res.text, self.parser)
+            delay = DelayLine(LineName=line, status=title, detail=text, AnnouncedTime=dt)
+            self.cache[url] = (short_status, delay)
+            return delay
+
+        delays: list[DelayLine] = list(await asyncio.gather(*(get_detail(*row) for row in rows)))
+        # 一覧から消えた路線のキャッシュは破棄する
+        urls = {row[0] for row in rows}
+        for url in [url for url in self.cache if url not in urls]:
+            del self.cache[url]
         return delays
+
+
+async def get_yahoo_delay(area:int=6, client:Optional[httpx.AsyncClient]=None) -> list[DelayLine]:
+    """
+    Yahoo!路線情報から運行情報を取得する。clientを省略すると共有クライアントを使う。
+    繰り返し取得する場合は、詳細ページを使い回すYahooDelayClientを使う方が効率的。
+    """
+    return await YahooDelayClient(area, client=client).fetch()
     
-async def get_ekispert_delay(api_key:str, prefs:list[int]=[26,27,28]) -> list[DelayLine]:
-    async with httpx.AsyncClient() as web:
-        uri = f"http://api.ekispert.jp/v1/json/operationLine/service/rescuenow/information?key={api_key}"    
-        uri += f"&prefectureCode={':'.join(map(str,prefs))}"
+async def get_ekispert_delay(
+        api_key:str,
+        prefs:list[int]=[26,27,28],
+        client:Optional[httpx.AsyncClient]=None,
+        metrics:Optional[FetchMetrics]=None
+        ) -> list[DelayLine]:
+    """
+    駅すぱあと運行情報APIから運行情報を取得する。clientを省略すると共有クライアントを使う。
+    metricsを渡すと "ekispert.download"・"ekispert.parse" の秒数と受信バイト数（"ekispert.bytes"）を記録する。
+    """
+    web = client or get_client()
+    uri = f"http://api.ekispert.jp/v1/json/operationLine/service/rescuenow/information?key={api_key}"    
+    uri += f"&prefectureCode={':'.join(map(str,prefs))}"
+    with phase(metrics, "ekispert.download"):
         request = await web.get(uri)
-        request.raise_for_status()
+    request.raise_for_status()
+    if metrics is not None:
+        metrics.count("ekispert.bytes", len(request.content))
+    with phase(metrics, "ekispert.parse"):
         res = ResponseModel.model_validate(request.json())
-        
-        results:dict[str,DelayLine] = {}
-        for i in res.ResultSet.Information or []:
-            if i.Line.code in results:
-                if i.Datetime < (results[i.Line.code].AnnouncedTime or datetime.min):
+    
+    results:dict[str,DelayLine] = {}
+    for i in res.ResultSet.Information or []:
+        if i.Line.code in results:
+            if i.Datetime < (results[i.Line.code].AnnouncedTime or datetime.min):
+                continue
+        results[i.Line.code] = DelayLine(
+            LineName=i.Line.Name,
+            status=i.status,
+            detail=i.Comment[0].text,
+            AnnouncedTime=i.Datetime
+        )
+    return list(results.values())
+
+def _normalize_line_name(name: str) -> str:
+    """提供元による表記揺れ（全角・半角、空白）を吸収した路線名"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", name))
+
+def _as_jst(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=JST) if dt.tzinfo is None else dt
+
+
+class DelayChange(BaseModel):
+    """
+    DelayMonitorが通知する運行情報の変化。
+    - kind: "new"（新規）, "changed"（新しい発表に更新）, "cleared"（解消）
+    - key: 路線名と発表時刻からなる識別子。同じkeyの通知は二度行われない
+    - line: 現在の運行情報（clearedの場合は解消前の最後の情報）
+    - previous: changedの場合、更新前の運行情報
+    """
+    kind:     Literal["new", "changed", "cleared"]
+    key:      str
+    line:     DelayLine
+    previous: Optional[DelayLine] = None
+    provider: str
+
+
+class DelayMonitor:
+    """
+    Yahoo!路線情報・駅すぱあとの運行情報をポーリングし、変化のあった発表だけを返す。
+    各発表は「路線名＋発表時刻」をキーとし、複数の提供元が同じ路線を報じている場合は最も新しい発表を採用する。
+    - yahoo: Yahoo!路線情報のクライアント。yahooもekispert_api_keyも省略した場合は既定のクライアントを使う
+    - ekispert_api_key, prefs: 指定すると駅すぱあとからも取得する
+    - dedup_window: 一度通知したキーを記憶しておく期間。この間に同じ発表が消えて再び現れても再通知せず、
+      同じ発表の解消も2回目以降は通知しない
+    - metrics: 既定のYahoo!路線情報のクライアントと駅すぱあとの取得に渡すFetchMetrics
+    """
+    def __init__(
+            self,
+            yahoo: Optional[YahooDelayClient] = None,
+            ekispert_api_key: Optional[str] = None,
+            prefs: list[int] = [26,27,28],
+            client: Optional[httpx.AsyncClient] = None,
+            dedup_window: timedelta = timedelta(hours=24),
+            metrics: Optional[FetchMetrics] = None
+            ) -> None:
+        if yahoo is None and ekispert_api_key is None:
+            yahoo = YahooDelayClient(client=client, metrics=metrics)
+        self.yahoo = yahoo
+        self.ekispert_api_key = ekispert_api_key
+        self.prefs = prefs
+        self.client = client
+        self.dedup_window = dedup_window
+        self.metrics = metrics
+        # 正規化した路線名: (キー, 運行情報, 提供元)
+        self.current: dict[str, tuple[str, DelayLine, str]] = {}
+        # 通知済みのキー: 最後に観測した時刻（解消の通知は "cleared:" を付けたキー）
+        self.notified: dict[str, datetime] = {}
+        # 直近のpollで失敗した提供元
+        self.errors: dict[str, BaseException] = {}
+
+    @staticmethod
+    def key_of(line: DelayLine) -> str:
+        return f"{_normalize_line_name(line.LineName)}@{_as_jst(line.AnnouncedTime).isoformat()}"
+
+    async def _fetch_all(self) -> dict[str, list[DelayLine]]:
+        providers: dict[str, Any] = {}
+        if self.yahoo is not None:
+            providers["yahoo"] = self.yahoo.fetch()
+        if self.ekispert_api_key is not None:
+            providers["ekispert"] = get_ekispert_delay(self.ekispert_api_key, self.prefs, client=self.client, metrics=self.metrics)
+        results = await asyncio.gather(*providers.values(), return_exceptions=True)
+
+        self.errors = {}
+        fetched: dict[str, list[DelayLine]] = {}
+        for name, result in zip(providers, results):
+            if isinstance(result, BaseException):
+                self.errors[name] = result
+            else:
+                fetched[name] = result
+        return fetched
+
+    async def poll(self) -> list[DelayChange]:
+        """全提供元から取得し、前回からの変化を返す。取得に失敗した提供元の路線は解消扱いにしない。"""
+        now = datetime.now(JST)
+        fetched = await self._fetch_all()
+
+        # 路線ごとに最も新しい発表を採用する
+        latest: dict[str, tuple[str, DelayLine, str]] = {}
+        for provider, lines in fetched.items():
+            for line in lines:
+                name = _normalize_line_name(line.LineName)
+                if name in latest and _as_jst(latest[name][1].AnnouncedTime) >= _as_jst(line.AnnouncedTime):
                     continue
-            results[i.Line.code] = DelayLine(
-                LineName=i.Line.Name,
-                status=i.status,
-                detail=i.Comment[0].text,
-                AnnouncedTime=i.Datetime
-            )
-        return list(results.values())
\ No newline at end of file
+                latest[name] = (self.key_of(line), line, provider)
+
+        changes: list[DelayChange] = []
+        for name, (key, line, provider) in latest.items():
+            previous = self.current.get(name)
+            if previous is not None and _as_jst(previous[1].AnnouncedTime) >= _as_jst(line.AnnouncedTime):
+                # 同じか古い発表（提供元による時刻の違いを含む）なら変化なし
+                continue
+            self.current[name] = (key, line, provider)
+            if key not in self.notified:
+                changes.append(DelayChange(
+                    kind="changed" if previous is not None else "new",
+                    key=key,
+                    line=line,
+                    previous=previous[1] if previous is not None else None,
+                    provider=provider,
+                ))
+            self.notified[key] = now
+
+        for name, (key, line, provider) in list(self.current.items()):
+            if name in latest or provider not in fetched:
+                # 表示中、または提供元の取得に失敗した路線はそのまま
+                if name in latest:
+                    self.notified[key] = now
+                continue
+            del self.current[name]
+            cleared_key = f"cleared:{key}"
+            if cleared_key not in self.notified:
+                changes.append(DelayChange(kind="cleared", key=key, line=line, provider=provider))
+            self.notified[cleared_key] = now
+
+        # 古い通知済みキーを破棄
+        for key in [key for key, seen in self.notified.items() if now - seen > self.dedup_window]:
+            del self.notified[key]
+        return changes
+
+    async def watch(self, interval: float = 60) -> AsyncIterator[DelayChange]:
+        """interval秒ごとにpollし、変化を1件ずつ返す非同期イテレーター。"""
+        while True:
+            for change in await self.poll():
+                yield change
+            await asyncio.sleep(interval)
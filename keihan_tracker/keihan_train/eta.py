@@ -0,0 +1,158 @@
+"""
+走行中の全列車 × 全駅の推定到着時刻（ETA）行列。
+
+各列車の残りの停車駅の予定時刻を1つの行列に並べ、遅延分数の加算と足止め判定を
+行列全体に対して一度に行う。NumPyがインストールされていればndarrayで計算し
+（`pip install keihan-tracker[numpy]`）、なければ同じ内容をリストで計算する。
+
+値はUNIX時間（秒, float）で、停車しない・通過済み・推定不可の要素はNaN。
+"""
+
+from typing import Optional, Sequence, Any
+import datetime
+import math
+from zoneinfo import ZoneInfo
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+JST = ZoneInfo("Asia/Tokyo")
+
+# (wdfBlockNo, [(駅番号, 予定時刻)], 遅延分数, 足止めか)
+ETARow = tuple[int, Sequence[tuple[int, Optional[datetime.datetime]]], float, bool]
+
+
+class ETAMatrix:
+    """
+    推定到着時刻の行列。行が列車（wdfs）、列が駅（stations）に対応する。
+    - scheduled: 予定時刻（UNIX時間）
+    - eta: 遅延を加味した推定時刻（UNIX時間）。足止めと判定した列車の行はすべてNaN
+    - stuck: 列車ごとの足止め判定
+    - created_at: 計算した時刻
+    NumPyがあればscheduled・etaはndarray、なければlist[list[float]]。
+    """
+    def __init__(
+            self,
+            wdfs: list[int],
+            stations: list[int],
+            scheduled: Any,
+            eta: Any,
+            stuck: list[bool],
+            created_at: datetime.datetime
+            ) -> None:
+        self.wdfs = wdfs
+        self.stations = stations
+        self.scheduled = scheduled
+        self.eta = eta
+        self.stuck = stuck
+        self.created_at = created_at
+        self.row_of: dict[int, int] = {wdf: i for i, wdf in enumerate(wdfs)}
+        self.col_of: dict[int, int] = {number: j for j, number in enumerate(stations)}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (len(self.wdfs), len(self.stations))
+
+    @staticmethod
+    def _to_datetime(value: float) -> Optional[datetime.datetime]:
+        if math.isnan(value):
+            return None
+        return datetime.datetime.fromtimestamp(value, JST)
+
+    def get(self, wdf: int, station_number: int) -> Optional[datetime.datetime]:
+        """列車wdfが駅に到着する推定時刻。停車しない・通過済み・推定不可ならNone"""
+        row = self.row_of.get(wdf)
+        col = self.col_of.get(station_number)
+        if row is None or col is None:
+            return None
+        return self._to_datetime(float(self.eta[row][col]))
+
+    def is_stuck(self, wdf: int) -> bool:
+        row = self.row_of.get(wdf)
+        return row is not None and self.stuck[row]
+
+    def station_etas(self, station_number: int) -> dict[int, datetime.datetime]:
+        """駅に到着予定の列車と推定時刻（wdfBlockNo:推定時刻）"""
+        col = self.col_of.get(station_number)
+        if col is None:
+            return {}
+        etas: dict[int, datetime.datetime] = {}
+        for row, wdf in enumerate(self.wdfs):
+            eta = self._to_datetime(float(self.eta[row][col]))
+            if eta is not None:
+                etas[wdf] = eta
+        return etas
+
+    def train_etas(self, wdf: int) -> dict[int, datetime.datetime]:
+        """列車の残りの停車駅と推定時刻（駅番号:推定時刻）"""
+        row = self.row_of.get(wdf)
+        if row is None:
+            return {}
+        etas: dict[int, datetime.datetime] = {}
+        for col, number in enumerate(self.stations):
+            eta = self._to_datetime(float(self.eta[row][col]))
+            if eta is not None:
+                etas[number] = eta
+        return etas
+
+
+def build_eta_matrix(
+        rows: Sequence[ETARow],
+        stations: Sequence[int],
+        created_at: Optional[datetime.datetime] = None,
+        predicted: Optional[dict[int, dict[int, datetime.datetime]]] = None
+        ) -> ETAMatrix:
+    """
+    列車ごとの残りの停車駅・遅延・足止め判定からETA行列を作る。
+    予定時刻の配置以外（遅延の加算、足止めの除外）は行列全体に対して一度に行う。
+    - predicted: 列車ごとの予測到着時刻（wdfBlockNo:{駅番号:時刻}、SegmentModel.predict_allなど）。
+      指定すると、予定時刻のある停車についてはこちらを推定時刻とする（足止めの列車は除く）
+    """
+    wdfs = [row[0] for row in rows]
+    stations = list(stations)
+    col_of = {number: j for j, number in enumerate(stations)}
+    n_rows, n_cols = len(wdfs), len(stations)
+
+    # 予定時刻のある停車を (行, 列, 時刻) に展開する
+    r_idx: list[int] = []
+    c_idx: list[int] = []
+    times: list[float] = []
+    for i, (_, stops, _, _) in enumerate(rows):
+        for number, time in stops:
+            col = col_of.get(number)
+            if col is None or time is None:
+                continue
+            r_idx.append(i)
+            c_idx.append(col)
+            times.append(time.timestamp())
+    delays = [row[2] * 60 for row in rows]
+    stuck = [row[3] for row in rows]
+
+    if np is not None:
+        scheduled = np.full((n_rows, n_cols), np.nan)
+        if times:
+            scheduled[np.array(r_idx), np.array(c_idx)] = np.array(times)
+        eta = scheduled + np.array(delays, dtype=float).reshape(-1, 1)
+        eta[np.array(stuck, dtype=bool)] = np.nan
+    else:
+        scheduled = [[math.nan] * n_cols for _ in range(n_rows)]
+        for i, j, t in zip(r_idx, c_idx, times):
+            scheduled[i][j] = t
+        eta = [
+            [math.nan] * n_cols if stuck[i] else [t + delays[i] for t in scheduled[i]]
+            for i in range(n_rows)
+            ]
+
+    if predicted:
+        for i, wdf in enumerate(wdfs):
+            if stuck[i]:
+                continue
+            for number, time in predicted.get(wdf, {}).items():
+                col = col_of.get(number)
+                if col is None or math.isnan(float(scheduled[i][col])):
+                    continue
+                eta[i][col] = time.timestamp()
+
+    return ETAMatrix(wdfs, stations, scheduled, eta, stuck, created_at or datetime.datetime.now(JST))
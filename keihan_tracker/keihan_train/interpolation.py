@@ -0,0 +1,171 @@
+"""
+列車位置の補間。
+
+trainPositionListは1分程度ごとにしか更新されないため、地図上の列車は駅間の枠を飛び飛びに移動する。
+PositionInterpolatorは更新のたびに各列車の「直前の停車駅を発車した時刻」と「次の停車駅までの所要時間」を求めておき、
+任意の時刻における駅間の位置（隣り合う2駅と、その間の進み具合0〜1）を計算する。
+所要時間はSegmentModelの実測値があればそれを、なければ時刻表の駅間時間を使う。
+
+更新時に区間を求めておくため、描画ごとの計算は列車数に比例する四則演算のみで、1秒間に数回呼び出せる。
+
+    interpolator = PositionInterpolator(model)   # modelは省略可
+    interpolator.attach(tracker)
+    ...
+    for wdf, pos in interpolator.positions().items():
+        draw(pos.from_station, pos.to_station, pos.fraction)
+"""
+
+from typing import Optional, NamedTuple, TYPE_CHECKING
+import datetime
+import math
+from zoneinfo import ZoneInfo
+
+from . import stations_map
+
+if TYPE_CHECKING:
+    from .tracker import KHTracker, ActiveTrainData
+    from .segment_model import SegmentModel
+
+JST = ZoneInfo("Asia/Tokyo")
+
+
+class TrainPosition(NamedTuple):
+    """
+    補間した列車位置。from_stationからto_stationへfractionだけ進んだ位置にいる。
+    停車中はto_stationがNoneでfractionは0。
+    """
+    from_station: int
+    to_station:   Optional[int]
+    fraction:     float
+
+
+class _Leg:
+    """直前の停車駅から次の停車駅までの区間"""
+    __slots__ = ("stations", "start", "duration", "lower")
+
+    def __init__(self, stations: list[int], start: float, duration: float, lower: float) -> None:
+        self.stations = stations   # 区間内の駅番号（通過駅を含む、進行方向順）
+        self.start = start         # 区間の始点を発車した時刻（UNIX時間）
+        self.duration = duration   # 区間の所要時間（秒）
+        self.lower = lower         # 観測した位置（区間内の駅の位置、0〜len(stations)-1）。これより手前には戻さない
+
+
+class PositionInterpolator:
+    """
+    走行中の全列車の位置を補間する。
+    - model: 実測の駅間走行時間を持つSegmentModel。省略時は時刻表の駅間時間のみを使う
+    """
+    def __init__(self, model: Optional["SegmentModel"] = None) -> None:
+        self.model = model
+        self.legs: dict[int, _Leg] = {}
+        self.stopped: dict[int, int] = {}   # 停車中の列車（wdfBlockNo:駅番号）
+        self.tracker: Optional["KHTracker"] = None   # 最後に区間を求めたtracker。atの省略時はその現在時刻を使う
+
+    def attach(self, tracker: "KHTracker") -> None:
+        """fetch_posで列車が更新されるたびに区間を求め直すよう、trackerに登録する。"""
+        tracker.listeners.append(self.update)
+
+    def update(self, tracker: "KHTracker") -> None:
+        """走行中の全列車について、現在の区間と所要時間を求める。"""
+        self.legs = {}
+        self.stopped = {}
+        self.tracker = tracker
+        observed = tracker.train_position_list.fileCreatedTime if tracker.train_position_list else tracker.now()
+        for wdf, train in tracker.active_trains.items():
+            try:
+                if train.is_stopping:
+                    self.stopped[wdf] = train.next_station.station_number
+                    continue
+                leg = self._leg(train, observed)
+            except (ValueError, IndexError, KeyError):
+                continue
+            if leg is not None:
+                self.legs[wdf] = leg
+
+    def _leg(self, train: "ActiveTrainData", observed: datetime.datetime) -> Optional[_Leg]:
+        next_stop = train.next_stop_station
+        if next_stop is None:
+            return None
+        order = stations_map.line_stations(train.line, train.direction)
+        stops = train.stop_stations
+        stop_numbers = [stop.station.station_number for stop in stops]
+        target = next_stop.station_number
+        current = train.next_station.station_number
+        if target not in order or current not in order or target not in stop_numbers:
+            return None
+
+        # 直前の停車駅: 停車駅リストでnext_stop_stationの1つ前
+        index = stop_numbers.index(target)
+        if index == 0:
+            return None
+        previous = stops[index - 1]
+        origin = previous.station.station_number
+        if origin not in order:
+            return None
+        i, j = order.index(origin), order.index(target)
+        if i >= j:
+            return None
+        stations = order[i:j + 1]
+
+        # 発車時刻: 実測の発車時刻 → 時刻表＋遅延 の順に使う
+        delay = train.delay_minutes * 60
+        start: Optional[float] = None
+        track = self.model.tracks.get(train.wdfBlockNo) if self.model is not None else None
+        if track is not None and track.departed_from == origin and track.departed_at is not None:
+            start = track.departed_at.timestamp()
+        elif previous.time is not None:
+            start = previous.time.timestamp() + delay
+
+        # 所要時間: 実測 → 時刻表 の順に使う
+        duration: Optional[float] = None
+        if self.model is not None:
+            duration = self.model.expected_run(
+                train.line, train.direction, train.train_type.value, observed.hour, origin, target
+                )
+        if duration is None and previous.time is not None and stops[index].time is not None:
+            duration = (stops[index].time - previous.time).total_seconds()
+        # 観測時点ではcurrentの手前の駅間にいる
+        lower = max(0.0, stations.index(current) - 1.0) if current in stations else 0.0
+        if start is None or not duration or duration <= 0:
+            # 時刻がわからなければ、観測した駅間の中央に置く
+            return _Leg(stations, observed.timestamp(), math.inf, lower + 0.5)
+
+        # 推定が観測した駅間からずれていれば、観測に合うよう発車時刻をずらす
+        last = len(stations) - 1
+        t = observed.timestamp()
+        x = (t - start) / duration * last
+        if x < lower:
+            start = t - lower / last * duration
+        elif x > lower + 1:
+            start = t - (lower + 1) / last * duration
+        return _Leg(stations, start, duration, lower)
+
+    def position(self, wdf: int, at: Optional[datetime.datetime] = None) -> Optional[TrainPosition]:
+        """列車1本の補間位置。atを省略するとtrackerの現在時刻（記録の再生中なら再生中の時刻）を使う"""
+        at = at or self._now()
+        if wdf in self.stopped:
+            return TrainPosition(self.stopped[wdf], None, 0.0)
+        leg = self.legs.get(wdf)
+        if leg is None:
+            return None
+        return self._evaluate(leg, at.timestamp())
+
+    def _now(self) -> datetime.datetime:
+        return self.tracker.now() if self.tracker is not None else datetime.datetime.now(JST)
+
+    @staticmethod
+    def _evaluate(leg: _Leg, t: float) -> TrainPosition:
+        last = len(leg.stations) - 1
+        progress = (t - leg.start) / leg.duration if leg.duration != math.inf else 0.0
+        # 観測位置より手前には戻さず、次の停車駅の手前で止める（到着は次の更新で確定する）
+        x = min(max(progress * last, leg.lower), last - 1e-6)
+        k = int(x)
+        return TrainPosition(leg.stations[k], leg.stations[k + 1], x - k)
+
+    def positions(self, at: Optional[datetime.datetime] = None) -> dict[int, TrainPosition]:
+        """走行中の全列車の補間位置（wdfBlockNo:TrainPosition）。atの省略時はpositionと同じ"""
+        t = (at or self._now()).timestamp()
+        result = {wdf: TrainPosition(station, None, 0.0) for wdf, station in self.stopped.items()}
+        for wdf, leg in self.legs.items():
+            result[wdf] = self._evaluate(leg, t)
+        return result
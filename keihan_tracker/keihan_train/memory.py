@@ -0,0 +1,123 @@
+"""
+KHTrackerが保持しているデータのメモリ使用量の概算。
+
+KHTracker.memory_report() から使う。オブジェクトをたどって sys.getsizeof を合計するため、
+値はインタプリタ上の概算（アロケーターの余白などは含まない）だが、構造ごとの比較や、
+日中に増え続ける構造（保持したままの生データなど）の発見には十分な精度がある。
+
+複数の構造から参照されているオブジェクト（列車から参照される駅など）は、
+REPORT_ORDER の順で最初にたどった構造にだけ計上する。
+"""
+
+from typing import Any, Iterable
+from enum import Enum
+from functools import lru_cache
+import datetime
+import sys
+import types
+
+from pydantic import BaseModel
+from tabulate import tabulate
+
+# 中身をたどらない型（getsizeofのみ計上する）
+_LEAF_TYPES = (str, bytes, bytearray, int, float, complex, bool, datetime.date, datetime.time, datetime.timedelta, range)
+# 計上もしない型（クラス・関数・モジュールなど、データとして保持しているわけではないもの）
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, Enum)
+
+
+@lru_cache(maxsize=None)
+def _slot_names(cls: type) -> tuple[str, ...]:
+    names: list[str] = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(name for name in slots if name not in ("__dict__", "__weakref__"))
+    return tuple(names)
+
+
+def deep_sizeof(roots: Iterable[Any], seen: set[int]) -> tuple[int, int]:
+    """
+    rootsからたどれるオブジェクトの (バイト数, オブジェクト数)。
+    seenに含まれるオブジェクトはたどらず、たどったオブジェクトはseenに追加する。
+    """
+    size = 0
+    count = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        count += 1
+        if isinstance(obj, _LEAF_TYPES):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+            continue
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+            continue
+        d = getattr(obj, "__dict__", None)
+        if isinstance(d, dict):
+            stack.append(d)
+        for name in _slot_names(type(obj)):
+            stack.append(getattr(obj, name, None))
+    return size, count
+
+
+class MemoryUsage(BaseModel):
+    """
+    1つの構造のメモリ使用量。
+    - items: 構造に含まれる要素数（駅数・列車数・停車駅数など）
+    - objects: たどったPythonオブジェクトの数
+    - bytes: バイト数の概算
+    """
+    items:   int
+    objects: int
+    bytes:   int
+
+
+class MemoryReport(BaseModel):
+    """
+    KHTracker.memory_reportの結果。
+    - usages: 構造名:MemoryUsage（REPORT_ORDERの順）
+    """
+    usages: dict[str, MemoryUsage]
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(usage.bytes for usage in self.usages.values())
+
+    @property
+    def total_objects(self) -> int:
+        return sum(usage.objects for usage in self.usages.values())
+
+    def __getitem__(self, name: str) -> MemoryUsage:
+        return self.usages[name]
+
+    def __str__(self) -> str:
+        rows = [
+            [name, usage.items, usage.objects, f"{usage.bytes / 1024:,.1f}"]
+            for name, usage in self.usages.items()
+            ]
+        rows.append(["合計", "", self.total_objects, f"{self.total_bytes / 1024:,.1f}"])
+        return tabulate(rows, headers=["構造", "要素数", "オブジェクト数", "KiB"], colalign=("left", "right", "right", "right"))
+
+
+# 構造名と説明。この順でたどり、共有されているオブジェクトは先の構造に計上する
+REPORT_ORDER = {
+    "stations":            "駅（StationData）",
+    "route_stations":      "列車の停車駅リスト（StopStationData）",
+    "trains":              "予定・終了した列車（TrainData）",
+    "active_trains":       "走行中の列車（ActiveTrainData）",
+    "starttime_list":      "startTimeListのモデル",
+    "train_position_list": "trainPositionListのモデル",
+    "static":              "select_station・transferGuideInfo・FileList.xmlのモデル",
+    "departure_boards":    "発車標のキャッシュ",
+    "board_index":         "発車標の差分更新用の索引（列車ごとの状態・停車駅）",
+    "eta_matrix":          "ETA行列のキャッシュ",
+    "other":               "その他（スケジューラー・取得設定・listenersなど）",
+}
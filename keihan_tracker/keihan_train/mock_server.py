@@ -0,0 +1,361 @@
+"""
+京阪のAPIの代わりになるローカルのHTTPサーバー（負荷試験・オフライン開発用）。
+
+select_station.json・transferGuideInfo.json・trainPositionList.json・startTimeList.json・FileList.xml を
+本物と同じパスで返す。返す内容は次のいずれか。
+・フィクスチャのディレクトリ（上の4つのJSONファイル。write_fixturesで取得中のtrackerから作れる）
+・SnapshotRecorderの記録（ファイルまたはディレクトリ）。ファイルの更新のたびに次の記録へ進む
+本物と同じく一定の周期（cadence）でファイルを作り直し、fileCreatedTimeとFileList.xmlのtimeを更新する。
+
+遅延・エラー・応答の途中切断・無応答、内容の書き換え（mutate）を設定でき、
+KHTrackerの再試行・サーキットブレーカー・stale配信やポーリング周期の学習を、ネットワークなしで試せる。
+
+    async with MockKeihanServer("fixtures/", latency=(0.05, 0.3), error_rate=0.05) as server:
+        tracker = KHTracker(urls=server.urls)
+        await tracker.fetch_pos()
+
+コマンドラインからも起動できる。
+
+    python -m keihan_tracker.keihan_train.mock_server fixtures/ --port 8080 --latency 0.1 --error-rate 0.05
+    KEIHAN_API_BASE=http://127.0.0.1:8080 python check_stops_gui.py
+"""
+
+from typing import Optional, Any, Callable, TYPE_CHECKING
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import random
+from zoneinfo import ZoneInfo
+
+from .tracker import DEFAULT_URLS
+from .replay import ReplaySource, filelist_xml
+from .recorder import position_payload, dia_payload
+
+if TYPE_CHECKING:
+    from .tracker import KHTracker
+
+JST = ZoneInfo("Asia/Tokyo")
+
+# フィクスチャのディレクトリ内のファイル名（エンドポイント名:ファイル名）
+FIXTURE_FILES = {
+    endpoint: urlsplit(url).path.rsplit("/", 1)[-1]
+    for endpoint, url in DEFAULT_URLS.items()
+    if endpoint != "file_list"
+    }
+# ファイルの作り直しでfileCreatedTimeを更新するエンドポイント
+_GENERATED = ("train_position_list", "start_time_list")
+
+# 値またはエンドポイント名:値 の辞書
+PerEndpoint = Any
+
+
+def urls_for(base: str) -> dict[str, str]:
+    """本物のURLのホスト部分をbase（例: http://127.0.0.1:8080）に置き換えたurls。KHTracker(urls=...) に渡す。"""
+    base = base.rstrip("/")
+    return {endpoint: base + urlsplit(url).path for endpoint, url in DEFAULT_URLS.items()}
+
+
+def write_fixtures(tracker: "KHTracker", directory: str | Path) -> None:
+    """取得済みのtrackerのデータを、MockKeihanServerのフィクスチャとしてdirectoryに書き出す。"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    payloads: dict[str, Any] = {}
+    if tracker.select_station is not None:
+        payloads["select_station"] = tracker.select_station.model_dump()
+    if tracker.transfer_guide_info is not None:
+        payloads["transfer_guide_info"] = tracker.transfer_guide_info.model_dump()
+    if tracker.train_position_list is not None:
+        payloads["train_position_list"] = position_payload(tracker.train_position_list)
+    if tracker.starttime_list is not None:
+        payloads["start_time_list"] = dia_payload(tracker.starttime_list)
+    for endpoint, payload in payloads.items():
+        (directory / FIXTURE_FILES[endpoint]).write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+
+
+class MockKeihanServer:
+    """
+    京阪のAPIを模したHTTPサーバー。
+    - fixtures: フィクスチャのディレクトリ、またはSnapshotRecorderの記録（*.khrのファイル・ディレクトリ）
+    - host, port: 待ち受けるアドレス。port=0なら空いているポートを使う（start後に port で確認できる）
+    - cadence: ファイルを作り直す周期（秒）。本物はおよそ60秒
+    - latency: 応答までの遅延（秒）。数値、(最小, 最大) の一様乱数、またはエンドポイント名:それらの辞書
+    - error_rate: error_status を返す確率（数値またはエンドポイント名:確率）
+    - hang_rate: 応答せずに hang_time 秒待ってから切断する確率（タイムアウトの再現）
+    - truncate_rate: 本文を途中で切って返す確率（壊れたJSONの再現）
+    - mutate: ファイルを作り直すたびに (エンドポイント名, 内容のdict) を受け取り、返す内容のdictを返す関数
+    - seed: 乱数の種。指定すると障害の起こり方が毎回同じになる
+    """
+    def __init__(
+            self,
+            fixtures: str | Path,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            cadence: float = 60.0,
+            latency: PerEndpoint = 0.0,
+            error_rate: PerEndpoint = 0.0,
+            error_status: int = 503,
+            hang_rate: PerEndpoint = 0.0,
+            hang_time: float = 30.0,
+            truncate_rate: PerEndpoint = 0.0,
+            mutate: Optional[Callable[[str, dict[str, Any]], dict[str, Any]]] = None,
+            seed: Optional[int] = None
+            ) -> None:
+        self.host = host
+        self.port = port
+        self.cadence = cadence
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.truncate_rate = truncate_rate
+        self.mutate = mutate
+        self.random = random.Random(seed)
+        self.requests: Counter[str] = Counter()   # エンドポイント名:リクエスト数
+        self.faults: Counter[str] = Counter()     # 障害の種類:回数
+
+        path = Path(fixtures)
+        self._replay: Optional[ReplaySource] = None
+        self._fixtures: dict[str, Any] = {}
+        if path.is_file() or any(path.glob("*.khr")):
+            self._replay = ReplaySource(path)
+        else:
+            for endpoint, name in FIXTURE_FILES.items():
+                self._fixtures[endpoint] = json.loads((path / name).read_text(encoding="utf-8"))
+        self._paths = {urlsplit(url).path: endpoint for endpoint, url in DEFAULT_URLS.items()}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._started = 0.0
+        self._generation = -1
+        self.generated_at: Optional[datetime.datetime] = None   # 最後にファイルを作り直した時刻
+        self._bodies: dict[str, bytes] = {}
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}   # 接続中のクライアント
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def urls(self) -> dict[str, str]:
+        """KHTracker(urls=...) に渡すURL"""
+        return urls_for(self.base_url)
+
+    # --- 起動・停止 ---
+    async def start(self) -> None:
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._server = server
+        self._started = asyncio.get_running_loop().time()
+        self._regenerate()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # keep-aliveで待機中の接続も閉じる
+            for writer, task in list(self._connections.items()):
+                writer.close()
+                task.cancel()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if self._replay is not None:
+            # パスから開いた記録（インデックスのmmapとファイル）を閉じる
+            self._replay.close_recording()
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        assert isinstance(self._server, asyncio.Server)
+        await self._server.serve_forever()
+
+    async def __aenter__(self) -> "MockKeihanServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    # --- ファイルの作り直し ---
+    def _regenerate(self) -> None:
+        """cadenceの周期が変わっていれば、返す内容を作り直す。"""
+        elapsed = asyncio.get_running_loop().time() - self._started
+        generation = int(elapsed // self.cadence) if self.cadence > 0 else 0
+        if generation == self._generation:
+            return
+        steps = generation - self._generation
+        self._generation = generation
+        now = datetime.datetime.now(JST).replace(microsecond=0)
+        self.generated_at = now
+
+        if self._replay is not None:
+            for _ in range(steps):
+                if not self._replay.step():
+                    # 記録の終わりに達したら先頭から繰り返す（最初の記録の直前に戻る）
+                    first = self._replay.recording.first_time
+                    assert first is not None
+                    self._replay.seek(first - datetime.timedelta(seconds=1))
+                    self._replay.step()
+            payloads = {kind: record.payload for kind, record in self._replay.current.items()}
+        else:
+            payloads = self._fixtures
+
+        stamp = now.strftime("%Y%m%d%H%M%S")
+        bodies: dict[str, bytes] = {}
+        for endpoint, payload in payloads.items():
+            if endpoint in _GENERATED or self.mutate is not None:
+                payload = copy.deepcopy(payload)
+            if endpoint in _GENERATED:
+                payload["fileCreatedTime"] = stamp
+            if self.mutate is not None:
+                payload = self.mutate(endpoint, payload)
+            bodies[endpoint] = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        bodies["file_list"] = filelist_xml(now).encode("utf-8")
+        self._bodies = bodies
+
+    # --- 障害の設定 ---
+    @staticmethod
+    def _for(value: PerEndpoint, endpoint: str) -> Any:
+        if isinstance(value, dict):
+            return value.get(endpoint, 0.0)
+        return value
+
+    def _latency(self, endpoint: str) -> float:
+        value = self._for(self.latency, endpoint)
+        if isinstance(value, (tuple, list)):
+            return self.random.uniform(*value)
+        return float(value)
+
+    def _happens(self, rate: PerEndpoint, endpoint: str) -> bool:
+        probability = self._for(rate, endpoint)
+        return probability > 0 and self.random.random() < probability
+
+    # --- HTTP ---
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        self._connections[writer] = task
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "connection" and value.strip().lower() == "close":
+                        keep_alive = False
+                parts = request_line.decode("latin-1").split()
+                path = urlsplit(parts[1]).path if len(parts) >= 2 else ""
+                if not await self._respond(writer, path, keep_alive):
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # stop()で閉じた接続も含め、切断はここで終える
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, path: str, keep_alive: bool) -> bool:
+        """応答を書く。接続を切った場合はFalse"""
+        endpoint = self._paths.get(path)
+        if endpoint is None:
+            await self._write(writer, 404, b"not found", "text/plain", keep_alive)
+            return True
+        self.requests[endpoint] += 1
+
+        delay = self._latency(endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._happens(self.hang_rate, endpoint):
+            self.faults["hang"] += 1
+            await asyncio.sleep(self.hang_time)
+            return False
+        if self._happens(self.error_rate, endpoint):
+            self.faults["error"] += 1
+            await self._write(writer, self.error_status, b"error", "text/plain", keep_alive)
+            return True
+
+        self._regenerate()
+        body = self._bodies.get(endpoint)
+        if body is None:
+            await self._write(writer, 404, b"not found", "text/plain", keep_alive)
+            return True
+        content_type = "application/xml" if endpoint == "file_list" else "application/json"
+        if self._happens(self.truncate_rate, endpoint):
+            # Content-Lengthどおりに送らずに切断する
+            self.faults["truncate"] += 1
+            await self._write(writer, 200, body, content_type, False, limit=len(body) // 2)
+            return False
+        await self._write(writer, 200, body, content_type, keep_alive)
+        return True
+
+    @staticmethod
+    async def _write(
+            writer: asyncio.StreamWriter,
+            status: int,
+            body: bytes,
+            content_type: str,
+            keep_alive: bool,
+            limit: Optional[int] = None
+            ) -> None:
+        reason = {200: "OK", 404: "Not Found"}.get(status, "Error")
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+            ).encode("latin-1")
+        writer.write(head + (body if limit is None else body[:limit]))
+        await writer.drain()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="京阪のAPIを模したローカルのHTTPサーバー")
+    parser.add_argument("fixtures", help="フィクスチャのディレクトリ、またはSnapshotRecorderの記録")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cadence", type=float, default=60.0, help="ファイルを作り直す周期（秒）")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0], help="遅延（秒）。2つ指定すると一様乱数")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockKeihanServer(
+        args.fixtures,
+        host=args.host,
+        port=args.port,
+        cadence=args.cadence,
+        latency=tuple(args.latency) if len(args.latency) > 1 else args.latency[0],
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+        truncate_rate=args.truncate_rate,
+        seed=args.seed,
+        )
+
+    async def run() -> None:
+        await server.start()
+        print(f"Serving Keihan API stand-in on {server.base_url}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
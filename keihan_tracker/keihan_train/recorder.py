@@ -0,0 +1,809 @@
+"""
+trainPositionList・startTimeListの記録。
+
+1日に約1,440回取得するtrainPositionListをJSONのまま保存すると大きく、読み返すのも遅い。
+SnapshotRecorderはfetch_posのたびに取得したデータを列指向の形式で1つのファイルに追記する。
+
+【データファイル】
+・先頭にMAGIC、以降はブロックの連続。ブロックは独立したzlibストリームで、レコードごとにフラッシュして追記する。
+・trainPositionListのレコードは、列車・位置ごとの値を列（カラム）ごとにまとめて格納する。
+  文字列はブロック内の辞書の番号に置き換え、すべての列を整数列として扱う。
+  列車の列は同じwdfBlockNoの前回の値との差分、位置の列は前回の同じ順番の位置との差分を、
+  zigzag符号化した可変長整数で書く。ほとんどの値は変化しないため0が並び、zlibでよく縮む。
+・ブロックの最初のtrainPositionListは差分の基準を持たない（キーフレーム）。
+  keyframe_interval件ごと、およびstartTimeListを記録するたびに新しいブロックを始める。
+・startTimeListと、記録を始めたときのselect_station・transferGuideInfoは1件で1ブロックとし、JSONをそのまま圧縮する。
+
+【インデックスファイル】（データファイル名 + ".idx"）
+・レコードごとに固定長（INDEX_FORMAT）で 時刻・ブロックの位置・ブロック内の位置・種類 を書く。
+  時刻はtrainPositionListならfileCreatedTime、それ以外は記録した時点の最新のfileCreatedTimeで、ファイル内で単調に増える。
+・読み出し時はmmapで開き、時刻で二分探索する。ファイル全体を読み込まないため、長期間の記録でも開くのは一瞬で済む。
+  ある時刻の状態は、直前のキーフレームからその時刻までの差分だけを展開して復元する（SnapshotReader.state_at）。
+
+書き込みは専用のスレッドで行うため、fetch_posのリスナーとしてはキューに入れるだけで戻る。
+
+    recorder = SnapshotRecorder("positions.khr")
+    recorder.attach(tracker)
+    ...
+    recorder.close()
+
+    for record in SnapshotReader("positions.khr"):
+        print(record.kind, record.time, record.payload)
+
+    tracker = await KHTracker.at(datetime.datetime(2024, 5, 1, 8, 12, tzinfo=JST), "recordings/")
+"""
+
+from typing import Optional, Iterator, Iterable, NamedTuple, Any, Sequence, TYPE_CHECKING
+from pathlib import Path
+import bisect
+import datetime
+import json
+import mmap
+import queue
+import struct
+import threading
+import warnings
+import zlib
+from zoneinfo import ZoneInfo
+
+from .schemes import trainPositionList, startTimeList, SelectStation, TransferGuideInfo
+
+if TYPE_CHECKING:
+    from .tracker import KHTracker
+
+JST = ZoneInfo("Asia/Tokyo")
+
+MAGIC = b"KHREC1\n"
+# fileCreatedTime（UNIX時間）, ブロックの位置, ブロック内の位置（展開後）, 種類
+INDEX_FORMAT = struct.Struct("<qQIB3x")
+_INDEX_KIND_OFFSET = struct.calcsize("<qQI")   # インデックスのレコード内の種類の位置
+
+KIND_POSITION = 0   # trainPositionList
+KIND_DIA = 1        # startTimeList
+KIND_SELECT_STATION = 2
+KIND_TRANSFER_GUIDE_INFO = 3
+# KHTrackerのエンドポイント名と同じ
+KIND_NAMES = {
+    KIND_POSITION: "train_position_list",
+    KIND_DIA: "start_time_list",
+    KIND_SELECT_STATION: "select_station",
+    KIND_TRANSFER_GUIDE_INFO: "transfer_guide_info",
+    }
+KIND_CODES = {name: code for code, name in KIND_NAMES.items()}
+
+# レコードの見出し: 種類, 本体の長さ
+_RECORD_HEADER = struct.Struct("<BI")
+
+# 1. 位置（LocationObject）の列
+_LOCATION_INTS = ("locationCol", "locationRow", "trainDirection")
+_LOCATION_STRS = ("delay", "delayEn", "delayKo", "delayZhCn", "delayZhTw",
+                  "trainIconTypeImageJp", "trainTypeVisIconVis")
+# 2. 列車（trainInfoObject）の列。wdfBlockNoは別に扱う
+_TRAIN_INTS = ("carsOfTrain", "destStationCode", "destStationNumber", "lastPassStation")
+_TRAIN_STRS = ("delayMinutes", "delayMinutesEn", "delayMinutesKo", "delayMinutesZhCn", "delayMinutesZhTw",
+               "destStationNameEn", "destStationNameJp", "destStationNameKo", "destStationNameZhCn",
+               "destStationNameZhTw", "trainNumber", "trainTypeEn", "trainTypeIcon", "trainTypeJp",
+               "trainTypeKo", "trainTypeZhCn", "trainTypeZhTw")
+# 臨時列車はtrainTypeJpにこの接頭辞が付く（schemes.trainInfoObject.check_type_special）
+_SPECIAL_PREFIX = "臨時　　　　"
+
+
+class Record(NamedTuple):
+    """
+    記録した1件のデータ。
+    - kind: "train_position_list", "start_time_list", "select_station", "transfer_guide_info" のいずれか
+    - time: 記録した時刻（trainPositionListならfileCreatedTime）
+    - payload: APIが返すJSONと同じ形のdict
+    """
+    kind:    str
+    time:    datetime.datetime
+    payload: dict[str, Any]
+
+
+class IndexEntry(NamedTuple):
+    time:   int   # 記録した時刻（UNIX時間）
+    block:  int   # ブロックの先頭のファイル内の位置
+    offset: int   # ブロックを展開したデータ内でのレコードの位置
+    kind:   int
+
+
+# --- 生のJSONへの変換 ---
+def _format_time(time: datetime.datetime) -> str:
+    return time.astimezone(JST).strftime("%Y%m%d%H%M%S")
+
+
+def position_payload(position_list: trainPositionList) -> dict[str, Any]:
+    """パース済みのtrainPositionListを、APIが返すJSONと同じ形のdictに戻す。"""
+    payload = position_list.model_dump()
+    payload["fileCreatedTime"] = _format_time(position_list.fileCreatedTime)
+    for location in payload["locationObjects"]:
+        for train in location["trainInfoObjects"]:
+            special = train.pop("is_special")
+            train["trainTypeJp"] = (_SPECIAL_PREFIX if special else "") + train["trainTypeJp"].value
+    return payload
+
+
+def dia_payload(starttime_list: startTimeList) -> dict[str, Any]:
+    """パース済みのstartTimeListを、APIが返すJSONと同じ形のdictに戻す。"""
+    payload = starttime_list.model_dump()
+    payload["fileCreatedTime"] = _format_time(starttime_list.fileCreatedTime)
+    return payload
+
+
+# --- 可変長整数 ---
+def _write_varint(out: bytearray, value: int) -> None:
+    # zigzag符号化で負の差分も小さな正の数にする
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes | memoryview, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos
+
+
+class _ColumnCodec:
+    """
+    trainPositionListと列形式のバイト列の相互変換。差分の基準（前回の値・文字列辞書）を持つため、
+    エンコード側とデコード側で同じ順番に同じレコードを通す。reset()でキーフレームの状態に戻る。
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.strings: list[str] = []
+        self.string_ids: dict[str, int] = {}
+        self.prev_locations: list[tuple[int, ...]] = []
+        self.prev_trains: dict[int, tuple[int, ...]] = {}
+
+    def _string_id(self, value: str, new: list[str]) -> int:
+        index = self.string_ids.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = index
+            new.append(value)
+        return index
+
+    def encode(self, payload: dict[str, Any]) -> bytes:
+        new_strings: list[str] = []
+        sid = self._string_id
+        header = (
+            int(datetime.datetime.strptime(payload["fileCreatedTime"], "%Y%m%d%H%M%S").replace(tzinfo=JST).timestamp()),
+            sid(payload["fileVersion"], new_strings),
+            sid(payload["linkNum"], new_strings),
+            )
+
+        locations: list[tuple[int, ...]] = []
+        wdfs: list[int] = []
+        trains: list[tuple[int, ...]] = []
+        for location in payload["locationObjects"]:
+            infos = location["trainInfoObjects"]
+            locations.append(
+                tuple(location[key] for key in _LOCATION_INTS)
+                + tuple(sid(location[key], new_strings) for key in _LOCATION_STRS)
+                + (len(infos),)
+                )
+            for info in infos:
+                wdfs.append(info["wdfBlockNo"])
+                trains.append(
+                    tuple(info[key] for key in _TRAIN_INTS)
+                    + tuple(sid(info[key], new_strings) for key in _TRAIN_STRS)
+                    )
+
+        out = bytearray()
+        for value in header:
+            _write_varint(out, value)
+        _write_varint(out, len(new_strings))
+        for value in new_strings:
+            raw = value.encode("utf-8")
+            _write_varint(out, len(raw))
+            out += raw
+        _write_varint(out, len(locations))
+        _write_varint(out, len(trains))
+
+        # 位置: 前回の同じ順番の位置との差分を列ごとに
+        prev_locations = self.prev_locations
+        width = len(_LOCATION_INTS) + len(_LOCATION_STRS) + 1
+        zero = (0,) * width
+        bases = [prev_locations[i] if i < len(prev_locations) else zero for i in range(len(locations))]
+        for column in range(width):
+            for row, base in zip(locations, bases):
+                _write_varint(out, row[column] - base[column])
+        # wdfBlockNo: 直前の列車との差分
+        previous = 0
+        for wdf in wdfs:
+            _write_varint(out, wdf - previous)
+            previous = wdf
+        # 列車: 前回の同じ列車（wdfBlockNo）との差分を列ごとに
+        width = len(_TRAIN_INTS) + len(_TRAIN_STRS)
+        zero = (0,) * width
+        bases = [self.prev_trains.get(wdf, zero) for wdf in wdfs]
+        for column in range(width):
+            for row, base in zip(trains, bases):
+                _write_varint(out, row[column] - base[column])
+
+        self.prev_locations = locations
+        self.prev_trains = dict(zip(wdfs, trains))
+        return bytes(out)
+
+    def decode(self, data: bytes | memoryview, build: bool = True) -> Optional[dict[str, Any]]:
+        """
+        レコードを復元する。build=Falseなら差分の基準だけを進めてdictは組み立てない
+        （キーフレームから目的のレコードまでの途中を読み飛ばすため）。
+        """
+        pos = 0
+        time, pos = _read_varint(data, pos)
+        version, pos = _read_varint(data, pos)
+        link, pos = _read_varint(data, pos)
+        n_new, pos = _read_varint(data, pos)
+        for _ in range(n_new):
+            length, pos = _read_varint(data, pos)
+            value = bytes(data[pos:pos + length]).decode("utf-8")
+            pos += length
+            self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        n_locations, pos = _read_varint(data, pos)
+        n_trains, pos = _read_varint(data, pos)
+
+        prev_locations = self.prev_locations
+        width = len(_LOCATION_INTS) + len(_LOCATION_STRS) + 1
+        zero = (0,) * width
+        location_columns: list[list[int]] = []
+        for column in range(width):
+            values = []
+            for i in range(n_locations):
+                delta, pos = _read_varint(data, pos)
+                base = prev_locations[i] if i < len(prev_locations) else zero
+                values.append(base[column] + delta)
+            location_columns.append(values)
+        wdfs: list[int] = []
+        previous = 0
+        for _ in range(n_trains):
+            delta, pos = _read_varint(data, pos)
+            previous += delta
+            wdfs.append(previous)
+        width = len(_TRAIN_INTS) + len(_TRAIN_STRS)
+        zero = (0,) * width
+        bases = [self.prev_trains.get(wdf, zero) for wdf in wdfs]
+        train_columns: list[list[int]] = []
+        for column in range(width):
+            values = []
+            for base in bases:
+                delta, pos = _read_varint(data, pos)
+                values.append(base[column] + delta)
+            train_columns.append(values)
+
+        locations = list(zip(*location_columns)) if n_locations else []
+        trains = list(zip(*train_columns)) if n_trains else []
+        self.prev_locations = locations
+        self.prev_trains = dict(zip(wdfs, trains))
+        if not build:
+            return None
+
+        # APIのJSONと同じ形に組み立てる
+        strings = self.strings
+        n_int = len(_LOCATION_INTS)
+        location_objects = []
+        cursor = 0
+        for row in locations:
+            location: dict[str, Any] = {key: row[i] for i, key in enumerate(_LOCATION_INTS)}
+            for i, key in enumerate(_LOCATION_STRS):
+                location[key] = strings[row[n_int + i]]
+            infos = []
+            for _ in range(row[-1]):
+                train_row = trains[cursor]
+                info: dict[str, Any] = {"wdfBlockNo": wdfs[cursor]}
+                for i, key in enumerate(_TRAIN_INTS):
+                    info[key] = train_row[i]
+                for i, key in enumerate(_TRAIN_STRS):
+                    info[key] = strings[train_row[len(_TRAIN_INTS) + i]]
+                infos.append(info)
+                cursor += 1
+            location["trainInfoObjects"] = infos
+            location_objects.append(location)
+        return {
+            "fileCreatedTime": _format_time(datetime.datetime.fromtimestamp(time, JST)),
+            "fileVersion": strings[version],
+            "linkNum": strings[link],
+            "locationObjects": location_objects,
+            }
+
+
+class SnapshotRecorder:
+    """
+    取得したtrainPositionList・startTimeListをファイルに追記する。
+    - path: データファイル。既にあれば続きに追記する
+    - keyframe_interval: この件数ごとに差分の基準を捨てて新しいブロックを始める。
+      小さいほど途中からの読み出しが速く、大きいほどファイルが小さい
+    - level: zlibの圧縮レベル
+    書き込みはバックグラウンドのスレッドで行う。書き込み中のエラーは last_error に入り、
+    失敗が続く間の最初の1回だけ RuntimeWarning を出す。
+    """
+    def __init__(self, path: str | Path, keyframe_interval: int = 60, level: int = 6) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.last_error: Optional[Exception] = None
+        self._failing: bool = False                                   # 直前の書き込みが失敗したか
+        self.last_position_time: Optional[datetime.datetime] = None   # 最後に記録したtrainPositionListのfileCreatedTime
+        self.last_dia_time: Optional[datetime.datetime] = None        # 最後に記録したstartTimeListのfileCreatedTime
+        self._last_stamp: Optional[datetime.datetime] = None          # インデックスに書いた最後の時刻
+        self._static: dict[int, Any] = {}                             # 記録済みのselect_station・transferGuideInfo
+
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        self._data = open(self.path, "ab")
+        self._index = open(self.index_path, "ab")
+        if new:
+            self._data.write(MAGIC)
+            self._data.flush()
+        # 途中で中断した書き込みがあっても、インデックスは完全なレコードだけを指すよう固定長の倍数に揃える
+        self._index.truncate(self._index.tell() - self._index.tell() % INDEX_FORMAT.size)
+        self._index.seek(0, 2)
+
+        self._codec = _ColumnCodec()
+        self._compressor: Optional[Any] = None
+        self._block = 0         # 書き込み中のブロックの位置
+        self._block_size = 0    # 書き込み中のブロックの展開後の大きさ
+        self._block_count = 0   # 書き込み中のブロックのtrainPositionListの件数
+
+        self._queue: queue.Queue[Optional[tuple[int, datetime.datetime, Any]]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="SnapshotRecorder", daemon=True)
+        self._thread.start()
+
+    # --- 記録 ---
+    def attach(self, tracker: "KHTracker") -> None:
+        """fetch_posで列車が更新されるたびに記録するよう、trackerに登録する。"""
+        tracker.listeners.append(self.record_tracker)
+
+    def record_tracker(self, tracker: "KHTracker") -> None:
+        """trackerの最新のデータのうち、前回から変わったものを記録する。"""
+        position_list = tracker.train_position_list
+        time = position_list.fileCreatedTime if position_list is not None else None
+        # 記録から状態を復元するときに駅・ダイヤを先に得られるよう、trainPositionListより先に書く
+        if tracker.select_station is not None:
+            self.record_static(tracker.select_station, time)
+        if tracker.transfer_guide_info is not None:
+            self.record_static(tracker.transfer_guide_info, time)
+        if tracker.starttime_list is not None:
+            self.record_dia(tracker.starttime_list, time)
+        if position_list is not None:
+            self.record_position(position_list)
+
+    def _stamp(self, time: Optional[datetime.datetime]) -> datetime.datetime:
+        # インデックスの時刻はファイル内で単調に増やす（時刻での二分探索のため）
+        time = time or datetime.datetime.now(JST)
+        if self._last_stamp is not None and time < self._last_stamp:
+            time = self._last_stamp
+        self._last_stamp = time
+        return time
+
+    def record_position(self, position_list: trainPositionList) -> None:
+        if self.last_position_time is not None and position_list.fileCreatedTime <= self.last_position_time:
+            return
+        self.last_position_time = position_list.fileCreatedTime
+        self._queue.put((KIND_POSITION, self._stamp(position_list.fileCreatedTime), position_list))
+
+    def record_dia(self, starttime_list: startTimeList, time: Optional[datetime.datetime] = None) -> None:
+        """
+        startTimeListを記録する。
+        - time: 記録する時刻。省略時はstartTimeListのfileCreatedTime
+        """
+        if self.last_dia_time is not None and starttime_list.fileCreatedTime <= self.last_dia_time:
+            return
+        self.last_dia_time = starttime_list.fileCreatedTime
+        self._queue.put((KIND_DIA, self._stamp(time or starttime_list.fileCreatedTime), starttime_list))
+
+    def record_static(self, data: SelectStation | TransferGuideInfo, time: Optional[datetime.datetime] = None) -> None:
+        """select_station・transferGuideInfoを記録する。前回記録したものと同じオブジェクトなら何もしない。"""
+        kind = KIND_SELECT_STATION if isinstance(data, SelectStation) else KIND_TRANSFER_GUIDE_INFO
+        if self._static.get(kind) is data:
+            return
+        self._static[kind] = data
+        self._queue.put((kind, self._stamp(time), data))
+
+    def flush(self) -> None:
+        """キューに入っている記録をすべて書き終えるまで待つ。"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """残りの記録を書き終えてファイルを閉じる。書き込みのスレッドが止まっていてもファイルは閉じる。"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._data.closed:
+            return
+        try:
+            self._end_block()
+        except Exception as e:
+            self.last_error = e
+            warnings.warn(f"{self.path} への記録の書き込みに失敗しました: {e!r}", RuntimeWarning)
+        finally:
+            self._compressor = None
+            self._data.close()
+            self._index.close()
+
+    def __enter__(self) -> "SnapshotRecorder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # --- 書き込み（スレッド上） ---
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                kind, time, model = item
+                if kind == KIND_POSITION:
+                    self._write_position(time, model)
+                elif kind == KIND_DIA:
+                    self._write_json(kind, time, dia_payload(model))
+                else:
+                    self._write_json(kind, time, model.model_dump())
+                self._failing = False
+            except Exception as e:
+                self.last_error = e
+                if not self._failing:
+                    # 書き込みのたびに失敗し続ける場合（ディスクの容量不足など）に警告を繰り返さない
+                    self._failing = True
+                    warnings.warn(f"{self.path} への記録の書き込みに失敗しました: {e!r}", RuntimeWarning)
+                # 差分の基準が書いた内容とずれないよう、次はキーフレームから始める
+                # ブロックを閉じる書き込みも失敗しうる（ディスクの容量不足など）が、スレッドは止めない
+                try:
+                    self._end_block()
+                except Exception:
+                    pass
+                self._compressor = None
+            finally:
+                self._queue.task_done()
+
+    def _start_block(self) -> None:
+        self._block = self._data.tell()
+        self._block_size = 0
+        self._block_count = 0
+        self._compressor = zlib.compressobj(self.level)
+        self._codec.reset()
+
+    def _end_block(self) -> None:
+        if self._compressor is None:
+            return
+        self._data.write(self._compressor.flush(zlib.Z_FINISH))
+        self._data.flush()
+        self._compressor = None
+
+    def _append(self, kind: int, time: datetime.datetime, body: bytes) -> None:
+        assert self._compressor is not None
+        offset = self._block_size
+        chunk = _RECORD_HEADER.pack(kind, len(body)) + body
+        self._data.write(self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._data.flush()
+        self._block_size += len(chunk)
+        # データを書き終えてからインデックスを書く（インデックスが未完のレコードを指さないように）
+        self._index.write(INDEX_FORMAT.pack(int(time.timestamp()), self._block, offset, kind))
+        self._index.flush()
+
+    def _write_position(self, time: datetime.datetime, position_list: trainPositionList) -> None:
+        if self._compressor is None or self._block_count >= self.keyframe_interval:
+            self._end_block()
+            self._start_block()
+        body = self._codec.encode(position_payload(position_list))
+        self._append(KIND_POSITION, time, body)
+        self._block_count += 1
+
+    def _write_json(self, kind: int, time: datetime.datetime, payload: dict[str, Any]) -> None:
+        # ダイヤ・駅データは単独のブロックにし、続くtrainPositionListはキーフレームから始める
+        self._end_block()
+        self._start_block()
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._append(kind, time, body)
+        self._end_block()
+
+
+
+
+class _IndexView(Sequence[IndexEntry]):
+    """インデックスファイルをmmapで開き、IndexEntryの列として読む。"""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._len = 0
+        self._sparse: Optional[dict[int, list[int]]] = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """記録中のファイルに追記された分を読めるよう、開き直す。"""
+        self.close()
+        self._sparse = None
+        size = self.path.stat().st_size if self.path.exists() else 0
+        self._len = size // INDEX_FORMAT.size
+        if self._len == 0:
+            return
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), self._len * INDEX_FORMAT.size, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        assert self._map is not None
+        return IndexEntry(*INDEX_FORMAT.unpack_from(self._map, index * INDEX_FORMAT.size))
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        if self._map is None:
+            return iter(())
+        return (IndexEntry(*values) for values in INDEX_FORMAT.iter_unpack(self._map))
+
+    def time_of(self, index: int) -> int:
+        assert self._map is not None
+        return struct.unpack_from("<q", self._map, index * INDEX_FORMAT.size)[0]
+
+    def bisect(self, time: int) -> int:
+        """時刻がtime以下の最後のレコードの次の位置"""
+        return bisect.bisect_right(range(self._len), time, key=self.time_of)
+
+    def sparse_kinds(self) -> dict[int, list[int]]:
+        """
+        trainPositionList以外の種類ごとの、レコードの位置（昇順）。
+        ダイヤ・駅データは記録を始めたときとダイヤの更新時にしか書かれず、長期間の記録では遠く離れているため、
+        最新のものを後ろから1件ずつ探さずに済むよう、初回に種類の列だけを取り出して作っておく。
+        """
+        if self._sparse is None:
+            self._sparse = {kind: [] for kind in KIND_NAMES if kind != KIND_POSITION}
+            if self._map is not None:
+                kinds = self._map[_INDEX_KIND_OFFSET::INDEX_FORMAT.size]
+                for kind, positions in self._sparse.items():
+                    code = bytes([kind])
+                    i = kinds.find(code)
+                    while i != -1:
+                        positions.append(i)
+                        i = kinds.find(code, i + 1)
+        return self._sparse
+
+
+class SnapshotReader:
+    """
+    SnapshotRecorderで記録したファイルを読む。
+    - path: データファイル（インデックスは path + ".idx"）
+    インデックスはmmapで開くので、記録が長期間に及んでもファイル全体を読み込まない。
+    記録中のファイルを読む場合は、refresh()で追記された分を読めるようにする。
+    """
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.entries = _IndexView(self.index_path)
+        self._json_cache: dict[int, dict[str, Any]] = {}   # ブロックの位置:復元したJSON（ダイヤ・駅データ）
+
+    def refresh(self) -> None:
+        self.entries.refresh()
+
+    def close(self) -> None:
+        self.entries.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def first_time(self) -> Optional[datetime.datetime]:
+        return datetime.datetime.fromtimestamp(self.entries.time_of(0), JST) if len(self.entries) else None
+
+    @property
+    def last_time(self) -> Optional[datetime.datetime]:
+        return datetime.datetime.fromtimestamp(self.entries.time_of(len(self.entries) - 1), JST) if len(self.entries) else None
+
+    def times(self, kind: str = "train_position_list") -> list[datetime.datetime]:
+        """記録したデータの時刻の一覧"""
+        code = KIND_CODES[kind]
+        return [datetime.datetime.fromtimestamp(e.time, JST) for e in self.entries if e.kind == code]
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.records()
+
+    def _open(self):
+        f = open(self.path, "rb")
+        if f.read(len(MAGIC)) != MAGIC:
+            f.close()
+            raise ValueError(f"{self.path} は記録ファイルではありません")
+        return f
+
+    def records(
+            self,
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None
+            ) -> Iterator[Record]:
+        """時刻がstart以上end未満の記録を、記録した順に返す。"""
+        first = self.entries.bisect(int(start.timestamp()) - 1) if start is not None else 0
+        last = self.entries.bisect(int(end.timestamp()) - 1) if end is not None else len(self.entries)
+        if first >= last:
+            return
+        # 範囲の先頭がブロックの途中なら、ブロックの先頭（キーフレーム）から差分をたどる
+        block = self.entries[first].block
+        while first > 0 and self.entries[first - 1].block == block:
+            first -= 1
+        lo = start.timestamp() if start is not None else -float("inf")
+        with self._open() as f:
+            group: list[IndexEntry] = []
+            for entry in self.entries[first:last]:
+                if group and entry.block != group[0].block:
+                    yield from self._read_group(f, group, lo)
+                    group = []
+                group.append(entry)
+            if group:
+                yield from self._read_group(f, group, lo)
+
+    def _read_group(self, f, entries: list[IndexEntry], lo: float) -> Iterator[Record]:
+        """同じブロックのレコードを先頭から順に復元する。"""
+        data = _read_block(f, entries[0].block, entries[-1].offset)
+        codec = _ColumnCodec()
+        for entry in entries:
+            wanted = lo <= entry.time
+            payload = self._decode(data, entry, codec, build=wanted)
+            if wanted and payload is not None:
+                yield Record(KIND_NAMES[entry.kind], datetime.datetime.fromtimestamp(entry.time, JST), payload)
+
+    def _decode(self, data: memoryview, entry: IndexEntry, codec: _ColumnCodec, build: bool = True) -> Optional[dict[str, Any]]:
+        kind, length = _RECORD_HEADER.unpack_from(data, entry.offset)
+        body = data[entry.offset + _RECORD_HEADER.size:entry.offset + _RECORD_HEADER.size + length]
+        if kind == KIND_POSITION:
+            return codec.decode(body, build)
+        return json.loads(bytes(body)) if build else None
+
+    def state_at(self, time: datetime.datetime) -> dict[str, Record]:
+        """
+        time時点で最新だった各データ（種類:Record）を返す。記録がない種類は含まない。
+        インデックスを二分探索し、trainPositionListは直前のキーフレームから差分をたどって復元する。
+        ダイヤ・駅データは種類ごとの位置の一覧を二分探索するため、記録の長さによらず一定の時間で探せる。
+        """
+        end = self.entries.bisect(int(time.timestamp()))
+        found: dict[int, IndexEntry] = {}
+        for kind, positions in self.entries.sparse_kinds().items():
+            k = bisect.bisect_left(positions, end)
+            if k:
+                found[kind] = self.entries[positions[k - 1]]
+        # trainPositionListはほぼすべてのレコードなので、間にあるダイヤ・駅データの分だけ戻れば見つかる
+        position_index: Optional[int] = None
+        for i in range(end - 1, -1, -1):
+            entry = self.entries[i]
+            if entry.kind == KIND_POSITION:
+                found[KIND_POSITION] = entry
+                position_index = i
+                break
+        if not found:
+            return {}
+
+        state: dict[str, Record] = {}
+        with self._open() as f:
+            for kind, entry in found.items():
+                if kind == KIND_POSITION:
+                    assert position_index is not None
+                    first = position_index
+                    while first > 0 and self.entries[first - 1].block == entry.block:
+                        first -= 1
+                    group = self.entries[first:position_index + 1]
+                    data = _read_block(f, entry.block, entry.offset)
+                    codec = _ColumnCodec()
+                    for previous in group[:-1]:
+                        self._decode(data, previous, codec, build=False)
+                    payload = self._decode(data, entry, codec)
+                else:
+                    # ダイヤ・駅データは大きいので、復元したものを使い回す
+                    payload = self._json_cache.get(entry.block)
+                    if payload is None:
+                        payload = self._decode(_read_block(f, entry.block, entry.offset), entry, _ColumnCodec())
+                        if len(self._json_cache) >= 8:
+                            self._json_cache.clear()
+                        self._json_cache[entry.block] = payload
+                assert payload is not None
+                state[KIND_NAMES[kind]] = Record(KIND_NAMES[kind], datetime.datetime.fromtimestamp(entry.time, JST), payload)
+        return state
+
+
+class SnapshotArchive:
+    """
+    複数の記録ファイル（日ごとに分けたものなど）をまとめて読む。
+    - paths: 記録ファイルのリスト、またはそれらを含むディレクトリ（*.khr）
+    時刻から記録ファイルを二分探索で選ぶため、ファイル数が増えても読み出しの時間はほとんど変わらない。
+    """
+    def __init__(self, paths: str | Path | Iterable[str | Path]) -> None:
+        if isinstance(paths, (str, Path)):
+            paths = sorted(Path(paths).glob("*.khr"))
+        readers = [SnapshotReader(path) for path in paths]
+        self.readers: list[SnapshotReader] = sorted(
+            (reader for reader in readers if len(reader)), key=lambda reader: reader.entries.time_of(0)
+            )
+        self._starts = [reader.entries.time_of(0) for reader in self.readers]
+
+    def close(self) -> None:
+        for reader in self.readers:
+            reader.close()
+
+    @property
+    def first_time(self) -> Optional[datetime.datetime]:
+        return self.readers[0].first_time if self.readers else None
+
+    def __enter__(self) -> "SnapshotArchive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def records(
+            self,
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None
+            ) -> Iterator[Record]:
+        for reader in self.readers:
+            yield from reader.records(start, end)
+
+    def state_at(self, time: datetime.datetime) -> dict[str, Record]:
+        """time時点で最新だった各データ。そのファイルに記録のない種類は、それより前のファイルから探す。"""
+        state: dict[str, Record] = {}
+        i = bisect.bisect_right(self._starts, int(time.timestamp()))
+        for reader in reversed(self.readers[:i]):
+            for kind, record in reader.state_at(time).items():
+                state.setdefault(kind, record)
+            if len(state) == len(KIND_NAMES):
+                break
+        return state
+
+
+def open_recording(recording: "str | Path | SnapshotReader | SnapshotArchive") -> "SnapshotReader | SnapshotArchive":
+    """パス（ファイルまたはディレクトリ）から記録を開く。既に開いた記録はそのまま返す。"""
+    if isinstance(recording, (SnapshotReader, SnapshotArchive)):
+        return recording
+    path = Path(recording)
+    return SnapshotArchive(path) if path.is_dir() else SnapshotReader(path)
+
+
+def _read_block(f, block: int, last_offset: int) -> memoryview:
+    """ブロックを、last_offsetのレコードを含むところまで展開する。"""
+    f.seek(block)
+    decompressor = zlib.decompressobj()
+    data = bytearray()
+    while True:
+        chunk = f.read(1 << 16)
+        if not chunk:
+            break
+        data += decompressor.decompress(chunk)
+        if len(data) >= last_offset + _RECORD_HEADER.size:
+            _, length = _RECORD_HEADER.unpack_from(data, last_offset)
+            if len(data) >= last_offset + _RECORD_HEADER.size + length:
+                break
+        if decompressor.eof:
+            break
+    return memoryview(bytes(data))
@@ -0,0 +1,175 @@
+"""
+記録したデータの再生。
+
+ReplaySourceはSnapshotRecorderの記録を、京阪のAPIの代わりにKHTrackerへ返すhttpxのトランスポート。
+記録したtrainPositionListを時刻順に1件ずつ進め、その時点の select_station・transferGuideInfo・
+trainPositionList・startTimeList（とFileList.xml）を返す。KHTrackerの現在時刻（clock）も再生中の時刻に合わせるため、
+ネットワークなしで取得から発車標までの処理を何度でも同じ結果で動かせる。
+
+    replay = ReplaySource("recordings/", start=start, speed=60)   # 60倍速。speed=Noneなら待たずに進める
+    tracker = replay.tracker()
+    async for time in replay.play(tracker):
+        print(time, len(tracker.active_trains))
+"""
+
+from typing import Optional, AsyncIterator, TYPE_CHECKING
+from pathlib import Path
+import asyncio
+import datetime
+import json
+from zoneinfo import ZoneInfo
+
+from httpx import AsyncBaseTransport, AsyncClient, Request, Response
+
+from .recorder import Record, SnapshotReader, SnapshotArchive, open_recording, KIND_NAMES
+
+if TYPE_CHECKING:
+    from .tracker import KHTracker
+
+JST = ZoneInfo("Asia/Tokyo")
+
+
+def filelist_xml(time: datetime.datetime) -> str:
+    """FileList.xmlの内容。KHTracker.fetch_filelistが読むのはtimeのみ"""
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?><root>"
+        f"<time>{time.astimezone(JST).strftime('%Y%m%d%H%M%S')}</time>"
+        "<traininfo></traininfo><image_PC></image_PC><image_SP></image_SP><html_FP></html_FP>"
+        "</root>"
+        )
+
+
+class ReplaySource(AsyncBaseTransport):
+    """
+    記録を再生するトランスポート。
+    - recording: 記録ファイル、記録ファイルを置いたディレクトリ、または開いたSnapshotReader/SnapshotArchive
+    - start, end: 再生する範囲（trainPositionListの時刻）。startを指定すると、その時点の駅・ダイヤから始める
+    - speed: play()で記録の時刻の間隔を何倍速で再現するか（1.0で実時間）。Noneなら待たずに進める
+    - urls: KHTrackerのurlsを差し替えている場合に指定する
+    step()で次のtrainPositionListへ進み、time（再生中の時刻）が変わる。
+    使い終わったらaclose()で、client()で作ったクライアントと、パスから開いた記録を閉じる。
+    トランスポートなので、それらのクライアントのどれかを閉じたときにも同じように閉じられる。
+    """
+    def __init__(
+            self,
+            recording: "str | Path | SnapshotReader | SnapshotArchive",
+            start: Optional[datetime.datetime] = None,
+            end: Optional[datetime.datetime] = None,
+            speed: Optional[float] = None,
+            urls: Optional[dict[str, str]] = None
+            ) -> None:
+        from .tracker import DEFAULT_URLS
+
+        # パスから開いた記録だけを閉じる（開いた記録を渡された場合は呼び出し側が閉じる）
+        self._owns_recording = not isinstance(recording, (SnapshotReader, SnapshotArchive))
+        self.recording = open_recording(recording)
+        self._clients: list[AsyncClient] = []
+        self._closed: bool = False
+        self.speed = speed
+        self.end = end
+        self.urls: dict[str, str] = {**DEFAULT_URLS, **(urls or {})}
+        self._endpoints: dict[str, str] = {url: endpoint for endpoint, url in self.urls.items()}
+        self.current: dict[str, Record] = {}        # 種類:再生中の時点で最新の記録
+        self.time: Optional[datetime.datetime] = None
+        self.finished: bool = False
+        self._texts: dict[str, tuple[Record, str]] = {}   # 種類:(記録, JSON文字列)
+        self._records = self.recording.records(start, end)
+        if start is not None:
+            # 範囲の前に記録された駅・ダイヤを引き継ぐ
+            for kind, record in self.recording.state_at(start).items():
+                if kind != "train_position_list":
+                    self.current[kind] = record
+
+    def seek(self, time: datetime.datetime) -> dict[str, Record]:
+        """time時点の状態に移る。以降のstep()はtimeより後の記録から進める。"""
+        self.current = dict(self.recording.state_at(time))
+        self.time = time
+        self.finished = False
+        self._records = self.recording.records(time + datetime.timedelta(seconds=1), self.end)
+        return self.current
+
+    def step(self) -> bool:
+        """次のtrainPositionListへ進む。記録の終わりに達していればFalse"""
+        for record in self._records:
+            self.current[record.kind] = record
+            if record.kind == "train_position_list":
+                self.time = record.time
+                return True
+        self.finished = True
+        return False
+
+    def clock(self) -> datetime.datetime:
+        """再生中の時刻。KHTracker(clock=...) に渡す。再生前は現在時刻"""
+        return self.time or datetime.datetime.now(JST)
+
+    def client(self) -> AsyncClient:
+        """このトランスポートを使うAsyncClient。aclose()で閉じられる"""
+        client = AsyncClient(transport=self)
+        self._clients.append(client)
+        return client
+
+    def close_recording(self) -> None:
+        """パスから開いた記録を閉じる。以降のstep()・seek()は使えないが、再生中の時点のデータは返し続ける"""
+        if self._owns_recording:
+            self.recording.close()
+            self._owns_recording = False
+
+    async def aclose(self) -> None:
+        """client()で作ったクライアントと、パスから開いた記録を閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        for client in self._clients:
+            await client.aclose()
+        self._clients.clear()
+        self.close_recording()
+
+    def tracker(self, **kwargs) -> "KHTracker":
+        """このトランスポートと再生中の時刻を使うKHTracker"""
+        from .tracker import KHTracker
+
+        kwargs.setdefault("rate_limit", 0)
+        kwargs.setdefault("serve_stale", False)
+        return KHTracker(client=self.client(), urls=self.urls, clock=self.clock, **kwargs)
+
+    async def play(self, tracker: "KHTracker") -> AsyncIterator[datetime.datetime]:
+        """
+        記録を時刻順に進めながらtracker.fetch_posを呼び、再生した時刻を返す。
+        speedが指定されていれば、記録の時刻の間隔をspeed倍速で待つ。
+        """
+        loop = asyncio.get_running_loop()
+        origin: Optional[tuple[float, datetime.datetime]] = None
+        while self.step():
+            assert self.time is not None
+            if self.speed:
+                if origin is None:
+                    origin = (loop.time(), self.time)
+                # 最初の記録からの経過で待つので、処理時間の分だけ遅れが積み重なることはない
+                target = origin[0] + (self.time - origin[1]).total_seconds() / self.speed
+                delay = target - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await tracker.fetch_pos()
+            yield self.time
+
+    def _text(self, kind: str) -> Optional[str]:
+        record = self.current.get(kind)
+        if record is None:
+            return None
+        cached = self._texts.get(kind)
+        if cached is None or cached[0] is not record:
+            cached = (record, json.dumps(record.payload, ensure_ascii=False))
+            self._texts[kind] = cached
+        return cached[1]
+
+    async def handle_async_request(self, request: Request) -> Response:
+        endpoint = self._endpoints.get(str(request.url))
+        if endpoint == "file_list":
+            position = self.current.get("train_position_list")
+            if position is None:
+                return Response(404, request=request)
+            return Response(200, text=filelist_xml(position.time), request=request)
+        text = self._text(endpoint) if endpoint in KIND_NAMES.values() else None
+        if text is None:
+            return Response(404, request=request)
+        return Response(200, text=text, headers={"Content-Type": "application/json"}, request=request)
@@ -0,0 +1,139 @@
+"""
+trainPositionList.jsonの更新周期に合わせてポーリング時刻を決めるスケジューラー。
+
+fileCreatedTimeの観測値から上流の生成周期と位相を学習し、
+次に生成されると予想される時刻の直後に取得することで、固定間隔のポーリングよりも
+少ないリクエスト数で新しいデータを得る。
+"""
+
+from typing import Optional
+import datetime
+import math
+import statistics
+
+class PollScheduler:
+    """
+    fileCreatedTimeの生成周期・位相を学習し、次の取得時刻を返す。
+    - default_period: 学習前に仮定する生成周期（秒）
+    - margin: 予想生成時刻から取得までの余裕（秒）。取得が早すぎると広げ、間に合っていれば少しずつ縮める
+    - history: 学習に使うfileCreatedTimeの個数
+    """
+    def __init__(
+            self,
+            default_period: float = 60,
+            margin: float = 2,
+            min_margin: float = 1,
+            history: int = 30
+            ) -> None:
+        self.default_period = default_period
+        self.margin = margin
+        self.min_margin = min_margin
+        self.history = history
+        self.created_times: list[datetime.datetime] = []   # 観測した相異なるfileCreatedTime（古い順）
+        self.last_fetch: Optional[datetime.datetime] = None
+        self.missed: int = 0                                  # 生成前に取得してしまった回数（直近の更新以降）
+        self.missed_at: Optional[datetime.datetime] = None    # 最初に生成前の取得をした時刻
+
+    @property
+    def period(self) -> float:
+        """
+        推定した生成周期（秒）。
+        取得間隔が周期より長いと差分が周期の整数倍になるため、最小の差分を基準に倍数を割り戻して平均する。
+        ただし中央値の半分未満の差分（上流の再生成など）は外れ値として除き、1つの短い差分で周期が潰れないようにする。
+        """
+        diffs = [
+            (b - a).total_seconds()
+            for a, b in zip(self.created_times, self.created_times[1:])
+            ]
+        diffs = [d for d in diffs if d > 0]
+        if not diffs:
+            return self.default_period
+        median = statistics.median(diffs)
+        diffs = [d for d in diffs if d >= median / 2]
+        unit = min(diffs)
+        multiples = [max(1, round(d / unit)) for d in diffs]
+        return sum(diffs) / sum(multiples)
+
+    @property
+    def phase(self) -> Optional[float]:
+        """
+        生成時刻のUNIX時間を周期で割った余り（秒）。観測値の円周平均をとり、秒単位の揺らぎを均す。
+        """
+        if not self.created_times:
+            return None
+        period = self.period
+        x = y = 0.0
+        for t in self.created_times:
+            angle = 2 * math.pi * (t.timestamp() % period) / period
+            x += math.cos(angle)
+            y += math.sin(angle)
+        return (math.atan2(y, x) / (2 * math.pi) * period) % period
+
+    @property
+    def expected_next_created(self) -> Optional[datetime.datetime]:
+        """最後に観測したデータの次に生成されると予想される時刻"""
+        if not self.created_times or self.phase is None:
+            return None
+        period = self.period
+        latest = self.created_times[-1]
+        # 最新の観測時刻を位相に合わせて補正し、1周期進める
+        offset = (latest.timestamp() - self.phase) % period
+        if offset > period / 2:
+            offset -= period
+        return latest + datetime.timedelta(seconds=period - offset)
+
+    def observe(self, file_created_time: datetime.datetime, fetched_at: datetime.datetime) -> bool:
+        """
+        取得したデータのfileCreatedTimeを記録する。新しいデータであればTrueを返す。
+        """
+        self.last_fetch = fetched_at
+        if self.created_times and file_created_time <= self.created_times[-1]:
+            # 生成前に取得してしまったので余裕を広げる
+            # 2回目以降は上流の停止（深夜など）とみなし、余裕は変えない
+            self.missed += 1
+            if self.missed == 1:
+                self.missed_at = fetched_at
+                self.margin = min(self.margin + 1, self.period / 2)
+            return False
+
+        if self.missed == 1 and self.missed_at is not None:
+            # 直前の取得では未生成、今回は生成済みだったので、公開までの遅れはその間にある
+            # 二分探索のように中間を採用する
+            lower = (self.missed_at - file_created_time).total_seconds()
+            upper = (fetched_at - file_created_time).total_seconds()
+            self.margin = min(max(self.min_margin, (lower + upper) / 2), self.period / 2)
+        elif not self.missed:
+            # 間に合っているので少しずつ詰める
+            self.margin = max(self.min_margin, self.margin - 0.05)
+        self.missed = 0
+
+        self.created_times.append(file_created_time)
+        del self.created_times[:-self.history]
+        return True
+
+    def next_fetch_time(
+            self,
+            now: datetime.datetime,
+            rate_limit_interval: float = 0,
+            last_fetch: Optional[datetime.datetime] = None
+            ) -> datetime.datetime:
+        """
+        次に取得すべき時刻を返す。
+        予想生成時刻+marginを基本とし、前回の取得からrate_limit_interval秒以上空ける。
+        - last_fetch: 前回の取得時刻。失敗した取得も含めたい場合に指定する（省略時は最後にobserveした時刻）
+        """
+        last_fetch = max(filter(None, (last_fetch, self.last_fetch)), default=None)
+        expected = self.expected_next_created
+        # 未学習ならすぐに取得する
+        target = now if expected is None else expected + datetime.timedelta(seconds=self.margin)
+
+        if last_fetch is not None:
+            # すでに予想時刻以降に取得して未生成だった場合は、レート制限の範囲ですぐに再取得する
+            # 何度も未生成が続く場合（深夜など）は周期ごとの取得に戻す
+            period = datetime.timedelta(seconds=self.period)
+            while target <= last_fetch and (self.missed >= 3 or target + period <= last_fetch):
+                target += period
+            # レート制限を守る（fetch_posの判定は「より後」なので僅かに足す）
+            earliest = last_fetch + datetime.timedelta(seconds=rate_limit_interval + 0.1)
+            target = max(target, earliest)
+        return target
@@ -0,0 +1,286 @@
+"""
+実測した駅間走行時間・駅停車時間の統計モデル。
+
+fetch_posのたびに走行中の列車の位置を観測し、
+- 駅を発車してから次の停車駅に到着するまでの時間（走行時間）
+- 駅に到着してから発車するまでの時間（停車時間）
+を路線・方向・種別・時間帯ごとに集計する。集計は平均と分散のみを持つ逐次統計なので、
+観測を続けてもメモリは区間数に比例した一定量に収まる。
+
+集計した統計から、各列車の残りの停車駅への到着時刻を予測する。
+統計のない区間は時刻表の駅間時間で補う。
+
+    model = SegmentModel.load("segments.json")   # ファイルがなければ空のモデル
+    model.attach(tracker)                         # fetch_posのたびに観測する
+    ...
+    model.predict(train)                          # {駅番号: 予測到着時刻}
+    model.save()
+"""
+
+from pydantic import BaseModel, Field
+from typing import Optional, TYPE_CHECKING
+from pathlib import Path
+import datetime
+import os
+from zoneinfo import ZoneInfo
+
+if TYPE_CHECKING:
+    from .tracker import KHTracker, ActiveTrainData
+
+JST = ZoneInfo("Asia/Tokyo")
+
+
+class RunningStat(BaseModel):
+    """
+    逐次更新する平均・分散。件数がmax_countに達した後は指数移動平均として古い観測の重みを減らす。
+    """
+    count: int   = 0
+    mean:  float = 0.0
+    var:   float = 0.0
+
+    def add(self, value: float, max_count: int) -> None:
+        n = min(self.count + 1, max_count)
+        delta = value - self.mean
+        self.mean += delta / n
+        self.var += (delta * (value - self.mean) - self.var) / n
+        self.count = n
+
+
+class SegmentStats(BaseModel):
+    """保存用の統計データ。キーは SegmentModel.run_key / dwell_key を参照。"""
+    version: int = 1
+    run:     dict[str, RunningStat] = Field(default_factory=dict)
+    dwell:   dict[str, RunningStat] = Field(default_factory=dict)
+
+
+class _TrainTrack:
+    """列車ごとの直近の観測状態"""
+    __slots__ = ("stopped_at", "arrived_at", "departed_from", "departed_at", "last_seen")
+
+    def __init__(self) -> None:
+        self.stopped_at: Optional[int] = None                 # 停車中の駅番号
+        self.arrived_at: Optional[datetime.datetime] = None   # その駅に到着した時刻（観測できた場合）
+        self.departed_from: Optional[int] = None              # 最後に発車した駅番号
+        self.departed_at: Optional[datetime.datetime] = None  # その駅を発車した時刻（観測できた場合）
+        self.last_seen: Optional[datetime.datetime] = None
+
+
+class SegmentModel:
+    """
+    駅間走行時間・停車時間を実測から学習し、到着時刻を予測する。
+    - path: 統計を保存するJSONファイル
+    - max_count: 1区間あたりの統計の重み（件数）の上限。これを超えると古い観測から徐々に忘れる
+    - max_gap: 観測間隔がこれより長い場合（取得失敗など）、発着時刻が不確かなので集計しない
+    - max_run, max_dwell: これより長い走行・停車は足止めなどの異常とみなし集計しない
+    """
+    def __init__(
+            self,
+            path: Optional[str | Path] = None,
+            max_count: int = 200,
+            max_gap: datetime.timedelta = datetime.timedelta(minutes=3),
+            max_run: datetime.timedelta = datetime.timedelta(minutes=30),
+            max_dwell: datetime.timedelta = datetime.timedelta(minutes=10)
+            ) -> None:
+        self.path: Optional[Path] = Path(path) if path is not None else None
+        self.max_count = max_count
+        self.max_gap = max_gap
+        self.max_run = max_run
+        self.max_dwell = max_dwell
+        self.stats = SegmentStats()
+        self.tracks: dict[int, _TrainTrack] = {}
+        self.last_observed: Optional[datetime.datetime] = None
+
+    # --- 永続化 ---
+    @classmethod
+    def load(cls, path: str | Path, **kwargs) -> "SegmentModel":
+        """pathから統計を読み込む。ファイルがなければ空のモデルを返す。"""
+        model = cls(path, **kwargs)
+        if model.path is not None and model.path.exists():
+            model.stats = SegmentStats.model_validate_json(model.path.read_text(encoding="utf-8"))
+        return model
+
+    def save(self, path: Optional[str | Path] = None) -> None:
+        """統計を保存する。書き込み途中で中断しても既存のファイルが壊れないよう、一時ファイルから置き換える。"""
+        target = Path(path) if path is not None else self.path
+        if target is None:
+            raise ValueError("保存先のpathが指定されていません")
+        tmp = target.with_name(target.name + ".tmp")
+        tmp.write_text(self.stats.model_dump_json(), encoding="utf-8")
+        os.replace(tmp, target)
+
+    # --- キー ---
+    @staticmethod
+    def run_key(line: str, direction: str, train_type: str, hour: Optional[int], from_station: int, to_station: int) -> str:
+        return f"{line}|{direction}|{train_type}|{'*' if hour is None else hour}|{from_station}-{to_station}"
+
+    @staticmethod
+    def dwell_key(line: str, direction: str, train_type: str, hour: Optional[int], station: int) -> str:
+        return f"{line}|{direction}|{train_type}|{'*' if hour is None else hour}|{station}"
+
+    def _add(self, table: dict[str, RunningStat], keys: tuple[str, str], value: float) -> None:
+        # 時間帯別と全時間帯の両方に集計し、時間帯別の統計がない場合の予測に使う
+        for key in keys:
+            table.setdefault(key, RunningStat()).add(value, self.max_count)
+
+    # --- 観測 ---
+    def attach(self, tracker: "KHTracker", eta: bool = False) -> None:
+        """
+        fetch_posで列車が更新されるたびに観測するよう、trackerに登録する。
+        etaがTrueなら、trackerのeta_matrix・estimate_arrivalもこのモデルの予測を使う（tracker.eta_model）。
+        """
+        tracker.listeners.append(self.observe)
+        if eta:
+            tracker.eta_model = self
+
+    def observe(self, tracker: "KHTracker", now: Optional[datetime.datetime] = None) -> None:
+        """
+        走行中の全列車の位置を観測し、発着を検出して統計を更新する。
+        観測時刻は、省略時はtrainPositionListの生成時刻（fileCreatedTime）を使う。前回と同じデータなら何もしない。
+        """
+        from .tracker import ActiveTrainData
+
+        if now is None:
+            position_list = tracker.train_position_list
+            now = position_list.fileCreatedTime if position_list is not None else datetime.datetime.now(JST)
+        if self.last_observed is not None and now <= self.last_observed:
+            return
+        self.last_observed = now
+        seen: set[int] = set()
+        for wdf, train in tracker.trains.items():
+            if not isinstance(train, ActiveTrainData):
+                continue
+            seen.add(wdf)
+            track = self.tracks.setdefault(wdf, _TrainTrack())
+            reliable = track.last_seen is not None and now - track.last_seen <= self.max_gap
+            # 発着は前回と今回の観測の間に起きているので、その中間を発着時刻とする
+            event = track.last_seen + (now - track.last_seen) / 2 if reliable and track.last_seen is not None else now
+            track.last_seen = now
+            try:
+                stops = {stop.station.station_number for stop in train.stop_stations}
+                station = train.next_station.station_number if train.is_stopping else None
+                line, direction, train_type = train.line, train.direction, train.train_type.value
+            except (ValueError, IndexError, KeyError):
+                continue
+            # 通過駅の枠にいる場合は走行中として扱う
+            if station is not None and station not in stops:
+                station = None
+
+            if station is not None and station != track.stopped_at:
+                # 到着
+                if reliable and track.departed_at is not None and track.departed_from is not None:
+                    run = event - track.departed_at
+                    if run <= self.max_run:
+                        hour = track.departed_at.hour
+                        self._add(self.stats.run, (
+                            self.run_key(line, direction, train_type, hour, track.departed_from, station),
+                            self.run_key(line, direction, train_type, None, track.departed_from, station),
+                            ), run.total_seconds())
+                track.stopped_at = station
+                track.arrived_at = event if reliable else None
+            elif station is None and track.stopped_at is not None:
+                # 発車
+                if reliable and track.arrived_at is not None:
+                    dwell = event - track.arrived_at
+                    if dwell <= self.max_dwell:
+                        hour = track.arrived_at.hour
+                        self._add(self.stats.dwell, (
+                            self.dwell_key(line, direction, train_type, hour, track.stopped_at),
+                            self.dwell_key(line, direction, train_type, None, track.stopped_at),
+                            ), dwell.total_seconds())
+                track.departed_from = track.stopped_at
+                track.departed_at = event if reliable else None
+                track.stopped_at = None
+                track.arrived_at = None
+
+        # 運行を終えた列車の観測状態を破棄
+        for wdf in [wdf for wdf in self.tracks if wdf not in seen]:
+            del self.tracks[wdf]
+
+    # --- 予測 ---
+    def expected_run(self, line: str, direction: str, train_type: str, hour: int, from_station: int, to_station: int) -> Optional[float]:
+        """駅間の平均走行時間（秒）。時間帯別の統計がなければ全時間帯の統計を使う。"""
+        for h in (hour, None):
+            stat = self.stats.run.get(self.run_key(line, direction, train_type, h, from_station, to_station))
+            if stat is not None:
+                return stat.mean
+        return None
+
+    def expected_dwell(self, line: str, direction: str, train_type: str, hour: int, station: int) -> Optional[float]:
+        """駅の平均停車時間（秒）。時間帯別の統計がなければ全時間帯の統計を使う。"""
+        for h in (hour, None):
+            stat = self.stats.dwell.get(self.dwell_key(line, direction, train_type, h, station))
+            if stat is not None:
+                return stat.mean
+        return None
+
+    def predict(self, train: "ActiveTrainData", now: Optional[datetime.datetime] = None) -> dict[int, datetime.datetime]:
+        """
+        走行中の列車の、残りの停車駅への予測到着時刻（駅番号:時刻）。
+        現在地から停車駅を順にたどり、実測の走行時間・停車時間を積み上げる。
+        統計のない区間・駅は時刻表の駅間時間で補い、起点が観測できていない場合は予定時刻＋遅延から始める。
+        """
+        now = now or train.master.now()
+        try:
+            line, direction, train_type = train.line, train.direction, train.train_type.value
+            next_stop = train.next_stop_station
+        except (ValueError, IndexError):
+            return {}
+        if next_stop is None:
+            return {}
+
+        stops = train.stop_stations
+        index = next((i for i, stop in enumerate(stops) if stop.station is next_stop), None)
+        if index is None:
+            return {}
+        delay = datetime.timedelta(minutes=train.delay_minutes)
+        track = self.tracks.get(train.wdfBlockNo)
+
+        # 起点: 停車中なら発車予測時刻、走行中なら直前の駅の発車時刻
+        predictions: dict[int, datetime.datetime] = {}
+        current = stops[index]
+        if train.is_stopping and current.station is next_stop:
+            dwell = self.expected_dwell(line, direction, train_type, now.hour, current.station.station_number)
+            arrived = track.arrived_at if track is not None and track.arrived_at is not None else now
+            departure = max(now, arrived + datetime.timedelta(seconds=dwell or 0))
+            predictions[current.station.station_number] = arrived
+            previous, t, start = current, departure, index + 1
+        elif track is not None and track.departed_at is not None and track.departed_from is not None:
+            previous_number, t, start = track.departed_from, track.departed_at, index
+            previous = next((stop for stop in stops if stop.station.station_number == previous_number), None)
+            if previous is None:
+                return {}
+        else:
+            # 起点が不明なので、次の停車駅は予定時刻＋遅延とする
+            if current.time is None:
+                return {}
+            arrival = max(now, current.time + delay)
+            predictions[current.station.station_number] = arrival
+            dwell = self.expected_dwell(line, direction, train_type, arrival.hour, current.station.station_number)
+            previous, t, start = current, arrival + datetime.timedelta(seconds=dwell or 0), index + 1
+
+        for stop in stops[start:]:
+            run = self.expected_run(
+                line, direction, train_type, t.hour, previous.station.station_number, stop.station.station_number
+                )
+            if run is None:
+                if previous.time is None or stop.time is None:
+                    return predictions
+                # 時刻表上の駅間時間（時刻表の時刻は発車時刻なので停車時間を含む）
+                run = (stop.time - previous.time).total_seconds()
+                dwell = 0.0
+            else:
+                dwell = None
+            arrival = t + datetime.timedelta(seconds=run)
+            # 走行中でも到着済みの時刻は予測しない
+            if arrival < now:
+                arrival = now
+            predictions[stop.station.station_number] = arrival
+            if dwell is None:
+                dwell = self.expected_dwell(line, direction, train_type, arrival.hour, stop.station.station_number) or 0.0
+            previous, t = stop, arrival + datetime.timedelta(seconds=dwell)
+        return predictions
+
+    def predict_all(self, tracker: "KHTracker", now: Optional[datetime.datetime] = None) -> dict[int, dict[int, datetime.datetime]]:
+        """走行中の全列車の予測到着時刻（wdfBlockNo:{駅番号:時刻}）"""
+        now = now or tracker.now()
+        return {wdf: self.predict(train, now) for wdf, train in tracker.active_trains.items()}
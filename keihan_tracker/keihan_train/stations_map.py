@@ -5,4 +5,17 @@ KYOBASHI_TO_DEMACHIYANAGI=[i for i in range(4,42+1)]
 UJI_UP = [77,76,75,74,73,72,71,28]
 KATANO_UP = [67,66,65,64,63,62,61,21]
 HONNSEN_UP = [1,2,3]             +KYOBASHI_TO_DEMACHIYANAGI
-NAKANOSHIMA_UP = [54,53,52,51,3] +KYOBASHI_TO_DEMACHIYANAGI
\ No newline at end of file
+NAKANOSHIMA_UP = [54,53,52,51,3] +KYOBASHI_TO_DEMACHIYANAGI
+LINE_UP = {
+    "京阪本線・鴨東線": HONNSEN_UP,
+    "中之島線": NAKANOSHIMA_UP,
+    "交野線": KATANO_UP,
+    "宇治線": UJI_UP,
+}
+
+def line_stations(line: str, direction: str) -> list[int]:
+    """路線の駅番号を進行方向の順に返す。"""
+    if line not in LINE_UP:
+        raise ValueError(line)
+    stations = LINE_UP[line]
+    return stations if direction == "up" else list(reversed(stations))
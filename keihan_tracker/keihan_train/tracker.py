@@ -19,18 +19,81 @@ from .schemes import (TransferGuideInfo,
                       )
 from . import stations_map
 from .position_calculation import calc_position
+from .scheduler import PollScheduler
+from .eta import ETAMatrix, build_eta_matrix
+from .memory import MemoryReport, MemoryUsage, REPORT_ORDER, deep_sizeof
 from pydantic import BaseModel, Field
 import warnings
-from typing import Optional, Literal, Sequence
-from httpx import AsyncClient
+from typing import Optional, Literal, Sequence, Any, Callable, TypeVar, Iterable, TYPE_CHECKING
+from httpx import AsyncClient, Response, HTTPError
+from ..resilience import ResilientFetcher, CircuitOpenError
+from ..client import get_client
+from ..metrics import FetchMetrics, phase
+from concurrent.futures import Executor, ProcessPoolExecutor
+import asyncio
+import bisect
+import inspect
 import json
 import xml.etree.ElementTree as ET
 from tabulate import tabulate
 import datetime
 import re
+import time
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
+if TYPE_CHECKING:
+    from .recorder import SnapshotReader, SnapshotArchive
+    from .segment_model import SegmentModel
+
 JST = ZoneInfo("Asia/Tokyo")
+_T = TypeVar("_T")
+
+# この時間以上停車している列車は足止めされているとみなし、ETAを推定しない
+STUCK_THRESHOLD = datetime.timedelta(minutes=15)
+
+SELECT_STATION_URL      = "https://www.keihan.co.jp/zaisen/select_station.json"
+TRANSFER_GUIDE_INFO_URL = "https://www.keihan.co.jp/zaisen/transferGuideInfo.json"
+TRAIN_POSITION_LIST_URL = "https://www.keihan.co.jp/zaisen-up/trainPositionList.json"
+START_TIME_LIST_URL     = "https://www.keihan.co.jp/zaisen-up/startTimeList.json"
+FILE_LIST_URL           = "https://www.keihan.co.jp/tinfo/05-flist/FileList.xml"
+
+# エンドポイント名:URL。KHTracker(urls=...) で一部を差し替えられる
+DEFAULT_URLS = {
+    "select_station":      SELECT_STATION_URL,
+    "transfer_guide_info": TRANSFER_GUIDE_INFO_URL,
+    "train_position_list": TRAIN_POSITION_LIST_URL,
+    "start_time_list":     START_TIME_LIST_URL,
+    "file_list":           FILE_LIST_URL,
+}
+
+# エンドポイントごとの既定タイムアウト（秒）。startTimeListは大きいため長めにとる
+DEFAULT_TIMEOUTS = {
+    "select_station":      10,
+    "transfer_guide_info": 10,
+    "train_position_list": 10,
+    "start_time_list":     30,
+    "file_list":           5,
+}
+
+def _parse_json(model: type[BaseModel], text: str) -> Any:
+    """JSON文字列をモデルでバリデートする。ProcessPoolExecutorからも呼べるようモジュール関数にしている。"""
+    return model.model_validate(json.loads(text))
+
+def _parse_json_timed(model: type[BaseModel], text: str) -> tuple[Any, float, float]:
+    """_parse_jsonと同じ処理を行い、(モデル, json.loadsの秒数, バリデーションの秒数)を返す。metricsがある場合に使う。"""
+    start = time.perf_counter()
+    data = json.loads(text)
+    loaded = time.perf_counter()
+    result = model.model_validate(data)
+    return result, loaded - start, time.perf_counter() - loaded
+
+def _route_key(route_stations: list["StopStationData"]) -> list[tuple]:
+    """停車駅リストの比較用キー"""
+    return [
+        (stop.station.station_number, stop.is_start, stop.is_final, stop.is_stop, stop.time)
+        for stop in route_stations
+        ]
 
 class StationData(BaseModel):
     """
@@ -112,6 +175,51 @@ class StationData(BaseModel):
         trains.sort(key=lambda x:x[1].time or datetime.datetime.min.replace(tzinfo=JST))
         return trains
 
+    def next_departures(
+            self,
+            n: int = 3,
+            direction: Optional[Literal["up","down"]] = None,
+            train_types: Optional[Iterable[TrainType]] = None,
+            destination: Optional["StationData"] = None,
+            now: Optional[datetime.datetime] = None
+            ) -> list[tuple["TrainData|ActiveTrainData","StopStationData"]]:
+        """
+        この駅から次に発車する列車を、条件に合うものから時刻順にn本まで返す。
+        KHTracker.departure_boards の発車標を現在時刻で二分探索し、n本見つかった時点で打ち切る。
+        - direction: 上り線（"up"）か下り線（"down"）か
+        - train_types: 対象の列車種別（例: {TrainType.EXPRESS, TrainType.LTD_EXP}）
+        - destination: 行き先駅
+        - now: 基準時刻（省略時は現在時刻）
+        時刻を過ぎていても走行中の列車（遅延など）は含め、時刻の不明な予定列車（始発駅の予定など）は含めない。
+        """
+        board = self.master.departure_boards()[self.station_number]
+        now = now or self.master.now()
+        types = set(train_types) if train_types is not None else None
+
+        def matches(train: "TrainData|ActiveTrainData") -> bool:
+            if direction is not None and train.direction != direction:
+                return False
+            if types is not None and train.train_type not in types:
+                return False
+            if destination is not None and train.destination is not destination:
+                return False
+            return True
+
+        start = board.index_at(now)
+        results: list[tuple[TrainData|ActiveTrainData, StopStationData]] = []
+        # 時刻を過ぎた停車のうち、まだ到着していない走行中の列車（走行中の列車の停車だけをたどる）
+        for train, stop in board.active_entries:
+            if stop.time is not None and stop.time >= now:
+                break
+            if matches(train):
+                results.append((train, stop))
+        for train, stop in board.entries[start:]:
+            if len(results) >= n:
+                break
+            if matches(train):
+                results.append((train, stop))
+        return results[:n]
+
     def __str__(self):
         return self.station_name.ja
     
@@ -134,6 +242,86 @@ class StopStationData(BaseModel):
     station:    StationData
     time:       Optional[datetime.datetime] = None #標準到着時刻、(12,00)の形式
 
+class DepartureBoard:
+    """
+    駅の発車標。StationData.upcoming_trainsと同じ列車を停車時刻順に保持する。
+    KHTracker.departure_boards で全駅分がまとめて作られる。
+    - station: 駅データ
+    - entries: (列車, 停車駅情報) のリスト（停車時刻順）
+    - version: 内容が変わるたびに変わる番号。内容が変わらない間は同じオブジェクト・同じ番号のまま使い回される
+    - active_entries: entriesのうち走行中の列車のもの（停車時刻順）。省略時は必要になったときにentriesから作る
+    """
+    def __init__(
+            self,
+            station: StationData,
+            entries: list[tuple["TrainData", StopStationData]],
+            version: int = 0,
+            active_entries: Optional[list[tuple["ActiveTrainData", StopStationData]]] = None
+            ) -> None:
+        self.station = station
+        self.entries = entries
+        self.version = version
+        self._active = active_entries
+
+    @property
+    def entries(self) -> list[tuple["TrainData", StopStationData]]:
+        return self._entries
+
+    @entries.setter
+    def entries(self, entries: list[tuple["TrainData", StopStationData]]) -> None:
+        self._entries = entries
+        self._times: Optional[list[datetime.datetime]] = None
+        self._active: Optional[list[tuple[ActiveTrainData, StopStationData]]] = None
+
+    @property
+    def active_entries(self) -> list[tuple["ActiveTrainData", StopStationData]]:
+        """
+        走行中の列車の停車（停車時刻順）。時刻を過ぎてもまだ到着していない列車を、発車標全体をたどらずに探すのに使う。
+        KHTracker.departure_boards が発車標を作る・更新するときに一緒に設定する。
+        """
+        if self._active is None:
+            self._active = [entry for entry in self._entries if isinstance(entry[0], ActiveTrainData)]
+        return self._active
+
+    @active_entries.setter
+    def active_entries(self, entries: list[tuple["ActiveTrainData", StopStationData]]) -> None:
+        self._active = entries
+
+    def index_at(self, time: datetime.datetime) -> int:
+        """停車時刻がtime以降である最初の位置（二分探索）。時刻不明の停車は先頭側にある。"""
+        if self._times is None:
+            min_time = datetime.datetime.min.replace(tzinfo=JST)
+            self._times = [stop.time or min_time for _, stop in self._entries]
+        return bisect.bisect_left(self._times, time)
+
+    @property
+    def trains(self) -> set[int]:
+        """この発車標に載っている列車のwdfBlockNo"""
+        return {train.wdfBlockNo for train, _ in self.entries}
+
+    def content_key(self) -> list[tuple]:
+        """表示内容の比較用キー。列車・停車時刻・走行中か・遅延が同じなら同じ内容とみなす。"""
+        return [
+            (train.wdfBlockNo, stop.station.station_number, stop.time, isinstance(train, ActiveTrainData), train.delay_minutes)
+            for train, stop in self.entries
+            ]
+
+    def top(self, n: int) -> "DepartureBoard":
+        """先頭n件だけの発車標を返す。"""
+        return DepartureBoard(self.station, self.entries[:n], self.version)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index: int) -> tuple["TrainData", StopStationData]:
+        return self.entries[index]
+
+    def __repr__(self) -> str:
+        return f"DepartureBoard({self.station}, {len(self.entries)}件)"
+
 class TrainData(BaseModel):
     """
     列車情報を表すモデル。
@@ -154,12 +342,13 @@ class TrainData(BaseModel):
 
     @property
     def line(self) -> LineLiteral:
-        stop_stations = [stop.station for stop in self.stop_stations]
-        if self.master.stations[54] in stop_stations:
+        # StationDataの==は全フィールドを比較するため、駅番号の集合で判定する
+        stop_stations = {stop.station.station_number for stop in self.route_stations if stop.is_stop}
+        if 54 in stop_stations:
             return "中之島線"
-        elif self.master.stations[67] in stop_stations:
+        elif 67 in stop_stations:
             return "交野線"
-        elif self.master.stations[77] in stop_stations:
+        elif 77 in stop_stations:
             return "宇治線"
         else:
             return "京阪本線・鴨東線"
@@ -206,7 +395,8 @@ class TrainData(BaseModel):
         if self.actual_train_type is not None:
             return self.actual_train_type
 
-        stop_stations_list = [stop.station for stop in self.stop_stations]
+        # 駅番号の集合で判定する（StationDataの==は全フィールドを比較するため遅い）
+        stop_stations_list = {stop.station.station_number for stop in self.route_stations if stop.is_stop}
 
         try:
             st_kyobashi = self.master.stations[4]      # KH04 京橋
@@ -232,13 +422,13 @@ class TrainData(BaseModel):
 
         # 1. 【普通】 
         # 大阪側: 野江(KH05)に停車するなら普通
-        if st_noe in stop_stations_list:
+        if st_noe.station_number in stop_stations_list:
             return TrainType.LOCAL
         
         # --- 京橋(KH04)を通らない列車の判定 ---
-        if st_kyobashi not in stop_stations_list:
+        if st_kyobashi.station_number not in stop_stations_list:
             # 鳥羽街道(KH35)に停車するなら確実に普通
-            if st_tobakaido in stop_stations_list:
+            if st_tobakaido.station_number in stop_stations_list:
                 return TrainType.LOCAL
             
             # 鳥羽街道に停車しない場合
@@ -255,7 +445,7 @@ class TrainData(BaseModel):
             
             if is_cross_tobakaido:
                 # 鳥羽街道を通過する列車（例：淀行き急行）
-                if st_fushimiinari in stop_stations_list:
+                if st_fushimiinari.station_number in stop_stations_list:
                     return TrainType.EXPRESS
                 
                 # return TrainType.LINER
@@ -264,7 +454,7 @@ class TrainData(BaseModel):
             else:
                 # 鳥羽街道まで行かない短距離列車（例：出町柳～三条）
                 # 神宮丸太町(KH41)に停車するなら普通
-                if st_jingu_marutamachi in stop_stations_list:
+                if st_jingu_marutamachi.station_number in stop_stations_list:
                     return TrainType.LOCAL
                 
                 # 万が一、神宮丸太町を通過する短距離列車があれば特急扱い
@@ -272,25 +462,25 @@ class TrainData(BaseModel):
 
 
         # --- 以下、京橋(KH04)を通る列車の判定 (既存ロジック) ---
-        if st_kadomashi in stop_stations_list:
+        if st_kadomashi.station_number in stop_stations_list:
              return TrainType.SEMI_EXP
 
-        if st_kayashima in stop_stations_list:
-            if st_moriguchishi in stop_stations_list:
+        if st_kayashima.station_number in stop_stations_list:
+            if st_moriguchishi.station_number in stop_stations_list:
                 return TrainType.SUB_EXP          # 準急
             else:
                 return TrainType.COMMUTER_SUB_EXP # 通勤準急
 
-        if st_moriguchishi in stop_stations_list:
-            if st_hirakatakoen in stop_stations_list:
+        if st_moriguchishi.station_number in stop_stations_list:
+            if st_hirakatakoen.station_number in stop_stations_list:
                 return TrainType.EXPRESS     # 急行
             else:
                 return TrainType.RAPID_EXP   # 快速急行
         else:
-            if st_hirakatashi not in stop_stations_list:
+            if st_hirakatashi.station_number not in stop_stations_list:
                 return TrainType.RAPID_LTD_EXP # 快速特急 洛楽
 
-            if st_neyagawashi in stop_stations_list:
+            if st_neyagawashi.station_number in stop_stations_list:
                 return TrainType.COMMUTER_RAPID_EXP # 通勤快急
             else:
                 # return TrainType.LINER
@@ -323,7 +513,7 @@ class TrainData(BaseModel):
         # もし終着駅の予定時刻を過ぎていたらcompleted
         stop_time = self.get_stop_time(self.destination)
         if stop_time:
-            if stop_time < datetime.datetime.now(JST):
+            if stop_time < self.master.now():
                 return "completed"
         return "scheduled"
 
@@ -414,7 +604,7 @@ class ActiveTrainData(TrainData):
     def stopping_time(self) -> datetime.timedelta:
         """列車が停車している時間。走行中はtimedelta(0)を返す。"""
         if self.station_arrival_time:
-            return datetime.datetime.now(tz=JST) - self.station_arrival_time
+            return self.master.now() - self.station_arrival_time
         else:
             return datetime.timedelta(0)
     
@@ -451,19 +641,7 @@ class ActiveTrainData(TrainData):
         next_station = self.next_station.station_number
         stop_stations = [station.station.station_number for station in self.stop_stations]
 
-        match self.line:
-            case "中之島線":
-                line = stations_map.NAKANOSHIMA_UP
-            case "交野線":
-                line = stations_map.KATANO_UP
-            case "京阪本線・鴨東線":
-                line = stations_map.HONNSEN_UP
-            case "宇治線":
-                line = stations_map.UJI_UP
-            case _:
-                raise ValueError()
-        if self.direction == "down":
-            line = list(reversed(line))
+        line = stations_map.line_stations(self.line, self.direction)
 
         if not next_station in line:
             raise IndexError(f"{self.next_station} is not in {self.line}")
@@ -525,27 +703,79 @@ class KHTracker:
     - stations: 全駅の辞書（駅番号:StationData）
     - trains: 全列車の辞書（列車管理番号:TrainData）
     - fetch_pos, fetch_dia でAPIから最新情報取得
+    - executor を指定すると、JSONのパースとダイヤ登録の計算をイベントループ外で実行する
+    - fetcher で再試行・タイムアウト・サーキットブレーカーを設定できる
+    - serve_stale がTrueなら、取得に失敗しても前回のデータを保持し is_stale を立てる
+    - use_filelist がTrueなら、小さなFileList.xmlで更新を確認してから大きなJSONを取得する
+    - client を省略すると、バス・遅延情報と共有のAsyncClient（keihan_tracker.client）を使う
+    - listeners に関数を追加すると、fetch_posで列車が更新されるたびに呼ばれる
+    - urls でエンドポイントのURLを差し替えられる（エンドポイント名:URL、DEFAULT_URLSを参照）
+    - clock を指定すると、現在時刻の代わりにその戻り値を使う（記録の再生など）
+    - metrics にFetchMetricsを渡すと、fetch_pos・regist_dia の区間ごとの処理時間と取得量を記録する
     """
-    def __init__(self, rate_limit:float = 15) -> None:
+    def __init__(
+            self,
+            rate_limit:float = 15,
+            executor: Optional[Executor] = None,
+            fetcher: Optional[ResilientFetcher] = None,
+            serve_stale: bool = True,
+            use_filelist: bool = False,
+            client: Optional[AsyncClient] = None,
+            urls: Optional[dict[str, str]] = None,
+            clock: Optional[Callable[[], datetime.datetime]] = None,
+            metrics: Optional[FetchMetrics] = None
+            ) -> None:
+        self.metrics: Optional[FetchMetrics] = metrics
+        self.urls: dict[str, str] = {**DEFAULT_URLS, **(urls or {})}
+        self.clock: Optional[Callable[[], datetime.datetime]] = clock
         #パースしたJSONデータ（BaseModel）
         self.transfer_guide_info: Optional[TransferGuideInfo] = None # 駅ごとの乗り入れデータ
         self.select_station: Optional[SelectStation] = None          # 路線ごとの駅名データ
         self.starttime_list: Optional[startTimeList] = None          # 列車ごとの駅到着時刻データ
         self.train_position_list: Optional[trainPositionList] = None # 列車の種別・位置・遅延情報データ
         self.file_list: Optional[FileList] = None
-        self.date: datetime.date = datetime.datetime.now(JST).date()   # 日度（始発から終電までを1日とする日付）
+        self.date: datetime.date = self.now().date()   # 日度（始発から終電までを1日とする日付）
         # 深夜帯は-1日することで27時の扱い
-        if 0 <= datetime.datetime.now(JST).hour <= 5:
+        if 0 <= self.now().hour <= 5:
             self.date = self.date - datetime.timedelta(days=1)
         
-        self.web = AsyncClient()
+        self._web: Optional[AsyncClient] = client
         self.last_fetch_pos_datetime: Optional[datetime.datetime] = None # 最後にfetch_posを行った時刻
         self.rate_limit_interval:float = rate_limit                      # アクセス間隔
+        # CPU負荷の高い処理（パース・ダイヤ登録）を実行するExecutor。Noneならイベントループ上で実行
+        self.executor: Optional[Executor] = executor
+        # 再試行・サーキットブレーカー付きの取得処理
+        self.fetcher: ResilientFetcher = fetcher or ResilientFetcher(timeouts=DEFAULT_TIMEOUTS)
+        self.serve_stale: bool = serve_stale
+        self.is_stale: bool = False                   # 最新の取得に失敗し、前回のデータを保持しているか
+        self.last_error: Optional[Exception] = None   # 最後に発生した取得エラー
+        # fileCreatedTimeから更新周期を学習し、次の取得時刻を決めるスケジューラー
+        self.scheduler: PollScheduler = PollScheduler()
+        # FileList.xmlのtimeが変わらない間は列車位置・ダイヤの取得を省略する
+        self.use_filelist: bool = use_filelist
         # wdfBlockNo:TrainData
         ## 現在アクティブな列車リスト
         self.trains:dict[int, TrainData|ActiveTrainData] = {}
         ## 駅リスト
         self.stations:dict[int, StationData] = {}
+        # 全駅の発車標（departure_boards）のキャッシュ。fetch_posで列車が更新されると、変化した列車の分だけ作り直す
+        self._boards: Optional[dict[int, DepartureBoard]] = None
+        self._boards_top: dict[int, dict[int, DepartureBoard]] = {}
+        self._boards_dirty: bool = False
+        self._board_version: int = 0
+        self._board_signatures: dict[int, tuple] = {}                 # wdfBlockNo:発車標に影響する状態
+        self._board_stops: dict[int, list[StopStationData]] = {}      # wdfBlockNo:発車標に載せた停車駅
+        # fetch_posで列車が更新されるたびに self を引数に呼ばれる関数（コルーチン関数も可）
+        self.listeners: list[Callable[["KHTracker"], Any]] = []
+        # 全走行中列車のETA行列（eta_matrix）のキャッシュ。fetch_posで列車が更新されると破棄する
+        self._eta: Optional[ETAMatrix] = None
+        self._eta_threshold: Optional[datetime.timedelta] = None
+        # eta_matrixで予定時刻＋遅延の代わりに使う到着予測（SegmentModel.attach(tracker, eta=True) で設定される）
+        self.eta_model: Optional["SegmentModel"] = None
+
+    def now(self) -> datetime.datetime:
+        """現在時刻。clockが指定されていればその戻り値"""
+        return self.clock() if self.clock is not None else datetime.datetime.now(JST)
 
     @property
     def active_trains(self) -> dict[int, ActiveTrainData]:
@@ -612,14 +842,287 @@ class KHTracker:
         return trains
 
 
+    @staticmethod
+    def _upcoming_stops(train: "TrainData|ActiveTrainData") -> list[StopStationData]:
+        """
+        列車がこれから停車する（停車中を含む）駅。StationData.upcoming_trainsと同じ判定を、列車ごとに1回で行う。
+        """
+        stops = train.stop_stations
+        if isinstance(train, ActiveTrainData):
+            next_stop = train.next_stop_station
+            if not next_stop:
+                return []
+            # 始発駅にいるなら全停車駅（始発駅には停車時刻が設定されていない）
+            if next_stop is train.start_station:
+                return stops
+            next_time = next((stop.time for stop in stops if stop.station is next_stop), None)
+            return [
+                stop for stop in stops
+                if stop.station is next_stop or (next_time and stop.time and stop.time >= next_time)
+                ]
+        if train.status == "scheduled":
+            return stops
+        return []
+
+    @staticmethod
+    def _board_signature(train: "TrainData|ActiveTrainData", now: datetime.datetime) -> tuple:
+        """
+        発車標に影響する列車の状態。これが変わった列車だけ停車駅を求め直す。
+        列車オブジェクトと停車駅リストは同一性で、それ以外は値で比較する。
+        """
+        if isinstance(train, ActiveTrainData):
+            state = (train.location_col, train.location_row, train.delay_minutes)
+        else:
+            # 予定列車は終着駅の時刻を過ぎるとcompletedになる（statusと同じ判定を駅の比較なしで行う）
+            final_time = next(
+                (stop.time for stop in train.route_stations if stop.is_final and stop.is_stop), None
+                )
+            state = (train.is_completed, final_time is not None and final_time < now)
+        return (train, train.route_stations, state)
+
+    @staticmethod
+    def _same_signature(a: tuple, b: tuple) -> bool:
+        return a[0] is b[0] and a[1] is b[1] and a[2] == b[2]
+
+    def _train_board_stops(self, train: "TrainData|ActiveTrainData") -> list[StopStationData]:
+        try:
+            return self._upcoming_stops(train)
+        except (ValueError, IndexError):
+            # 位置や始発駅が不明な列車は発車標に載せない
+            return []
+
+    def _next_board_version(self) -> int:
+        self._board_version += 1
+        return self._board_version
+
+    def _build_departure_boards(self) -> dict[int, DepartureBoard]:
+        min_time = datetime.datetime.min.replace(tzinfo=JST)
+        entries: dict[int, list[tuple[TrainData, StopStationData]]] = {number: [] for number in self.stations}
+        active: dict[int, list[tuple[ActiveTrainData, StopStationData]]] = {number: [] for number in self.stations}
+        self._board_signatures = {}
+        self._board_stops = {}
+        now = self.now()
+        for wdf, train in self.trains.items():
+            stops = self._train_board_stops(train)
+            self._board_signatures[wdf] = self._board_signature(train, now)
+            self._board_stops[wdf] = stops
+            is_active = isinstance(train, ActiveTrainData)
+            for stop in stops:
+                entries[stop.station.station_number].append((train, stop))
+                if is_active:
+                    active[stop.station.station_number].append((train, stop))
+
+        boards: dict[int, DepartureBoard] = {}
+        for number, items in entries.items():
+            items.sort(key=lambda x: x[1].time or min_time)
+            active[number].sort(key=lambda x: x[1].time or min_time)
+            boards[number] = DepartureBoard(self.stations[number], items, self._next_board_version(), active[number])
+        return boards
+
+    def _update_departure_boards(self, boards: dict[int, DepartureBoard]) -> set[int]:
+        """
+        前回から状態の変わった列車だけ停車駅を求め直し、その列車が載っていた・新たに載る駅の発車標だけ作り直す。
+        作り直しても内容が同じ発車標は、オブジェクトとversionをそのまま使う。作り直した駅番号を返す。
+        """
+        min_time = datetime.datetime.min.replace(tzinfo=JST)
+        changed: set[int] = set()
+        now = self.now()
+        for wdf, train in self.trains.items():
+            signature = self._board_signature(train, now)
+            old = self._board_signatures.get(wdf)
+            if old is None or not self._same_signature(old, signature):
+                changed.add(wdf)
+                self._board_signatures[wdf] = signature
+        removed = self._board_signatures.keys() - self.trains.keys()
+        for wdf in removed:
+            del self._board_signatures[wdf]
+        changed |= removed
+        if not changed:
+            return set()
+
+        # 変化した列車が載っていた駅と、新たに載る駅
+        affected: set[int] = set()
+        added: dict[int, list[tuple[TrainData, StopStationData]]] = {}
+        for wdf in changed:
+            for stop in self._board_stops.pop(wdf, []):
+                affected.add(stop.station.station_number)
+            if wdf in removed:
+                continue
+            train = self.trains[wdf]
+            stops = self._train_board_stops(train)
+            self._board_stops[wdf] = stops
+            for stop in stops:
+                number = stop.station.station_number
+                affected.add(number)
+                added.setdefault(number, []).append((train, stop))
+
+        for number in affected:
+            board = boards.get(number)
+            if board is None:
+                continue
+            entries = [entry for entry in board.entries if entry[0].wdfBlockNo not in changed]
+            entries += added.get(number, [])
+            entries.sort(key=lambda x: x[1].time or min_time)
+            # 走行中の列車の停車も、変化した列車の分だけ入れ替える
+            active = [entry for entry in board.active_entries if entry[0].wdfBlockNo not in changed]
+            active += [entry for entry in added.get(number, []) if isinstance(entry[0], ActiveTrainData)]
+            active.sort(key=lambda x: x[1].time or min_time)
+            new_board = DepartureBoard(board.station, entries, board.version, active)
+            if new_board.content_key() == board.content_key():
+                # 表示内容は同じなので、オブジェクトはそのままで参照先の列車だけ差し替える
+                board.entries = entries
+                board.active_entries = active
+                continue
+            new_board.version = self._next_board_version()
+            boards[number] = new_board
+        return affected
+
+    def departure_boards(self, top: Optional[int] = None) -> dict[int, DepartureBoard]:
+        """
+        全駅の発車標を返す（駅番号:DepartureBoard）。
+        各列車の残りの停車駅を1回ずつたどって全駅分をまとめて作るため、駅ごとにupcoming_trainsを呼ぶより高速。
+        fetch_pos後の最初の呼び出しでは、位置・状態・遅延・ダイヤが変わった列車に関係する駅だけを作り直す。
+        内容の変わらなかった発車標は同じオブジェクト・同じversionのまま返るため、HTTPのキャッシュ（ETagなど）に使える。
+        - top: 指定すると各駅の先頭top件のみ返す
+        """
+        if self._boards is None:
+            with phase(self.metrics, "departure_boards.build"):
+                self._boards = self._build_departure_boards()
+            self._boards_top = {}
+            self._boards_dirty = False
+        elif self._boards_dirty:
+            with phase(self.metrics, "departure_boards.update"):
+                affected = self._update_departure_boards(self._boards)
+                self._boards_dirty = False
+                for n, top_boards in self._boards_top.items():
+                    for number in affected:
+                        self._set_top_board(top_boards, n, number)
+            if self.metrics is not None:
+                self.metrics.count("departure_boards.rebuilt_stations", len(affected))
+        elif self.metrics is not None:
+            self.metrics.count("departure_boards.cache_hits")
+        if top is None:
+            return self._boards
+
+        if top not in self._boards_top:
+            self._boards_top[top] = {number: board.top(top) for number, board in self._boards.items()}
+        return self._boards_top[top]
+
+    def _set_top_board(self, top_boards: dict[int, DepartureBoard], n: int, number: int) -> None:
+        """先頭n件の発車標を作り直す。先頭n件の内容が変わっていなければ以前のオブジェクトを使い回す。"""
+        new_top = self._boards[number].top(n)
+        old_top = top_boards.get(number)
+        if old_top is not None and old_top.content_key() == new_top.content_key():
+            old_top.entries = new_top.entries
+        else:
+            top_boards[number] = new_top
+
+    def eta_matrix(self, stuck_threshold: datetime.timedelta = STUCK_THRESHOLD) -> ETAMatrix:
+        """
+        走行中の全列車 × 全駅の推定到着時刻（予定時刻＋遅延分数）の行列を返す。
+        eta_modelが設定されていれば、予測できた停車はその予測到着時刻を使う。
+        始発駅以外でstuck_threshold以上停車している列車は足止めとみなし、推定しない（None）。
+        結果は次にfetch_posで列車が更新されるまでキャッシュされる。
+        """
+        if self._eta is not None and self._eta_threshold == stuck_threshold:
+            if self.metrics is not None:
+                self.metrics.count("eta_matrix.cache_hits")
+            return self._eta
+        # 残りの停車駅は発車標と共通
+        self.departure_boards()
+        rows = []
+        for wdf, train in self.active_trains.items():
+            try:
+                stuck = not train.is_at_start_station and train.stopping_time > stuck_threshold
+            except (ValueError, IndexError):
+                stuck = False
+            stops = [(stop.station.station_number, stop.time) for stop in self._board_stops.get(wdf, [])]
+            rows.append((wdf, stops, train.delay_minutes, stuck))
+        now = self.now()
+        predicted = self.eta_model.predict_all(self, now) if self.eta_model is not None else None
+        self._eta = build_eta_matrix(rows, sorted(self.stations), now, predicted)
+        self._eta_threshold = stuck_threshold
+        return self._eta
+
+    def estimate_arrival(self, train: "TrainData", station: StationData) -> Optional[datetime.datetime]:
+        """
+        遅延を加味した列車の推定到着時刻。eta_matrixから読み出す。
+        停車しない・通過済み・足止めと判定した場合はNone。
+        """
+        return self.eta_matrix().get(train.wdfBlockNo, station.station_number)
+
+    @property
+    def web(self) -> AsyncClient:
+        """通信に使うAsyncClient。指定がなければ共有クライアントを返す。"""
+        return self._web or get_client()
+
+    @web.setter
+    def web(self, client: AsyncClient) -> None:
+        self._web = client
+
+    async def aclose(self) -> None:
+        """
+        clientに渡したAsyncClient（KHTracker.atやReplaySource.trackerで作ったものを含む）を閉じる。
+        共有クライアントは閉じない（keihan_tracker.client.aclose_client を使う）。
+        """
+        if self._web is not None:
+            await self._web.aclose()
+
+    async def _get(self, endpoint: str) -> Response:
+        """エンドポイントのURLをfetcherを通してGETする。metricsがあれば "<エンドポイント名>.download" と受信バイト数を記録する"""
+        if self.metrics is None:
+            return await self.fetcher.get(self.web, endpoint, self.urls[endpoint])
+        with self.metrics.phase(f"{endpoint}.download"):
+            res = await self.fetcher.get(self.web, endpoint, self.urls[endpoint])
+        self.metrics.count(f"{endpoint}.bytes", len(res.content))
+        return res
+
+    async def _parse(self, model: type[BaseModel], text: str, endpoint: str) -> Any:
+        """
+        JSON文字列をモデルでパースする（executorがあればそこで実行）。
+        metricsがあれば "<エンドポイント名>.parse"（json.loads）と ".validate"（バリデーション）の秒数を記録する
+        """
+        if self.metrics is None:
+            return await self._run_cpu(_parse_json, model, text)
+        result, loads, validate = await self._run_cpu(_parse_json_timed, model, text)
+        self.metrics.observe(f"{endpoint}.parse", loads)
+        self.metrics.observe(f"{endpoint}.validate", validate)
+        return result
+
+    def _mark_stale(self, error: Exception) -> None:
+        """取得に失敗したが、前回のデータを引き続き使うことを記録する。"""
+        self.is_stale = True
+        self.last_error = error
+        warnings.warn(f"取得に失敗したため前回のデータを使用します: {error!r}", RuntimeWarning)
+
+    @property
+    def data_age(self) -> Optional[datetime.timedelta]:
+        """保持している列車位置データの経過時間（fileCreatedTime基準）。未取得ならNone。"""
+        if self.train_position_list is None:
+            return None
+        return self.now() - self.train_position_list.fileCreatedTime
+
+    async def _run_cpu(self, func: Callable[..., _T], *args, thread_only: bool = False) -> _T:
+        """
+        CPU負荷の高い処理を実行する。
+        executorが設定されていればそこで実行し、結果をイベントループに戻す。
+        thread_only=Trueの処理はtrackerのオブジェクトを共有するため、
+        executorがProcessPoolExecutorの場合はループ既定のスレッドプールで実行する。
+        """
+        if self.executor is None:
+            return func(*args)
+        executor = self.executor
+        if thread_only and isinstance(executor, ProcessPoolExecutor):
+            executor = None
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
     #動的データを更新
     async def fetch_pos(self):
         "列車走行位置を更新します。1分に1回が適切でしょう。"
         #不変データをダウンロード
         if not self.select_station:
-            res = await self.web.get("https://www.keihan.co.jp/zaisen/select_station.json")
-            res.raise_for_status()
-            self.select_station = SelectStation.model_validate(json.loads(res.text))
+            res = await self._get("select_station")
+            self.select_station = await self._parse(SelectStation, res.text, "select_station")
             # select_stationから駅データを登録
             for line,line_detail in self.select_station.root.items():
                 for number, name in line_detail.stations.items():
@@ -635,113 +1138,153 @@ class KHTracker:
                                                 station_name = name,
                     )
         if not self.transfer_guide_info:
-            res = await self.web.get("https://www.keihan.co.jp/zaisen/transferGuideInfo.json")
-            res.raise_for_status()
-            self.transfer_guide_info = TransferGuideInfo.model_validate(json.loads(res.text))
+            res = await self._get("transfer_guide_info")
+            self.transfer_guide_info = await self._parse(TransferGuideInfo, res.text, "transfer_guide_info")
             # transferGuideInfoから乗り換え情報を登録
             for number, transfers in self.transfer_guide_info.root.items():
                 number = int(number[2:])
                 self.stations[number].transfer = transfers
         
         # レート制限
-        now = datetime.datetime.now(tz=JST)
+        now = self.now()
         if self.last_fetch_pos_datetime:
             # 前回の取得 + 制限interval
             next_fetch = self.last_fetch_pos_datetime + datetime.timedelta(seconds=self.rate_limit_interval)
             if now <= next_fetch:
+                if self.metrics is not None:
+                    self.metrics.count("fetch_pos.rate_limited")
                 return
         
         # 列車位置を取得
         self.last_fetch_pos_datetime = now
-        res = await self.web.get("https://www.keihan.co.jp/zaisen-up/trainPositionList.json")
-        res.raise_for_status()
-        self.train_position_list = trainPositionList.model_validate(json.loads(res.text))
-        del res
+        with phase(self.metrics, "fetch_pos"):
+            await self._poll(now)
+
+    async def _poll(self, now: datetime.datetime) -> None:
+        """fetch_posのうち、レート制限を通過した後の列車位置の取得・反映"""
+        # FileList.xmlで更新を確認し、変化がなければ大きなJSONの取得・パースを省略する
+        filelist: Optional[FileList] = None
+        if self.use_filelist:
+            changed, filelist = await self._filelist_changed()
+            if not changed:
+                if self.metrics is not None:
+                    self.metrics.count("fetch_pos.filelist_unchanged")
+                # 列車位置が変わらなくても、古くなったダイヤは更新する
+                if self.starttime_list is not None and self._dia_expired():
+                    await self.regist_dia(True)
+                return
 
-        old_wdfs: list[int] = []
-        # 前日の列車があれば削除
-        for wdf, train in self.trains.items():
-            if train.date != self.date:
-                old_wdfs.append(wdf)
-        for wdf in old_wdfs:
-            del self.trains[wdf]
-
-        # もう運行終了したActiveTrainDataをinactive化する
-        # 1. 現在アクティブな列車集合を取得
-        current_wdfs:set[int] = set()
-        for trainlist in self.train_position_list.locationObjects:
-            for train in trainlist.trainInfoObjects:
-                current_wdfs.add(train.wdfBlockNo)
-
-        # 2. 差集合で もうアクティブでなくなった列車を計算
-        wdfs_to_delete = set([train for train in self.trains.keys()]) - current_wdfs
-        for wdf in wdfs_to_delete:
-            if isinstance(self.trains[wdf], ActiveTrainData):
-                self.trains[wdf] = self.active_trains[wdf].inactivate()
-
-        # trainPositionListから列車一覧を取得
-        for trainlist in self.train_position_list.locationObjects:
-            # 同じ場所に2編成以上ある場合（連結等）があるのでリスト形式
-            for train in trainlist.trainInfoObjects:
-                wdf = train.wdfBlockNo
-                # 存在しない/アクティブでないなら新規作成
-                if self.trains.get(wdf) == None or not isinstance(self.trains.get(wdf), ActiveTrainData):
-                    new_active_train = ActiveTrainData(
-                        master=self, 
-                        wdfBlockNo=wdf,
-                        date=self.date,
-                        train_number = train.trainNumber,
-                        destination = self.stations[train.destStationNumber],
-                        train_type = train.trainTypeJp,
-                        is_special = train.is_special,
-                        cars = train.carsOfTrain,
-                        # up:京都方面（京阪本線）、枚方市方面（交野線）、中書島方面（宇治線）
-                        # down: 大阪方面、私市方面、宇治方面
-                        direction = "up" if trainlist.trainDirection == 0 else "down",
-                        location_col = trainlist.locationCol,
-                        location_row = trainlist.locationRow,
-                        delay_text = MultiLang(
+        try:
+            res = await self._get("train_position_list")
+        except (HTTPError, CircuitOpenError) as e:
+            # 前回のデータがあればそれを使い続ける
+            if not self.serve_stale or self.train_position_list is None:
+                raise
+            self._mark_stale(e)
+            return
+        self.is_stale = False
+        self.last_error = None
+        self.train_position_list = await self._parse(trainPositionList, res.text, "train_position_list")
+        del res
+        # 列車位置を反映できてからFileListを記録する（失敗した回は次回も取得し直す）
+        if filelist is not None:
+            self.file_list = filelist
+        self.scheduler.observe(self.train_position_list.fileCreatedTime, now)
+
+        changed = 0   # 新たに走り始めた・位置が変わった・運行を終えた列車の数
+        with phase(self.metrics, "fetch_pos.inactivate"):
+            old_wdfs: list[int] = []
+            # 前日の列車があれば削除
+            for wdf, train in self.trains.items():
+                if train.date != self.date:
+                    old_wdfs.append(wdf)
+            for wdf in old_wdfs:
+                del self.trains[wdf]
+
+            # もう運行終了したActiveTrainDataをinactive化する
+            # 1. 現在アクティブな列車集合を取得
+            current_wdfs:set[int] = set()
+            for trainlist in self.train_position_list.locationObjects:
+                for train in trainlist.trainInfoObjects:
+                    current_wdfs.add(train.wdfBlockNo)
+
+            # 2. 差集合で もうアクティブでなくなった列車を計算
+            wdfs_to_delete = set([train for train in self.trains.keys()]) - current_wdfs
+            for wdf in wdfs_to_delete:
+                if isinstance(self.trains[wdf], ActiveTrainData):
+                    self.trains[wdf] = self.active_trains[wdf].inactivate()
+                    changed += 1
+
+        with phase(self.metrics, "fetch_pos.reconcile"):
+            # trainPositionListから列車一覧を取得
+            for trainlist in self.train_position_list.locationObjects:
+                # 同じ場所に2編成以上ある場合（連結等）があるのでリスト形式
+                for train in trainlist.trainInfoObjects:
+                    wdf = train.wdfBlockNo
+                    # 存在しない/アクティブでないなら新規作成
+                    if self.trains.get(wdf) == None or not isinstance(self.trains.get(wdf), ActiveTrainData):
+                        new_active_train = ActiveTrainData(
+                            master=self, 
+                            wdfBlockNo=wdf,
+                            date=self.date,
+                            train_number = train.trainNumber,
+                            destination = self.stations[train.destStationNumber],
+                            train_type = train.trainTypeJp,
+                            is_special = train.is_special,
+                            cars = train.carsOfTrain,
+                            # up:京都方面（京阪本線）、枚方市方面（交野線）、中書島方面（宇治線）
+                            # down: 大阪方面、私市方面、宇治方面
+                            direction = "up" if trainlist.trainDirection == 0 else "down",
+                            location_col = trainlist.locationCol,
+                            location_row = trainlist.locationRow,
+                            delay_text = MultiLang(
+                                ja = train.delayMinutes,
+                                en = train.delayMinutesEn,
+                                cn = train.delayMinutesZhCn,
+                                tw = train.delayMinutesZhTw,
+                                kr = train.delayMinutesKo
+                            ),
+                            delay_minutes = int(re.sub(r"\D","",train.delayMinutes)) if train.delayMinutes != "" else 0
+                            )
+                        if new_active_train.is_stopping:
+                            new_active_train.station_arrival_time = self.now()
+                    
+                        self.trains[wdf] = new_active_train
+                        changed += 1
+
+                    elif type(self.trains[wdf]) == ActiveTrainData:
+                        # 可変の情報を更新
+                        active_train = self.active_trains[wdf]
+                        old_coordinate = (active_train.location_row, active_train.location_col)
+                        new_coordinate = (trainlist.locationRow, trainlist.locationCol)
+                        active_train.location_row = new_coordinate[0]
+                        active_train.location_col = new_coordinate[1]
+                        if old_coordinate != new_coordinate:
+                            changed += 1
+                        active_train.delay_text = MultiLang(
                             ja = train.delayMinutes,
                             en = train.delayMinutesEn,
                             cn = train.delayMinutesZhCn,
                             tw = train.delayMinutesZhTw,
                             kr = train.delayMinutesKo
-                        ),
-                        delay_minutes = int(re.sub(r"\D","",train.delayMinutes)) if train.delayMinutes != "" else 0
                         )
-                    if new_active_train.is_stopping:
-                        new_active_train.station_arrival_time = datetime.datetime.now(tz=JST)
-                    
-                    self.trains[wdf] = new_active_train
-
-                elif type(self.trains[wdf]) == ActiveTrainData:
-                    # 可変の情報を更新
-                    active_train = self.active_trains[wdf]
-                    old_coordinate = (active_train.location_row, active_train.location_col)
-                    new_coordinate = (trainlist.locationRow, trainlist.locationCol)
-                    active_train.location_row = new_coordinate[0]
-                    active_train.location_col = new_coordinate[1]
-                    active_train.delay_text = MultiLang(
-                        ja = train.delayMinutes,
-                        en = train.delayMinutesEn,
-                        cn = train.delayMinutesZhCn,
-                        tw = train.delayMinutesZhTw,
-                        kr = train.delayMinutesKo
-                    )
-                    active_train.delay_minutes = int(re.sub(r"\D","",train.delayMinutes)) if train.delayMinutes != "" else 0
-
-                    # lastPassStationを更新
-                    if train.lastPassStation != 99 and train.lastPassStation != 0:
-                        active_train.lastpass_station = self.stations[train.lastPassStation]
-                    else:
-                        active_train.lastpass_station = None
-
-                    # 停車時刻を算出
-                    if not active_train.is_stopping:
-                        active_train.station_arrival_time = None
-                    else:
-                        if old_coordinate != new_coordinate:
-                            active_train.station_arrival_time = datetime.datetime.now(tz=JST)
+                        active_train.delay_minutes = int(re.sub(r"\D","",train.delayMinutes)) if train.delayMinutes != "" else 0
+
+                        # lastPassStationを更新
+                        if train.lastPassStation != 99 and train.lastPassStation != 0:
+                            active_train.lastpass_station = self.stations[train.lastPassStation]
+                        else:
+                            active_train.lastpass_station = None
+
+                        # 停車時刻を算出
+                        if not active_train.is_stopping:
+                            active_train.station_arrival_time = None
+                        else:
+                            if old_coordinate != new_coordinate:
+                                active_train.station_arrival_time = self.now()
+        if self.metrics is not None:
+            self.metrics.count("fetch_pos.changed_trains", changed)
+            self.metrics.gauge("fetch_pos.trains", len(current_wdfs))
 
         # 日付更新
         if 0 <= self.train_position_list.fileCreatedTime.hour <= 5:
@@ -752,47 +1295,147 @@ class KHTracker:
         
         #ダイア情報を登録
         if self.starttime_list:
-            if (datetime.datetime.now(JST)-self.starttime_list.fileCreatedTime) > datetime.timedelta(hours=1):
+            if self._dia_expired():
                 await self.regist_dia(True)
             else:
                 await self.regist_dia(False)
         else:
             await self.regist_dia(True)
 
+        with phase(self.metrics, "fetch_pos.listeners"):
+            # 列車の状態は更新済みなので、listenerの失敗はfetch_posの失敗にしない
+            for listener in self.listeners:
+                try:
+                    result = listener(self)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    warnings.warn(f"listener {listener!r} でエラーが発生しました: {e!r}", RuntimeWarning)
+
+    @property
+    def next_fetch_datetime(self) -> datetime.datetime:
+        """上流の更新周期とレート制限から求めた、次にfetch_posを呼ぶべき時刻"""
+        return self.scheduler.next_fetch_time(
+            self.now(), self.rate_limit_interval, self.last_fetch_pos_datetime
+            )
+
+    async def wait_next_fetch(self):
+        """
+        次にfetch_posを呼ぶべき時刻まで待機する。
+        固定間隔で待つ代わりに、上流でtrainPositionListが生成された直後に取得できる。
+        """
+        delay = (self.next_fetch_datetime - self.now()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @classmethod
+    async def at(
+            cls,
+            timestamp: datetime.datetime,
+            recording: "str | Path | SnapshotReader | SnapshotArchive",
+            **kwargs
+            ) -> "KHTracker":
+        """
+        SnapshotRecorderの記録から、timestamp時点の状態を復元したKHTrackerを返す。
+        - recording: 記録ファイル、記録ファイルを置いたディレクトリ、または開いたSnapshotReader/SnapshotArchive
+        - kwargs: KHTrackerの引数
+        記録の直前のキーフレームから差分をたどって復元するため、記録が長期間でも1日の先頭から再生しない。
+        返すKHTrackerの現在時刻（clock）はtimestampに固定され、発車標や列車の状態もその時点のものになる。
+        続きを再生する場合は、replay.ReplaySource を seek() してから play() を使う。
+        パスから開いた記録は復元後に閉じる。返したKHTrackerは使い終わったらaclose()で閉じる。
+        """
+        from .replay import ReplaySource
+        from .recorder import KIND_NAMES
+
+        replay = ReplaySource(recording)
+        try:
+            state = replay.seek(timestamp)
+            missing = set(KIND_NAMES.values()) - set(state)
+            if missing:
+                raise LookupError(f"{timestamp} 時点の記録がありません: {', '.join(sorted(missing))}")
+            tracker = replay.tracker(**kwargs)
+            await tracker.fetch_pos()
+        except BaseException:
+            await replay.aclose()
+            raise
+        # 復元した時点のデータは読み込み済みなので、記録はもう使わない
+        replay.close_recording()
+        return tracker
+
     async def regist_dia(self, download:bool):
         "ダイヤ情報を更新します。更新が必要な際にはfetch_posから自動的に実行されます。"
+        with phase(self.metrics, "regist_dia"):
+            return await self._regist_dia(download)
+
+    async def _regist_dia(self, download: bool) -> "KHTracker":
         if download or self.starttime_list == None:
-            res = await self.web.get("https://www.keihan.co.jp/zaisen-up/startTimeList.json")
-            res.raise_for_status()
-            self.starttime_list = startTimeList.model_validate(json.loads(res.text))
-            del res
+            try:
+                res = await self._get("start_time_list")
+            except (HTTPError, CircuitOpenError) as e:
+                # 前回のダイヤがあればそれで登録を続ける
+                if not self.serve_stale or self.starttime_list is None:
+                    raise
+                self._mark_stale(e)
+            else:
+                self.starttime_list = await self._parse(startTimeList, res.text, "start_time_list")
+                del res
+
+        # 停車駅リストの構築はexecutor上で行い、結果の反映のみループ上で行う
+        with phase(self.metrics, "regist_dia.build"):
+            dia = await self._run_cpu(
+                self._build_dia, self.starttime_list, self.date, set(self.trains.keys()), thread_only=True
+                )
 
-        # startTimeListからデータを登録
-        for train in self.starttime_list.TrainInfo:
+        changed = 0   # 新たに登録した・停車駅が変わった列車の数
+        with phase(self.metrics, "regist_dia.apply"):
+            for wdf, (train_formation, has_premiumcar, route_stations) in dia.items():
+                if not wdf in self.trains:
+                    self.trains[wdf] = TrainData(
+                        master=self,
+                        wdfBlockNo=wdf,
+                        has_premiumcar=has_premiumcar,
+                        train_formation=train_formation,
+                        date=self.date
+                    )
+
+                self.trains[wdf].train_formation = train_formation
+                self.trains[wdf].has_premiumcar = has_premiumcar
+                # 停車駅が変わっていなければ以前のリストを残す（発車標の差分更新で同一性を比較するため）
+                if _route_key(self.trains[wdf].route_stations) != _route_key(route_stations):
+                    self.trains[wdf].route_stations = route_stations
+                    changed += 1
+        if self.metrics is not None:
+            self.metrics.count("regist_dia.changed_trains", changed)
+            self.metrics.gauge("regist_dia.trains", len(dia))
+
+        # 列車位置・ダイヤが変わったので、次のdeparture_boardsで変化した列車の分だけ発車標を作り直す
+        self._boards_dirty = True
+        self._eta = None
+        return self
+
+    def _build_dia(
+            self,
+            starttime_list: startTimeList,
+            date: datetime.date,
+            known_wdfs: set[int]
+            ) -> dict[int, tuple[int, bool, list[StopStationData]]]:
+        """
+        startTimeListから列車ごとの（編成, プレミアムカー有無, 停車駅リスト）を構築する。
+        self.trainsは変更しないため、イベントループ外で実行できる。
+        """
+        dia: dict[int, tuple[int, bool, list[StopStationData]]] = {}
+        for train in starttime_list.TrainInfo:
             # 臨時列車の場合
             if train.extTrain:
                 # ActiveTrainDataがある場合、当日の便で確定するので登録
-                if train.wdfBlockNo in self.trains.keys():
+                if train.wdfBlockNo in known_wdfs:
                     pass
                 # 当日の便でない可能性があるため登録スキップ
                 else:
                     continue
-            
-            wdf = train.wdfBlockNo
-            if not wdf in self.trains:
-                self.trains[wdf] = TrainData(
-                    master=self,
-                    wdfBlockNo=wdf,
-                    has_premiumcar=bool(train.premiumCar),
-                    train_formation=int(train.trainCar),
-                    date=self.date
-                )
-            
-            self.trains[wdf].train_formation = int(train.trainCar)
-            self.trains[wdf].has_premiumcar = bool(train.premiumCar)
-                
+
             # ダイヤ登録
-            self.trains[wdf].route_stations = []
+            route_stations: list[StopStationData] = []
             for stop_station in (train.diaStationInfoObjects):
                 # 3桁の上２桁が駅番号
                 if len(stop_station.stationNumber) != 3:
@@ -805,7 +1448,7 @@ class KHTracker:
 
                 # もし出発駅なら-
                 if stop_station.stationDepTime == "-":
-                    self.trains[wdf].route_stations.append(
+                    route_stations.append(
                         StopStationData(
                             is_start = True,
                             is_final=False,
@@ -824,9 +1467,9 @@ class KHTracker:
                 # 停車駅なら
                 else:
                     is_stop:bool = True
-                    time = datetime.datetime.combine(self.date, datetime.time.min) + datetime.timedelta(hours=ltime[0],minutes=ltime[1])
+                    time = datetime.datetime.combine(date, datetime.time.min) + datetime.timedelta(hours=ltime[0],minutes=ltime[1])
                     time = time.replace(tzinfo=JST)
-                self.trains[wdf].route_stations.append(
+                route_stations.append(
                         StopStationData(
                             is_start = False,
                             is_stop = is_stop,
@@ -835,23 +1478,49 @@ class KHTracker:
                             time = time
                             )
                         )
-            
+
             # まれに始発駅に時刻が登録される場合あり
             # https://web.archive.org/web/20260124090959/https://www.keihan.co.jp/zaisen-up/startTimeList.json?6f4653a2-5a0a-4a65-810d-f1917026b14b
-            if len([stop for stop in self.trains[wdf].route_stations if stop.is_start]) == 0:
-                start_station = min(self.trains[wdf].route_stations, key=lambda x:x.time or datetime.datetime.max.replace(tzinfo=JST))
+            if len([stop for stop in route_stations if stop.is_start]) == 0:
+                start_station = min(route_stations, key=lambda x:x.time or datetime.datetime.max.replace(tzinfo=JST))
                 start_station.is_start = True
 
             # 終着駅
-            final_station = max(self.trains[wdf].route_stations, key=lambda x:x.time or datetime.datetime.min.replace(tzinfo=JST))
+            final_station = max(route_stations, key=lambda x:x.time or datetime.datetime.min.replace(tzinfo=JST))
             final_station.is_final = True
 
-        return self
+            dia[train.wdfBlockNo] = (int(train.trainCar), bool(train.premiumCar), route_stations)
+        return dia
 
-    async def fetch_filelist(self):
-        """【未実装】FileList.xmlを取得する。"""
-        res = await self.web.get("https://www.keihan.co.jp/tinfo/05-flist/FileList.xml")
-        res.raise_for_status()
+    def _dia_expired(self) -> bool:
+        """startTimeListの作成から1時間以上経っているか"""
+        return self.starttime_list is not None and (self.now()-self.starttime_list.fileCreatedTime) > datetime.timedelta(hours=1)
+
+    async def _filelist_changed(self) -> tuple[bool, Optional[FileList]]:
+        """
+        FileList.xmlのtimeが前回から変わったかと、取得したFileListを返す。
+        初回や、FileList.xmlを取得・解釈できなかった場合は、取り逃さないようTrueを返す。
+        file_listは更新しない（列車位置を反映できた後に_pollが記録する）。
+        """
+        previous = self.file_list.time if self.file_list else None
+        try:
+            filelist = await self._fetch_filelist()
+        except (HTTPError, CircuitOpenError, ET.ParseError, ValueError):
+            return True, None
+        if filelist is None or previous is None or self.train_position_list is None:
+            return True, filelist
+        return filelist.time != previous, filelist
+
+    async def fetch_filelist(self) -> Optional[FileList]:
+        """FileList.xmlを取得してfile_listに格納する。timeが含まれていなければNoneを返す。"""
+        filelist = await self._fetch_filelist()
+        if filelist is not None:
+            self.file_list = filelist
+        return filelist
+
+    async def _fetch_filelist(self) -> Optional[FileList]:
+        """FileList.xmlを取得して解釈する。timeが含まれていなければNoneを返す。"""
+        res = await self._get("file_list")
         root = ET.fromstring(res.text)
 
         # 時刻設定
@@ -859,7 +1528,7 @@ class KHTracker:
         if t:
             time = datetime.datetime.strptime(t,"%Y%m%d%H%M%S").replace(tzinfo=JST)
         else:
-            return
+            return None
         traininfo = root.findtext("traininfo") or ""
         image_PC = root.findtext("image_PC") or ""
         image_SP = root.findtext("image_SP") or ""
@@ -872,7 +1541,7 @@ class KHTracker:
             image_SP=image_SP,
             html_FP=html_FP
         )
-        self.file_list = filelist
+        return filelist
 
     @property
     def max_delay_train(self) -> Optional[ActiveTrainData]:
@@ -891,3 +1560,61 @@ class KHTracker:
     def max_delay_minutes(self) -> int:
         """現在の最大遅延分数"""
         return self.max_delay_train.delay_minutes if self.max_delay_train else 0
+
+    # memory_reportで個別に計上する属性（これ以外の属性は "other" に計上する）
+    _REPORTED_ATTRS = {
+        "stations", "trains", "starttime_list", "train_position_list", "select_station", "transfer_guide_info",
+        "file_list", "_boards", "_boards_top", "_board_signatures", "_board_stops", "_eta",
+    }
+    # 外部の資源で、trackerが保持するデータではないもの
+    _UNREPORTED_ATTRS = {"_web", "executor", "clock", "listeners"}
+
+    def memory_report(self) -> MemoryReport:
+        """
+        保持しているデータの構造ごとのメモリ使用量の概算（要素数・オブジェクト数・バイト数）。構造は memory.REPORT_ORDER を参照。
+        複数の構造から参照されるオブジェクトは、REPORT_ORDERの順で先の構造に計上する（列車の行先駅は stations など）。
+        全オブジェクトをたどるため、列車の多い時間帯は1秒程度かかる。
+        """
+        seen: set[int] = {id(self)}
+        trains = self.trains.values()
+        actives = [train for train in trains if isinstance(train, ActiveTrainData)]
+        routes = [train.route_stations for train in trains]
+        statics = [model for model in (self.select_station, self.transfer_guide_info, self.file_list) if model is not None]
+        others = {
+            name: value for name, value in vars(self).items()
+            if name not in self._REPORTED_ATTRS and name not in self._UNREPORTED_ATTRS
+            }
+        roots: dict[str, tuple[int, list[Any]]] = {
+            "stations":            (len(self.stations), [self.stations]),
+            "route_stations":      (sum(len(route) for route in routes), routes),
+            "trains":              (len(self.trains) - len(actives), [self.trains]),
+            "active_trains":       (len(actives), actives),
+            "starttime_list":      (len(self.starttime_list.TrainInfo) if self.starttime_list else 0, [self.starttime_list]),
+            "train_position_list": (
+                sum(len(location.trainInfoObjects) for location in self.train_position_list.locationObjects)
+                if self.train_position_list else 0,
+                [self.train_position_list]
+                ),
+            "static":              (len(statics), statics),
+            "departure_boards":    (
+                len(self._boards or {}) + sum(len(boards) for boards in self._boards_top.values()),
+                [self._boards, self._boards_top]
+                ),
+            "board_index":         (len(self._board_signatures), [self._board_signatures, self._board_stops]),
+            "eta_matrix":          (len(self._eta.wdfs) if self._eta else 0, [self._eta]),
+            "other":               (len(others), list(others.values())),
+        }
+
+        usages: dict[str, MemoryUsage] = {}
+        active_ids = {id(train) for train in actives}
+        for name in REPORT_ORDER:
+            items, objects = roots[name]
+            if name == "trains":
+                # self.trainsの辞書からは走行中の列車をたどらない（active_trainsに計上する）
+                seen |= active_ids
+                size, count = deep_sizeof(objects, seen)
+                seen -= active_ids
+            else:
+                size, count = deep_sizeof(objects, seen)
+            usages[name] = MemoryUsage(items=items, objects=count, bytes=size)
+        return MemoryReport(usages=usages)
@@ -0,0 +1,174 @@
+"""
+取得処理の区間ごとの計測。
+
+FetchMetricsを KHTracker・BusInfoFetcher（KHBusTracker）・YahooDelayClient の metrics に渡すと、
+取得・パース・更新などの区間の処理時間と、取得したバイト数・列車数・キャッシュヒット数などを集計する。
+metricsを渡さなければ計測は行わず、各区間で増えるのはNoneの判定だけになる。
+
+    metrics = FetchMetrics()
+    metrics.listeners.append(lambda kind, name, value: print(kind, name, value))
+    tracker = KHTracker(metrics=metrics)
+    await tracker.fetch_pos()
+    print(metrics.prometheus())
+
+区間名・カウンター名は "fetch_pos.download" のように「処理.区間」とする（README参照）。
+"""
+
+from typing import Optional, Any, Callable, Literal
+from contextlib import nullcontext
+import re
+import threading
+import time
+
+# metricsがNoneのときにphase()が返すコンテキストマネージャー（状態を持たないので使い回す）
+_NULL_PHASE = nullcontext()
+
+MetricKind = Literal["phase", "counter", "gauge"]
+
+
+class PhaseStats:
+    """1つの区間の集計。秒数の合計・回数・最大・直近の値"""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.last: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self) -> str:
+        return f"PhaseStats(count={self.count}, mean={self.mean:.6f}, max={self.max:.6f}, last={self.last:.6f})"
+
+
+class _Phase:
+    """FetchMetrics.phaseが返すタイマー"""
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "FetchMetrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "_Phase":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class FetchMetrics:
+    """
+    区間の処理時間とカウンター・ゲージの集計。
+    - phases: 区間名:PhaseStats
+    - counters: 累積する値（取得したバイト数、キャッシュヒット数など）
+    - gauges: 直近の値（列車数など）
+    - listeners: 値が記録されるたびに (種類, 名前, 値) を引数に呼ばれる関数。種類は "phase"・"counter"・"gauge"。
+      記録したスレッド（executorを使う場合はそのスレッド）で呼ばれるため、重い処理は行わないこと
+    - prefix: prometheus()で出力するメトリクス名の接頭辞
+    """
+    def __init__(self, prefix: str = "keihan_tracker") -> None:
+        self.prefix = prefix
+        self.phases: dict[str, PhaseStats] = {}
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.listeners: list[Callable[[MetricKind, str, float], Any]] = []
+        # 発車標の構築などはexecutorのスレッドから記録されるため、集計の更新はロックする
+        self._lock = threading.Lock()
+
+    def phase(self, name: str) -> _Phase:
+        """with文で囲んだ区間の処理時間を記録する"""
+        return _Phase(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """区間の処理時間を記録する"""
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+            stats.add(seconds)
+        self._notify("phase", name, seconds)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """カウンターに加算する"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._notify("counter", name, value)
+
+    def gauge(self, name: str, value: float) -> None:
+        """ゲージを設定する"""
+        with self._lock:
+            self.gauges[name] = value
+        self._notify("gauge", name, value)
+
+    def _notify(self, kind: MetricKind, name: str, value: float) -> None:
+        for listener in self.listeners:
+            listener(kind, name, value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phases.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def snapshot(self) -> dict[str, float]:
+        """
+        集計の平坦な辞書。区間は "<区間名>.seconds"（合計）・".count"・".max"・".last"、
+        カウンターとゲージはその名前のまま。
+        """
+        with self._lock:
+            result: dict[str, float] = {}
+            for name, stats in self.phases.items():
+                result[f"{name}.seconds"] = stats.total
+                result[f"{name}.count"] = stats.count
+                result[f"{name}.max"] = stats.max
+                result[f"{name}.last"] = stats.last
+            result.update(self.counters)
+            result.update(self.gauges)
+        return result
+
+    def _metric_name(self, name: str) -> str:
+        return re.sub(r"[^a-zA-Z0-9_]", "_", f"{self.prefix}_{name}")
+
+    def prometheus(self) -> str:
+        """Prometheusのテキスト形式（text/plain; version=0.0.4）の出力"""
+        phase_metric = self._metric_name("phase_seconds")
+        lines: list[str] = []
+        with self._lock:
+            if self.phases:
+                lines.append(f"# HELP {phase_metric} 取得処理の区間ごとの処理時間")
+                lines.append(f"# TYPE {phase_metric} summary")
+                for name, stats in sorted(self.phases.items()):
+                    lines.append(f'{phase_metric}_sum{{phase="{name}"}} {stats.total!r}')
+                    lines.append(f'{phase_metric}_count{{phase="{name}"}} {stats.count}')
+                for suffix in ("max", "last"):
+                    lines.append(f"# TYPE {phase_metric}_{suffix} gauge")
+                    for name, stats in sorted(self.phases.items()):
+                        lines.append(f'{phase_metric}_{suffix}{{phase="{name}"}} {getattr(stats, suffix)!r}')
+            for name, value in sorted(self.counters.items()):
+                metric = self._metric_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value!r}")
+            for name, value in sorted(self.gauges.items()):
+                metric = self._metric_name(name)
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+def phase(metrics: Optional[FetchMetrics], name: str) -> "_Phase | nullcontext[None]":
+    """metricsがあればその区間のタイマー、Noneなら何もしないコンテキストマネージャーを返す"""
+    if metrics is None:
+        return _NULL_PHASE
+    return _Phase(metrics, name)
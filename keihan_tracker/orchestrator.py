@@ -0,0 +1,280 @@
+"""
+電車・バス・運行情報をまとめて定期取得するオーケストレーター。
+
+情報源（ソース）ごとに取得間隔とレート制限を持ち、それぞれ独立したタスクとして並行に取得する。
+あるソースの失敗や遅延は他のソースに影響せず、結果は取得時刻付きの1つの状態オブジェクトにまとめられる。
+
+    orchestrator = Orchestrator()
+    tracker = orchestrator.add_tracker()
+    orchestrator.add_bus_tracker([("京阪香里園", 1)], interval=15)
+    orchestrator.add_yahoo_delay(interval=60)
+
+    await orchestrator.refresh()         # 全ソースを並行に1回取得
+    asyncio.create_task(orchestrator.run())  # 以降はソースごとの間隔で取得し続ける
+"""
+
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, Any, Callable, Awaitable, Iterable
+from httpx import AsyncClient
+import asyncio
+import datetime
+import time
+import warnings
+
+from .keihan_train import KHTracker
+from .bus.tracker import KHBusTracker, BusInfoFetcher, StopKey
+from .delay_tracker import YahooDelayClient, get_ekispert_delay, JST
+from .metrics import FetchMetrics
+
+
+class SourceState(BaseModel):
+    """
+    1つのソースの状態。
+    - value: 最後に取得に成功した値（失敗しても前回の値を保持する）
+    - updated_at: 最後に取得に成功した時刻
+    - attempted_at: 最後に取得を試みた時刻
+    - duration: 直近の取得にかかった秒数
+    - error: 直近の取得で発生したエラー（成功すればNone）
+    - failures: 連続して失敗した回数
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    name:         str
+    value:        Any = None
+    updated_at:   Optional[datetime.datetime] = None
+    attempted_at: Optional[datetime.datetime] = None
+    duration:     Optional[float] = None
+    error:        Optional[BaseException] = None
+    failures:     int = 0
+
+    @property
+    def ok(self) -> bool:
+        """直近の取得に成功したか"""
+        return self.updated_at is not None and self.error is None
+
+    @property
+    def age(self) -> Optional[datetime.timedelta]:
+        """最後に取得に成功してからの経過時間"""
+        if self.updated_at is None:
+            return None
+        return datetime.datetime.now(JST) - self.updated_at
+
+
+class OrchestratorState(BaseModel):
+    """
+    全ソースの状態をまとめたもの。state["buses"] のようにソース名で値を取り出せる。
+    - updated_at: いずれかのソースが最後に更新された時刻
+    """
+    sources:    dict[str, SourceState] = Field(default_factory=dict)
+    updated_at: Optional[datetime.datetime] = None
+
+    def __getitem__(self, name: str) -> Any:
+        return self.sources[name].value
+
+    def get(self, name: str, default: Any = None) -> Any:
+        source = self.sources.get(name)
+        return default if source is None or source.value is None else source.value
+
+
+class Source:
+    """
+    定期取得する情報源。
+    - fetch: 引数なしで呼び出し、取得した値を返すコルーチン関数
+    - interval: 取得間隔（秒）
+    - rate_limit: 取得を試みる最短の間隔（秒）。失敗時の再試行もこれより短くはならない
+    - next_run: 次の取得時刻を返す関数。指定するとintervalの代わりに使う（KHTrackerの更新周期の学習など）
+    """
+    def __init__(
+            self,
+            name: str,
+            fetch: Callable[[], Awaitable[Any]],
+            interval: float,
+            rate_limit: float = 0,
+            next_run: Optional[Callable[[], datetime.datetime]] = None
+            ) -> None:
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.rate_limit = rate_limit
+        self.next_run = next_run
+        self.state = SourceState(name=name)
+        self.lock = asyncio.Lock()
+
+    def next_time(self) -> datetime.datetime:
+        """次に取得すべき時刻"""
+        last = self.state.attempted_at
+        if last is None:
+            return datetime.datetime.now(JST)
+        earliest = last + datetime.timedelta(seconds=self.rate_limit)
+        if self.next_run is not None:
+            try:
+                return max(self.next_run(), earliest)
+            except Exception as e:
+                # 次の取得時刻を求められなければintervalで続ける
+                warnings.warn(f"ソース {self.name} の次の取得時刻を求められませんでした: {e!r}", RuntimeWarning)
+        return max(last + datetime.timedelta(seconds=self.interval), earliest)
+
+
+class Orchestrator:
+    """
+    複数のソースを、それぞれの間隔で並行に取得する。
+    - client: 各ソースが使うAsyncClient。省略時は共有のクライアント（keihan_tracker.client）を使う
+    - sources: 登録されたソースの辞書（ソース名:Source）
+    - state: 全ソースの最新の状態
+    - metrics: 渡すと、add_*で作る各ソースの区間ごとの処理時間と、ソースごとの取得時間（"source.<ソース名>"）・失敗数を記録する
+    """
+    def __init__(self, client: Optional[AsyncClient] = None, metrics: Optional[FetchMetrics] = None) -> None:
+        self.client = client
+        self.metrics = metrics
+        self.sources: dict[str, Source] = {}
+        self.state = OrchestratorState()
+        # ソースが更新（成功・失敗とも）されるたびに呼ばれる関数
+        self.listeners: list[Callable[[SourceState], Any]] = []
+
+    def add(
+            self,
+            name: str,
+            fetch: Callable[[], Awaitable[Any]],
+            interval: float,
+            rate_limit: float = 0,
+            next_run: Optional[Callable[[], datetime.datetime]] = None
+            ) -> Source:
+        """任意のソースを登録する。"""
+        if name in self.sources:
+            raise ValueError(f"ソース {name} は既に登録されています")
+        source = Source(name, fetch, interval, rate_limit, next_run)
+        self.sources[name] = source
+        self.state.sources[name] = source.state
+        return source
+
+    def add_tracker(self, tracker: Optional[KHTracker] = None, name: str = "trains") -> KHTracker:
+        """
+        京阪電車の列車位置を登録する。取得時刻はKHTrackerが学習した更新周期に従う。
+        値はKHTrackerそのもの。取得に失敗して前回のデータを保持している間はerrorが設定される。
+        """
+        tracker = tracker or KHTracker(client=self.client, metrics=self.metrics)
+
+        async def fetch() -> KHTracker:
+            await tracker.fetch_pos()
+            if tracker.is_stale and tracker.last_error is not None:
+                raise tracker.last_error
+            return tracker
+
+        self.add(
+            name, fetch,
+            interval=tracker.rate_limit_interval,
+            rate_limit=tracker.rate_limit_interval,
+            next_run=lambda: tracker.next_fetch_datetime,
+        )
+        return tracker
+
+    def add_bus_tracker(
+            self,
+            stops: Iterable[StopKey] | KHBusTracker = (),
+            interval: float = 15,
+            rate_limit: float = 5,
+            name: str = "buses"
+            ) -> KHBusTracker:
+        """京阪バスの接近情報を登録する。値はKHBusTrackerそのもの。"""
+        if isinstance(stops, KHBusTracker):
+            bus_tracker = stops
+        else:
+            fetcher = None
+            if self.client is not None:
+                fetcher = BusInfoFetcher(client=self.client, lean=True, metrics=self.metrics)
+            bus_tracker = KHBusTracker(stops, fetcher=fetcher, metrics=self.metrics)
+
+        async def fetch() -> KHBusTracker:
+            await bus_tracker.fetch()
+            return bus_tracker
+
+        self.add(name, fetch, interval, rate_limit)
+        return bus_tracker
+
+    def add_yahoo_delay(
+            self,
+            area: int = 6,
+            interval: float = 60,
+            rate_limit: float = 30,
+            name: str = "yahoo_delay"
+            ) -> YahooDelayClient:
+        """Yahoo!路線情報の運行情報を登録する。値はlist[DelayLine]。"""
+        yahoo = YahooDelayClient(area=area, client=self.client, metrics=self.metrics)
+        self.add(name, yahoo.fetch, interval, rate_limit)
+        return yahoo
+
+    def add_ekispert_delay(
+            self,
+            api_key: str,
+            prefs: list[int] = [26,27,28],
+            interval: float = 120,
+            rate_limit: float = 60,
+            name: str = "ekispert_delay"
+            ) -> None:
+        """駅すぱあとの運行情報を登録する。値はlist[DelayLine]。"""
+        self.add(name, lambda: get_ekispert_delay(api_key, prefs, client=self.client, metrics=self.metrics), interval, rate_limit)
+
+    async def _run_source(self, source: Source) -> SourceState:
+        async with source.lock:
+            state = source.state
+            now = datetime.datetime.now(JST)
+            state.attempted_at = now
+            start = time.perf_counter()
+            try:
+                value = await source.fetch()
+            except Exception as e:
+                state.error = e
+                state.failures += 1
+            else:
+                state.value = value
+                state.error = None
+                state.failures = 0
+                state.updated_at = datetime.datetime.now(JST)
+            state.duration = time.perf_counter() - start
+            if self.metrics is not None:
+                self.metrics.observe(f"source.{source.name}", state.duration)
+                if state.error is not None:
+                    self.metrics.count(f"source.{source.name}.failures")
+            self.state.updated_at = datetime.datetime.now(JST)
+            # 1つのlistenerの失敗で、このソースや他のlistenerが止まらないようにする
+            for listener in self.listeners:
+                try:
+                    listener(state)
+                except Exception as e:
+                    warnings.warn(f"ソース {source.name} のlistener {listener!r} でエラーが発生しました: {e!r}", RuntimeWarning)
+            return state
+
+    async def refresh(self, names: Optional[Iterable[str]] = None, force: bool = True) -> OrchestratorState:
+        """
+        ソースを並行に1回ずつ取得する。所要時間は最も遅いソースの時間で決まる。
+        - names: 取得するソース名。省略時は全ソース
+        - force: Falseなら、取得時刻に達していないソースは飛ばす
+        """
+        now = datetime.datetime.now(JST)
+        targets = [self.sources[name] for name in (names if names is not None else self.sources)]
+        if not force:
+            targets = [source for source in targets if source.next_time() <= now]
+        await asyncio.gather(*(self._run_source(source) for source in targets))
+        return self.state
+
+    async def _loop(self, source: Source) -> None:
+        while True:
+            delay = (source.next_time() - datetime.datetime.now(JST)).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._run_source(source)
+            except Exception as e:
+                # 想定外のエラーでもこのソースのループは続ける（他のソースを止めない）
+                warnings.warn(f"ソース {source.name} の取得処理でエラーが発生しました: {e!r}", RuntimeWarning)
+                await asyncio.sleep(max(source.rate_limit, 1))
+
+    async def run(self) -> None:
+        """全ソースをそれぞれの間隔で取得し続ける。キャンセルされるまで終了しない。"""
+        tasks = [asyncio.create_task(self._loop(source)) for source in self.sources.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,170 @@
+"""
+上流APIの一時的な障害に耐えるための取得ユーティリティ。
+
+・RetryPolicy: ジッター付き指数バックオフによる再試行設定
+・CircuitBreaker: 連続して失敗したエンドポイントへのアクセスを一定時間止める
+・ResilientFetcher: エンドポイントごとのタイムアウト・再試行・サーキットブレーカーをまとめたもの
+"""
+
+from pydantic import BaseModel, Field
+from typing import Optional, Literal
+from httpx import AsyncClient, Response, HTTPStatusError, TransportError
+import asyncio
+import random
+import time
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため、リクエストを送らなかったことを表す例外。"""
+    def __init__(self, endpoint: str, retry_after: float) -> None:
+        super().__init__(f"{endpoint} はサーキットブレーカーにより停止中です（残り{retry_after:.1f}秒）")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class RetryPolicy(BaseModel):
+    """
+    再試行の設定。
+    - attempts: 最大試行回数（初回を含む）
+    - base_delay, max_delay: バックオフの基準・上限（秒）。n回目の待機は 0〜min(max_delay, base_delay*2**n) の一様乱数（フルジッター）
+    - retry_statuses: 再試行の対象とするHTTPステータス
+    """
+    attempts:       int   = 3
+    base_delay:     float = 0.5
+    max_delay:      float = 8.0
+    retry_statuses: set[int] = Field(default_factory=lambda: {429, 500, 502, 503, 504})
+
+    def backoff(self, attempt: int) -> float:
+        """attempt回目（0始まり）の失敗後に待機する秒数"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    連続failure_threshold回失敗すると開き、reset_timeout秒の間リクエストを遮断する。
+    時間経過後は半開状態となり、1回だけ試行を許可する。成功すれば閉じ、失敗すれば再び開く。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running: bool = False
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def retry_after(self) -> float:
+        """遮断が解除されるまでの秒数"""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """リクエストを送ってよいか。半開状態では同時に1件のみ許可する。"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """半開状態の試行を、成功・失敗を記録せずに終える（キャンセルされた場合など）。次の呼び出しで再び試行できる。"""
+        self._trial_running = False
+
+
+class ResilientFetcher:
+    """
+    エンドポイント名ごとにタイムアウト・サーキットブレーカーを持ち、再試行付きでリクエストを送る。
+    クライアントは呼び出し側が渡すため、KHTracker・バス・遅延情報のどれからでも利用できる。
+    - retry: 再試行の設定
+    - timeouts: エンドポイント名:タイムアウト秒。未指定のエンドポイントはdefault_timeoutを使う
+    - failure_threshold, reset_timeout: CircuitBreakerの設定
+    """
+    def __init__(
+            self,
+            retry: Optional[RetryPolicy] = None,
+            timeouts: Optional[dict[str, float]] = None,
+            default_timeout: float = 10,
+            failure_threshold: int = 5,
+            reset_timeout: float = 60,
+            ) -> None:
+        self.retry = retry or RetryPolicy()
+        self.timeouts: dict[str, float] = timeouts or {}
+        self.default_timeout = default_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[endpoint]
+
+    async def request(self, client: AsyncClient, method: str, endpoint: str, url: str, **kwargs) -> Response:
+        """
+        リクエストを送り、成功したレスポンスを返す。
+        再試行しても失敗した場合は最後の例外を送出し、ブレーカーが開いている場合はCircuitOpenErrorを送出する。
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(endpoint, breaker.retry_after)
+
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint, self.default_timeout))
+        # 成功しなかった場合は必ずブレーカーに記録する（半開状態の試行が残ったままにならないように）
+        try:
+            res = await self._attempts(client, method, url, **kwargs)
+        except asyncio.CancelledError:
+            breaker.release_trial()
+            raise
+        except BaseException:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return res
+
+    async def _attempts(self, client: AsyncClient, method: str, url: str, **kwargs) -> Response:
+        """再試行しながらリクエストを送る。再試行の対象外のエラー、または最後の試行のエラーはそのまま送出する"""
+        for attempt in range(self.retry.attempts):
+            wait = self.retry.backoff(attempt)
+            try:
+                res = await client.request(method, url, **kwargs)
+                res.raise_for_status()
+                return res
+            except HTTPStatusError as e:
+                if e.response.status_code not in self.retry.retry_statuses or attempt + 1 >= self.retry.attempts:
+                    raise
+                # Retry-Afterが秒数で指定されていれば従う
+                retry_after = e.response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    wait = min(float(retry_after), self.retry.max_delay)
+            except TransportError:
+                if attempt + 1 >= self.retry.attempts:
+                    raise
+            await asyncio.sleep(wait)
+        raise RuntimeError("unreachable")
+
+    async def get(self, client: AsyncClient, endpoint: str, url: str, **kwargs) -> Response:
+        return await self.request(client, "GET", endpoint, url, **kwargs)
+
+    async def post(self, client: AsyncClient, endpoint: str, url: str, **kwargs) -> Response:
+        return await self.request(client, "POST", endpoint, url, **kwargs)
@@ -11,8 +11,14 @@ INSTALL_REQUIRES = [
     "httpx",
     "tabulate",
     "beautifulsoup4",
-    "tzdata"
+    "tzdata",
+    "typing_extensions"
     ]
+EXTRAS_REQUIRE = {
+    "http2": ["httpx[http2]"],
+    "lxml": ["lxml"],
+    "numpy": ["numpy"],
+    }
 LICENSE = "MIT License"
 CLASSIFIERS = [
     "Programming Language :: Python :: 3",
@@ -42,6 +48,7 @@ setup(name=NAME,
       packages=find_packages(),
       python_requires=PYTHON_REQUIRES,
       install_requires=INSTALL_REQUIRES,
+      extras_require=EXTRAS_REQUIRE,
       license=LICENSE,
       classifiers=CLASSIFIERS,
       keywords=["keihan","train","parse","parsing","validation","tracking","position","京阪","鉄道","位置"],